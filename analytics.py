@@ -0,0 +1,235 @@
+"""
+Population health analytics over columnar snapshots of records
+
+Heights, weights, ages and codes for sex and class are pulled once into
+flat arrays, then BMI, categories, percentiles and per-class means are
+computed a whole column at a time. NumPy is used when installed; the
+pure-Python fallback gives the same results, only slower.
+"""
+import bisect
+import math
+from array import array
+import growth
+from db import get_connection, stream_cursor
+from utils import BMI_CATEGORIES, age_in_months
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Lower bounds of the Normal, Overweight and Obese BMI categories
+BMI_THRESHOLDS = (18.5, 25.0, 30.0)
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+def bmi_values(height, weight):
+    """BMI for paired height (cm) and weight (kg) columns; NaN where either is missing"""
+    if np is not None:
+        height_m = np.asarray(height, dtype=np.float64) / 100
+        weight = np.asarray(weight, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bmi = weight / (height_m * height_m)
+        bmi[~((height_m > 0) & (weight > 0))] = np.nan
+        return bmi
+    return [
+        w / ((h / 100) ** 2) if h > 0 and w > 0 else math.nan
+        for h, w in zip(height, weight)
+    ]
+
+def category_counts(bmi):
+    """Count BMI values per category, matching utils.calculate_bmi's cut-offs"""
+    if np is not None:
+        bmi = np.asarray(bmi, dtype=np.float64)
+        # Cumulative counts below each cut-off (NaN compares False), then differences
+        below = [np.count_nonzero(bmi < threshold) for threshold in BMI_THRESHOLDS]
+        below.append(np.count_nonzero(~np.isnan(bmi)))
+        counts = [int(high - low) for low, high in zip([0] + below, below)]
+    else:
+        counts = [0] * len(BMI_CATEGORIES)
+        for value in bmi:
+            if not math.isnan(value):
+                counts[bisect.bisect_right(BMI_THRESHOLDS, value)] += 1
+    return dict(zip(BMI_CATEGORIES, counts))
+
+def percentiles(values, qs=DEFAULT_PERCENTILES):
+    """Return {q: value} ignoring NaN (linear interpolation), or {} if no values"""
+    if np is not None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return {}
+        return dict(zip(qs, np.percentile(values, qs).tolist()))
+    
+    values = sorted(value for value in values if not math.isnan(value))
+    if not values:
+        return {}
+    result = {}
+    for q in qs:
+        position = (len(values) - 1) * q / 100
+        low = math.floor(position)
+        high = min(low + 1, len(values) - 1)
+        result[q] = values[low] + (values[high] - values[low]) * (position - low)
+    return result
+
+def group_means(codes, labels, values):
+    """Return {label: mean of values} for integer group `codes`, ignoring NaN"""
+    if np is not None:
+        codes = np.asarray(codes, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.bincount(codes[valid], weights=values[valid], minlength=len(labels))
+        counts = np.bincount(codes[valid], minlength=len(labels))
+        return {
+            label: float(total / count)
+            for label, total, count in zip(labels, sums.tolist(), counts.tolist()) if count
+        }
+    
+    sums = [0.0] * len(labels)
+    counts = [0] * len(labels)
+    for code, value in zip(codes, values):
+        if not math.isnan(value):
+            sums[code] += value
+            counts[code] += 1
+    return {label: total / count for label, total, count in zip(labels, sums, counts) if count}
+
+class HealthColumns:
+    """Columnar snapshot of the records fields used for population analytics
+    
+    Numeric columns are typed arrays (NaN marks a missing height or
+    weight); sex and class are stored as integer codes into `sexes` and
+    `classes`. With NumPy, column() views the arrays without copying.
+    """
+    
+    def __init__(self):
+        self.admin_no = array('q')
+        self.age = array('d')
+        self.age_months = array('q')
+        self.height = array('d')
+        self.weight = array('d')
+        self.sex_code = array('q')
+        self.class_code = array('q')
+        self.sexes = []
+        self.classes = []
+        self._bmi = None
+    
+    def __len__(self):
+        return len(self.admin_no)
+    
+    @classmethod
+    def load(cls, batch_size=10000, on=None):
+        """Stream the needed records columns into a new snapshot, with ages in months on `on`"""
+        columns = cls()
+        sex_codes, class_codes = {}, {}
+        with get_connection() as conn:
+            cr = stream_cursor(conn)
+            try:
+                cr.execute("SELECT AdminNo, Sex, Age, ClassSec, Height, Weight, DoB FROM records")
+                while True:
+                    rows = cr.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for admin_no, sex, age, class_sec, height, weight, dob in rows:
+                        columns.append(
+                            admin_no, sex, age, class_sec, height, weight,
+                            age_in_months(dob, on), sex_codes, class_codes
+                        )
+            finally:
+                cr.close()
+        return columns
+    
+    def append(self, admin_no, sex, age, class_sec, height, weight, age_months, sex_codes, class_codes):
+        """Add one student; `sex_codes`/`class_codes` map labels to codes"""
+        if sex not in sex_codes:
+            sex_codes[sex] = len(self.sexes)
+            self.sexes.append(sex)
+        if class_sec not in class_codes:
+            class_codes[class_sec] = len(self.classes)
+            self.classes.append(class_sec)
+        self.admin_no.append(admin_no)
+        self.age.append(age)
+        self.age_months.append(age_months)
+        self.height.append(math.nan if height is None else height)
+        self.weight.append(math.nan if weight is None else weight)
+        self.sex_code.append(sex_codes[sex])
+        self.class_code.append(class_codes[class_sec])
+        self._bmi = None
+    
+    def column(self, name):
+        """Return a column as a NumPy array (zero-copy) or the raw typed array"""
+        values = getattr(self, name)
+        if np is not None:
+            return np.frombuffer(values, dtype=np.float64 if values.typecode == 'd' else np.int64)
+        return values
+    
+    def bmi(self):
+        """BMI per student, computed once per snapshot"""
+        if self._bmi is None:
+            self._bmi = bmi_values(self.column('height'), self.column('weight'))
+        return self._bmi
+    
+    def summary(self, qs=DEFAULT_PERCENTILES):
+        """Adult BMI categories and BMI percentiles, plus per-class means of BMI, height and weight
+        
+        'adult_bmi' uses the adult cut-offs for everyone, like
+        bmi_distribution(); growth_screening() categorizes under-19s.
+        """
+        bmi = self.bmi()
+        codes = self.column('class_code')
+        means = {
+            name: group_means(codes, self.classes, values)
+            for name, values in (('bmi', bmi), ('height', self.column('height')), ('weight', self.column('weight')))
+        }
+        categories = category_counts(bmi)
+        return {
+            'students': len(self),
+            'measured': sum(categories.values()),
+            'adult_bmi': categories,
+            'bmi_percentiles': {q: round(value, 2) for q, value in percentiles(bmi, qs).items()},
+            'class_means': {
+                class_sec: {name: round(means[name][class_sec], 2) for name in means if class_sec in means[name]}
+                for class_sec in sorted(self.classes)
+            }
+        }
+    
+    def growth_screening(self, reference=None, threshold=2.0):
+        """Score everyone against a BMI-for-age reference and flag |z| >= threshold
+        
+        Returns 'assessed' (students the reference covers), 'categories'
+        (WHO BMI-for-age counts) and 'at_risk': (admin_no, class_sec, z,
+        percentile) tuples, most extreme first. Raises ValueError if no
+        reference is given or configured (GROWTH_REFERENCE_PATH).
+        """
+        reference = reference or growth.get_growth_reference()
+        if reference is None:
+            raise ValueError("No BMI-for-age reference configured (set GROWTH_REFERENCE_PATH)")
+        z = reference.zscores(self.bmi(), self.column('sex_code'), self.sexes, self.column('age_months'))
+        categories = growth.category_counts(z)
+        if np is not None:
+            flagged = np.flatnonzero(np.abs(z) >= threshold)
+            flagged = flagged[np.argsort(-np.abs(z[flagged]), kind='stable')]
+            columns = (
+                self.column('admin_no')[flagged].tolist(),
+                self.column('class_code')[flagged].tolist(),
+                np.round(z[flagged], 2).tolist(),
+                np.round(growth.percentiles_of(z[flagged]), 1).tolist()
+            )
+        else:
+            flagged = sorted(
+                (i for i, value in enumerate(z) if abs(value) >= threshold),
+                key=lambda i: -abs(z[i])
+            )
+            columns = (
+                [self.admin_no[i] for i in flagged],
+                [self.class_code[i] for i in flagged],
+                [round(z[i], 2) for i in flagged],
+                [round(growth.percentile(z[i]), 1) for i in flagged]
+            )
+        return {
+            'assessed': sum(categories.values()),
+            'categories': categories,
+            'at_risk': [
+                (admin_no, self.classes[code], score, pct)
+                for admin_no, code, score, pct in zip(*columns)
+            ]
+        }
@@ -0,0 +1,299 @@
+"""
+Asynchronous, batched audit-log writer
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import secrets
+import threading
+from datetime import datetime
+import db
+from db import get_connection
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+AUDIT_CONFIG = {
+    'batch_size': int(os.getenv('AUDIT_BATCH_SIZE', '100')),
+    'flush_interval': float(os.getenv('AUDIT_FLUSH_INTERVAL', '2')),
+    'spool_path': os.getenv('AUDIT_SPOOL_PATH', 'logs/audit_spool.jsonl'),
+    'fsync': os.getenv('AUDIT_SPOOL_FSYNC', 'false').lower() in ('1', 'true', 'yes')
+}
+
+INSERT_AUDIT = """
+    INSERT INTO audit_log
+    (AdminID, TargetAdminNo, ActionType, ChangedFields, OldValues, NewValues, IPAddress, CreatedAt)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+def make_event(admin_id, action_type, target_admin_no=None, changed_fields=None, old_values=None, new_values=None, ip_address=None):
+    """Build the audit_log row for an action, timestamped now"""
+    return [
+        admin_id,
+        target_admin_no,
+        action_type,
+        json.dumps(changed_fields) if changed_fields else None,
+        json.dumps(old_values, default=str) if old_values else None,
+        json.dumps(new_values, default=str) if new_values else None,
+        ip_address,
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ]
+
+def lock_file(path):
+    """Open `path` holding an exclusive lock; returns the open file, or None if another writer has it
+    
+    The lock lasts until the file is closed or the process exits.
+    """
+    f = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+class AuditWriter:
+    """Queue audit events in memory and write them to audit_log in batches
+    
+    Every event is appended to a local spool file before it is queued, so
+    events that were not yet written survive a crash and are replayed on
+    the next start. Delivery is at-least-once: a crash between the INSERT
+    committing and the spool being cleared can replay a batch.
+    
+    Each spool is locked by one writer (see lock_file). When another
+    process holds `spool_path`, this writer spools to a private
+    `<name>.<pid>.<random><ext>` file instead, and every writer recovers
+    such files left behind by writers that have died.
+    """
+    
+    def __init__(self, spool_path, batch_size=100, flush_interval=2.0, fsync=False):
+        self.base_path = spool_path
+        self.spool_path = spool_path
+        self.inflight_path = spool_path + '.inflight'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._pending = []
+        self._retry = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+        self._spool = None
+        self._lock = None
+    
+    def start(self):
+        """Lock a spool, replay any spooled events and start the background flusher"""
+        spool_dir = os.path.dirname(self.spool_path)
+        if spool_dir and not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+        
+        self._lock = lock_file(self.base_path + '.lock')
+        if self._lock is None:
+            root, ext = os.path.splitext(self.base_path)
+            self.spool_path = f"{root}.{os.getpid()}.{secrets.token_hex(4)}{ext}"
+            self.inflight_path = self.spool_path + '.inflight'
+            self._lock = lock_file(self.spool_path + '.lock')
+            logger.info(f"Audit spool {self.base_path} is in use by another process; spooling to {self.spool_path}")
+        
+        orphans, orphaned = self._sweep_orphans()
+        self._retry = self._read_spool(self.inflight_path) + self._read_spool(self.spool_path) + orphaned
+        if self._retry:
+            logger.info(f"Recovered {len(self._retry)} spooled audit events")
+            # Keep recovered events in the inflight file until they are written
+            self._write_spool(self.inflight_path, self._retry)
+            if os.path.exists(self.spool_path):
+                os.remove(self.spool_path)
+        self._remove_orphans(orphans)
+        
+        self._spool = open(self.spool_path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+        return self
+    
+    def log(self, event):
+        """Queue one event (an audit_log row from make_event)"""
+        self.log_many([event])
+    
+    def log_many(self, events):
+        """Queue several events with a single spool write"""
+        if not events:
+            return
+        lines = ''.join(json.dumps(event) + '\n' for event in events)
+        with self._cond:
+            self._spool.write(lines)
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._pending.extend(events)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+    
+    def flush(self):
+        """Write every queued event now; returns False if the write failed"""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._retry + self._pending
+                self._pending = []
+                if not batch:
+                    return True
+                self._rotate_spool()
+            
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Pool timeouts and connect errors are not DatabaseErrors, and the
+                # inflight spool is the only other copy of the batch
+                logger.error(f"Error writing audit batch, will retry: {e}")
+                self._retry = batch
+                return False
+            
+            self._retry = []
+            os.remove(self.inflight_path)
+            logger.debug(f"Audit batch written: {len(batch)} events")
+            return True
+    
+    def close(self):
+        """Stop the flusher thread after a final flush"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        flushed = self.flush()
+        with self._cond:
+            self._spool.close()
+        if flushed and self.spool_path != self.base_path:
+            # A private spool that is fully written is not needed again
+            for path in (self.spool_path, self.spool_path + '.lock'):
+                os.remove(path)
+        self._lock.close()
+    
+    def _sweep_orphans(self):
+        """Lock the private spools of writers that died; returns ({path: lock}, their events)"""
+        root, ext = os.path.splitext(self.base_path)
+        pattern = f"{glob.escape(root)}.*{ext}"
+        paths = set(glob.glob(pattern)) | {path[:-len('.inflight')] for path in glob.glob(pattern + '.inflight')}
+        orphans, events = {}, []
+        for path in sorted(paths - {self.spool_path}):
+            lock = lock_file(path + '.lock')
+            if lock is None:
+                continue  # its writer is still running
+            orphans[path] = lock
+            events += self._read_spool(path + '.inflight') + self._read_spool(path)
+        if events:
+            logger.info(f"Recovered {len(events)} audit events from {len(orphans)} orphaned spools")
+        return orphans, events
+    
+    @staticmethod
+    def _remove_orphans(orphans):
+        """Delete swept spools once their events are safe in this writer's inflight file"""
+        for path, lock in orphans.items():
+            for stale in (path + '.inflight', path, path + '.lock'):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            lock.close()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval
+                )
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep the flusher alive; the batch stays queued for the next pass
+                logger.error(f"Audit flusher error: {e}")
+    
+    def _rotate_spool(self):
+        """Move the active spool into the inflight file (caller holds _cond)"""
+        self._spool.close()
+        if os.path.exists(self.inflight_path):
+            # A previous batch failed; its events are already inflight
+            with open(self.spool_path, 'r', encoding='utf-8') as active, \
+                    open(self.inflight_path, 'a', encoding='utf-8') as inflight:
+                inflight.write(active.read())
+            os.remove(self.spool_path)
+        else:
+            os.replace(self.spool_path, self.inflight_path)
+        self._spool = open(self.spool_path, 'a', encoding='utf-8')
+    
+    def _write_batch(self, batch):
+        with get_connection() as conn:
+            cr = conn.cursor()
+            try:
+                # PyMySQL rewrites executemany INSERTs into multi-row statements
+                cr.executemany(INSERT_AUDIT, batch)
+                conn.commit()
+            except db.IntegrityError:
+                # One bad row (e.g. unknown AdminID) must not block the rest
+                conn.rollback()
+                for event in batch:
+                    try:
+                        cr.execute(INSERT_AUDIT, event)
+                    except db.IntegrityError as e:
+                        logger.error(f"Dropping invalid audit event {event}: {e}")
+                conn.commit()
+            cr.close()
+    
+    @staticmethod
+    def _read_spool(path):
+        if not os.path.exists(path):
+            return []
+        events = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    logger.warning(f"Skipping corrupt audit spool line in {path}")
+        return events
+    
+    @staticmethod
+    def _write_spool(path, events):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(event) + '\n' for event in events)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_audit_writer():
+    """Return the process-wide audit writer, starting it on first use"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(**AUDIT_CONFIG).start()
+    return _writer
+
+def flush():
+    """Write all queued audit events; call on shutdown"""
+    if _writer is not None:
+        return _writer.flush()
+    return True
+
+def shutdown():
+    """Flush and stop the audit writer"""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+atexit.register(shutdown)
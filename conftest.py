@@ -0,0 +1,71 @@
+"""
+Shared test fixtures: an isolated SQLite database per test and a
+synthetic BMI-for-age reference
+
+Test modules seed their own students on top of sqlite_db.
+"""
+import pytest
+
+import audit
+import db
+import growth
+from growth import GrowthReference
+from models import RECORD_CACHE, NAME_INDEX, SESSIONS
+
+# Made-up LMS knots shaped like a BMI-for-age curve, for tests only (not
+# clinical data). Rows are (age in months, L, M, S).
+TEST_KNOTS = {
+    'M': [
+        (61, -0.7387, 15.2641, 0.0839), (72, -0.80, 15.30, 0.0850), (84, -0.95, 15.50, 0.0890),
+        (96, -1.10, 15.80, 0.0950), (108, -1.25, 16.10, 0.1010), (120, -1.40, 16.50, 0.1080),
+        (132, -1.50, 17.00, 0.1140), (144, -1.55, 17.60, 0.1190), (156, -1.55, 18.30, 0.1220),
+        (168, -1.50, 19.00, 0.1230), (180, -1.40, 19.80, 0.1230), (192, -1.30, 20.50, 0.1220),
+        (204, -1.20, 21.10, 0.1210), (216, -1.10, 21.70, 0.1200), (228, -1.00, 22.20, 0.1190),
+    ],
+    'F': [
+        (61, -0.8886, 15.2441, 0.0969), (72, -0.95, 15.30, 0.0990), (84, -1.05, 15.40, 0.1040),
+        (96, -1.15, 15.70, 0.1100), (108, -1.20, 16.10, 0.1170), (120, -1.25, 16.60, 0.1230),
+        (132, -1.25, 17.20, 0.1290), (144, -1.20, 18.00, 0.1330), (156, -1.15, 18.80, 0.1350),
+        (168, -1.10, 19.60, 0.1350), (180, -1.05, 20.20, 0.1350), (192, -1.00, 20.70, 0.1340),
+        (204, -0.95, 21.00, 0.1340), (216, -0.90, 21.30, 0.1340), (228, -0.85, 21.40, 0.1340),
+    ],
+}
+
+
+@pytest.fixture
+def growth_reference(monkeypatch):
+    """Install a reference built from TEST_KNOTS as the process-wide one; returns it"""
+    reference = GrowthReference.from_knots(TEST_KNOTS)
+    monkeypatch.setattr(growth, '_reference', reference)
+    return reference
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """Point the app at an empty SQLite file in tmp_path (no tables yet); yields tmp_path"""
+    previous = db.BACKEND
+    monkeypatch.setitem(db.SCHEMA_CACHE, 'path', str(tmp_path / '.schema_cache'))
+    monkeypatch.setitem(audit.AUDIT_CONFIG, 'spool_path', str(tmp_path / 'audit_spool.jsonl'))
+    db.set_backend(db.SQLiteBackend(tmp_path / 'medrep.db'))
+    yield tmp_path
+    audit.shutdown()
+    db.set_backend(previous)
+
+
+@pytest.fixture
+def sqlite_db(sqlite_backend):
+    """Create the tables, empty the caches and add one admin; yields their session token"""
+    db.create_tables()
+    RECORD_CACHE.clear()
+    NAME_INDEX.invalidate()
+    SESSIONS.invalidate()
+    with db.get_connection() as conn:
+        cr = conn.cursor()
+        cr.execute(
+            "INSERT INTO admins (Username, PasswordHash, Role) VALUES (%s, %s, %s)",
+            ('nurse', 'not-a-hash', 'Admin')
+        )
+        admin_id = cr.lastrowid
+        conn.commit()
+        cr.close()
+    yield SESSIONS.issue(admin_id)
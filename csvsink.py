@@ -0,0 +1,125 @@
+"""
+CSV sinks for streaming exports: plain, gzip or zstd files or stdout
+
+Standalone (standard library plus the optional zstandard package), so
+scripts with their own database code can stream CSV without importing
+the application modules.
+"""
+import csv
+import gzip
+import io
+import logging
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Compression name -> file suffix; compression is inferred from the suffix
+COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+def compression_for(target):
+    """Compression implied by a target's suffix ('none' for stdout or no suffix)"""
+    for name, suffix in COMPRESSIONS.items():
+        if suffix and target not in (None, '-') and str(target).endswith(suffix):
+            return name
+    return 'none'
+
+@contextmanager
+def open_sink(target=None, compression=None):
+    """Open a text stream for CSV output to a path, or to stdout for None/'-'
+    
+    `compression` is 'none', 'gzip' or 'zstd' (zstd needs the zstandard
+    package); by default it follows the target's suffix.
+    """
+    compression = compression or compression_for(target)
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression} ({', '.join(COMPRESSIONS)})")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs the 'zstandard' package (pip install zstandard)")
+    
+    with ExitStack() as stack:
+        if target in (None, '-'):
+            raw = sys.stdout.buffer
+        else:
+            raw = stack.enter_context(open(target, 'wb'))
+        if compression == 'gzip':
+            raw = stack.enter_context(gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=GZIP_LEVEL))
+        elif compression == 'zstd':
+            raw = stack.enter_context(
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)
+            )
+        sink = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        try:
+            yield sink
+            sink.flush()
+        finally:
+            # Leave closing the underlying streams (never stdout) to the stack
+            sink.detach()
+
+class Progress:
+    """Count exported rows and report the rate every `every` rows
+    
+    `report` is called with (rows, seconds, rows per second); by default
+    the progress is logged.
+    """
+    
+    def __init__(self, every=10000, report=None):
+        self.every = every
+        self.report = report or self.log
+        self.rows = 0
+        self.started = time.monotonic()
+        self._next = every
+    
+    @staticmethod
+    def log(rows, seconds, rate):
+        """Default report: log the progress"""
+        logger.info(f"Exported {rows} rows in {seconds:.1f}s ({rate:.0f} rows/s)")
+    
+    def elapsed(self):
+        """Seconds since the export started"""
+        return time.monotonic() - self.started
+    
+    def rate(self):
+        """Rows per second so far"""
+        elapsed = self.elapsed()
+        return self.rows / elapsed if elapsed else 0.0
+    
+    def update(self, rows):
+        """Add `rows` exported rows, reporting when another `every` have passed"""
+        self.rows += rows
+        if self.rows >= self._next:
+            self._next = (self.rows // self.every + 1) * self.every
+            self.report(self.rows, self.elapsed(), self.rate())
+    
+    def finish(self):
+        """Report the final totals; returns {'rows', 'seconds', 'rows_per_sec'}"""
+        self.report(self.rows, self.elapsed(), self.rate())
+        return {'rows': self.rows, 'seconds': round(self.elapsed(), 3), 'rows_per_sec': round(self.rate(), 1)}
+
+def cursor_batches(cr, batch_size=1000):
+    """Yield lists of rows from an executed cursor until it is exhausted"""
+    while True:
+        rows = cr.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+def export_rows(batches, header, target=None, compression=None, progress=None):
+    """Write `header` and every batch of rows as CSV to a sink; returns Progress.finish()"""
+    progress = progress or Progress()
+    with open_sink(target, compression) as sink:
+        writer = csv.writer(sink)
+        writer.writerow(header)
+        for batch in batches:
+            writer.writerows(batch)
+            progress.update(len(batch))
+    return progress.finish()
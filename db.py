@@ -1,9 +1,17 @@
 """
 Database connection and schema management
 """
-import pymysql as sql
+import hashlib
 import logging
 import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
@@ -11,6 +19,10 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# PyMySQL (and the ssl stack it pulls in) is imported by load_pymysql()
+# when the first MySQL connection is opened, not at startup
+pymysql = None
+
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
     'user': os.getenv('DB_USER', 'root'),
@@ -18,154 +30,634 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'MedRep')
 }
 
+POOL_CONFIG = {
+    'size': int(os.getenv('DB_POOL_SIZE', '5')),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    'idle_timeout': float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300')),
+    'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+    'ping': os.getenv('DB_POOL_PING', 'true').lower() in ('1', 'true', 'yes')
+}
+
+SCHEMA_CACHE = {
+    'path': os.getenv('SCHEMA_CACHE_PATH', '.schema_cache'),
+    'fast_path': os.getenv('SCHEMA_FAST_PATH', 'true').lower() in ('1', 'true', 'yes')
+}
+
+# Exception types raised by any backend, usable directly in `except` clauses.
+# load_pymysql() rebinds them, so other modules must use db.DatabaseError
+# rather than a from-import
+DatabaseError = (sqlite3.Error,)
+IntegrityError = (sqlite3.IntegrityError,)
+OperationalError = (sqlite3.OperationalError,)
+
+def load_pymysql():
+    """Import PyMySQL on first use and add its errors to the exception tuples"""
+    global pymysql, DatabaseError, IntegrityError, OperationalError
+    if pymysql is None:
+        try:
+            import pymysql as module
+        except ImportError:
+            raise RuntimeError("PyMySQL is required for DB_ENGINE=mysql (pip install PyMySQL)")
+        DatabaseError = (sqlite3.Error, module.Error)
+        IntegrityError = (sqlite3.IntegrityError, module.IntegrityError)
+        OperationalError = (sqlite3.OperationalError, module.OperationalError)
+        pymysql = module
+    return pymysql
+
+class MySQLBackend:
+    """MySQL storage via PyMySQL"""
+    
+    name = 'mysql'
+    
+    # Appended to a SELECT to lock the rows it reads until commit
+    row_lock = 'FOR UPDATE'
+    
+    def __init__(self, config):
+        self.config = config
+    
+    def connect(self):
+        """Open a new server connection"""
+        return load_pymysql().connect(**self.config)
+    
+    def ping(self, conn):
+        """Raise if the connection is no longer usable"""
+        conn.ping(reconnect=False)
+    
+    def stream_cursor(self, conn):
+        """Return an unbuffered cursor that reads rows as they are fetched"""
+        return conn.cursor(pymysql.cursors.SSCursor)
+    
+    def upsert_sql(self, table, columns, key_columns, increment=()):
+        """INSERT that updates the non-key columns when the key exists"""
+        updates = ', '.join(
+            f"{column} = {column} + VALUES({column})" if column in increment else f"{column} = VALUES({column})"
+            for column in columns if column not in key_columns
+        )
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {updates}"
+        )
+    
+    def update_returning(self, cr, table, assignments, column, expr, where, params):
+        """Run one UPDATE and return the new value of `column` (None if no row matched)
+        
+        The value travels back in the OK packet via LAST_INSERT_ID(expr),
+        so this stays a single statement with no follow-up SELECT.
+        """
+        cr.execute(
+            f"UPDATE {table} SET {assignments}, {column} = LAST_INSERT_ID({expr}) WHERE {where}",
+            params
+        )
+        return cr.lastrowid if cr.rowcount else None
+    
+    def begin_snapshot(self, cr):
+        """Start a read-only transaction whose reads all see one point in time"""
+        cr.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+    
+    def period_sql(self, column, fmt):
+        """SQL formatting a DATETIME column with a strftime-style `fmt`"""
+        return f"DATE_FORMAT({column}, '{fmt.replace('%', '%%')}')"
+    
+    def translate_ddl(self, statement):
+        """Return the statements that implement `statement` on this backend"""
+        return [statement]
+
+# MySQL-only column syntax and its SQLite equivalent
+_SQLITE_NOW = "datetime('now', 'localtime')"
+_AUTO_INCREMENT_RE = re.compile(r'\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b', re.IGNORECASE)
+_ENUM_RE = re.compile(r'(\w+)\s+ENUM\s*\(([^)]*)\)', re.IGNORECASE)
+_JSON_RE = re.compile(r'\bJSON\b', re.IGNORECASE)
+_ON_UPDATE_RE = re.compile(r'(\w+)\s+DATETIME\b([^,\n]*?)\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP', re.IGNORECASE)
+_DEFAULT_NOW_RE = re.compile(r'DEFAULT\s+CURRENT_TIMESTAMP\b', re.IGNORECASE)
+_TABLE_NAME_RE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+_NOW_RE = re.compile(r'\bNOW\(\)', re.IGNORECASE)
+
+@lru_cache(maxsize=256)
+def _translate_query(query, has_params):
+    """Rewrite a PyMySQL-style query for sqlite3"""
+    query = _NOW_RE.sub(_SQLITE_NOW, query)
+    if has_params:
+        # PyMySQL only interpolates (and un-escapes %%) when params are given
+        query = query.replace('%s', '?').replace('%%', '%')
+    return query
+
+def _convert_date(value):
+    try:
+        return date.fromisoformat(value.decode())
+    except ValueError:
+        return value.decode()
+
+def _convert_datetime(value):
+    try:
+        return datetime.fromisoformat(value.decode())
+    except ValueError:
+        return value.decode()
+
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', _convert_date)
+sqlite3.register_converter('DATETIME', _convert_datetime)
+
+class SQLiteCursor:
+    """sqlite3 cursor that accepts the %s-style queries used with PyMySQL"""
+    
+    def __init__(self, cursor):
+        self._cursor = cursor
+    
+    def execute(self, query, params=None):
+        if params is None:
+            return self._cursor.execute(_translate_query(query, False))
+        return self._cursor.execute(_translate_query(query, True), tuple(params))
+    
+    def executemany(self, query, seq_of_params):
+        return self._cursor.executemany(_translate_query(query, True), seq_of_params)
+    
+    def fetchone(self):
+        return self._cursor.fetchone()
+    
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+    
+    def fetchall(self):
+        return self._cursor.fetchall()
+    
+    def close(self):
+        self._cursor.close()
+    
+    def __iter__(self):
+        return iter(self._cursor)
+    
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+    
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+    
+    @property
+    def description(self):
+        return self._cursor.description
+
+class SQLiteConnection:
+    """Wrap an sqlite3 connection with the subset of the PyMySQL API we use"""
+    
+    def __init__(self, conn):
+        self._conn = conn
+    
+    def cursor(self):
+        return SQLiteCursor(self._conn.cursor())
+    
+    def commit(self):
+        self._conn.commit()
+    
+    def rollback(self):
+        self._conn.rollback()
+    
+    def close(self):
+        self._conn.close()
+    
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+class SQLiteBackend:
+    """Embedded SQLite storage for single-school deployments and tests"""
+    
+    name = 'sqlite'
+    
+    # Writers are serialized by the database lock; no row locks exist
+    row_lock = ''
+    
+    def __init__(self, path, timeout=30):
+        self.path = str(path)
+        self.timeout = timeout
+    
+    def connect(self):
+        """Open the database file in WAL mode"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False  # the pool hands connections between threads
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return SQLiteConnection(conn)
+    
+    def ping(self, conn):
+        """Raise if the connection is no longer usable"""
+        conn.ping()
+    
+    def stream_cursor(self, conn):
+        """Return a cursor for incremental reads (sqlite3 steps rows lazily)"""
+        return conn.cursor()
+    
+    def upsert_sql(self, table, columns, key_columns, increment=()):
+        """INSERT that updates the non-key columns when the key exists"""
+        updates = ', '.join(
+            f"{column} = {column} + excluded.{column}" if column in increment else f"{column} = excluded.{column}"
+            for column in columns if column not in key_columns
+        )
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+        )
+    
+    def update_returning(self, cr, table, assignments, column, expr, where, params):
+        """Run one UPDATE and return the new value of `column` (None if no row matched)"""
+        cr.execute(
+            f"UPDATE {table} SET {assignments}, {column} = {expr} WHERE {where} RETURNING {column}",
+            params
+        )
+        rows = cr.fetchall()
+        return rows[0][0] if rows else None
+    
+    def begin_snapshot(self, cr):
+        """Start a read transaction; in WAL mode its first read fixes the snapshot"""
+        cr.execute("BEGIN")
+    
+    def period_sql(self, column, fmt):
+        """SQL formatting a DATETIME column with a strftime-style `fmt`"""
+        return f"strftime('{fmt.replace('%', '%%')}', {column})"
+    
+    def translate_ddl(self, statement):
+        """Rewrite MySQL DDL, emulating ON UPDATE columns with triggers"""
+        match = _TABLE_NAME_RE.search(statement)
+        table = match.group(1) if match else None
+        
+        on_update_columns = [m.group(1) for m in _ON_UPDATE_RE.finditer(statement)]
+        statement = _ON_UPDATE_RE.sub(lambda m: f"{m.group(1)} DATETIME{m.group(2)}", statement)
+        statement = _AUTO_INCREMENT_RE.sub('INTEGER PRIMARY KEY AUTOINCREMENT', statement)
+        statement = _ENUM_RE.sub(
+            lambda m: f"{m.group(1)} TEXT CHECK ({m.group(1)} COLLATE NOCASE IN ({m.group(2)}))",
+            statement
+        )
+        statement = _JSON_RE.sub('TEXT', statement)
+        statement = _DEFAULT_NOW_RE.sub(f"DEFAULT ({_SQLITE_NOW})", statement)
+        
+        statements = [statement]
+        for column in on_update_columns:
+            statements.append(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{column}_on_update
+                AFTER UPDATE ON {table} FOR EACH ROW WHEN NEW.{column} IS OLD.{column}
+                BEGIN
+                    UPDATE {table} SET {column} = {_SQLITE_NOW} WHERE rowid = NEW.rowid;
+                END
+            """)
+        return statements
+
+def backend_from_env():
+    """Build the storage backend selected by DB_ENGINE"""
+    engine = os.getenv('DB_ENGINE', 'mysql').lower()
+    if engine == 'mysql':
+        return MySQLBackend(DB_CONFIG)
+    if engine == 'sqlite':
+        return SQLiteBackend(os.getenv('DB_PATH', f"{DB_CONFIG['database']}.db"))
+    raise ValueError(f"Unsupported DB_ENGINE: {engine}")
+
+BACKEND = backend_from_env()
+
 def create_connection():
     """Create and return database connection"""
     try:
-        conn = sql.connect(**DB_CONFIG)
+        conn = BACKEND.connect()
         return conn
-    except sql.Error as e:
+    except DatabaseError as e:
         logger.error(f"Database connection error: {e}")
         raise
 
+class ConnectionPool:
+    """Bounded, thread-safe pool of database connections"""
+    
+    def __init__(self, size=5, timeout=10, idle_timeout=300, max_lifetime=3600, ping=True):
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping = ping
+        # Idle connections as (conn, created_at, last_used) tuples
+        self._idle = queue.LifoQueue()
+        # One slot per connection that may exist, idle or checked out
+        self._slots = threading.BoundedSemaphore(size)
+    
+    def _is_usable(self, conn, created_at, last_used):
+        """Check whether an idle connection can be handed out again"""
+        now = time.monotonic()
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if self.idle_timeout and now - last_used > self.idle_timeout:
+            return False
+        if self.ping:
+            try:
+                BACKEND.ping(conn)
+            except DatabaseError:
+                return False
+        return True
+    
+    def _discard(self, conn):
+        """Close a connection without raising"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def acquire(self):
+        """Check out a connection, opening a new one if none is idle"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Timed out waiting for a database connection")
+        try:
+            while True:
+                try:
+                    conn, created_at, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return create_connection(), time.monotonic()
+                if self._is_usable(conn, created_at, last_used):
+                    return conn, created_at
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+    
+    def release(self, conn, created_at, broken=False):
+        """Return a checked-out connection to the pool"""
+        try:
+            if broken:
+                self._discard(conn)
+                return
+            try:
+                # End any open transaction so the next user starts clean
+                conn.rollback()
+            except DatabaseError:
+                self._discard(conn)
+                return
+            self._idle.put((conn, created_at, time.monotonic()))
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and back in"""
+        conn, created_at = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except OperationalError:
+            broken = True
+            raise
+        finally:
+            self.release(conn, created_at, broken)
+    
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(**POOL_CONFIG)
+    return _pool
+
+def get_connection():
+    """Check out a pooled connection: `with get_connection() as conn: ...`"""
+    return get_pool().connection()
+
+def stream_cursor(conn):
+    """Return a cursor on `conn` that streams rows instead of buffering them"""
+    return BACKEND.stream_cursor(conn)
+
+def upsert_sql(table, columns, key_columns, increment=()):
+    """Return an insert-or-update statement for the current backend
+    
+    Existing rows take the new values, except that columns listed in
+    `increment` have the new value added to them.
+    """
+    return BACKEND.upsert_sql(table, columns, key_columns, increment)
+
+def update_returning(cr, table, assignments, column, expr, where, params):
+    """Atomically update a row and read back one column's new value
+    
+    `column` is assigned last; `params` follow the SQL order
+    (assignments, expr, where).
+    """
+    return BACKEND.update_returning(cr, table, assignments, column, expr, where, params)
+
+def begin_snapshot(cr):
+    """Open a consistent-read transaction on `cr`'s connection
+    
+    Every query until commit/rollback (the pool rolls back on release)
+    sees the same committed state.
+    """
+    BACKEND.begin_snapshot(cr)
+
+# strftime formats for the time buckets period_sql() supports
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+def period_sql(column, bucket):
+    """SQL expression labelling `column` with its 'day', 'month' or 'year'
+    
+    The result is for queries run with parameters (its % signs are escaped).
+    """
+    if bucket not in PERIOD_FORMATS:
+        raise ValueError(f"Unknown period: {bucket} ({', '.join(PERIOD_FORMATS)})")
+    return BACKEND.period_sql(column, PERIOD_FORMATS[bucket])
+
+def set_backend(backend):
+    """Switch the storage backend, discarding pooled connections"""
+    global BACKEND, _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        BACKEND = backend
+        _pool = None
+
+# Base schema, applied in order by create_tables()
+SCHEMA = [
+    # Admins table with role-based auth
+    """
+    CREATE TABLE IF NOT EXISTS admins (
+        AdminID INT AUTO_INCREMENT PRIMARY KEY,
+        Username VARCHAR(50) UNIQUE NOT NULL,
+        PasswordHash VARCHAR(255) NOT NULL,
+        FullName VARCHAR(100),
+        Email VARCHAR(100),
+        Role ENUM('SuperAdmin', 'Admin', 'Viewer') DEFAULT 'Admin',
+        IsActive BOOLEAN DEFAULT TRUE,
+        LoginAttempts INT DEFAULT 0,
+        LockedUntil DATETIME,
+        LastLogin DATETIME,
+        CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """,
+    
+    # Users table
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        AdminNo INT PRIMARY KEY,
+        Sname VARCHAR(25) NOT NULL
+    )
+    """,
+    
+    # Records table with constraints
+    """
+    CREATE TABLE IF NOT EXISTS records (
+        AdminNo INT PRIMARY KEY,
+        Sname VARCHAR(25) NOT NULL,
+        Sex ENUM('M', 'F', 'Other') NOT NULL,
+        Mname VARCHAR(20),
+        Fname VARCHAR(20),
+        Age INT NOT NULL CHECK (Age >= 5 AND Age <= 25),
+        ClassSec VARCHAR(10) NOT NULL,
+        DoB DATE NOT NULL,
+        BloodGroup VARCHAR(4) NOT NULL,
+        Height FLOAT CHECK (Height > 0),
+        Weight FLOAT CHECK (Weight > 0),
+        Allergies VARCHAR(255),
+        Tetanus ENUM('Y', 'N') DEFAULT 'N',
+        TetanusDate DATE,
+        Cholera ENUM('Y', 'N') DEFAULT 'N',
+        CholeraDate DATE,
+        Typhoid ENUM('Y', 'N') DEFAULT 'N',
+        TyphoidDate DATE,
+        HepA ENUM('Y', 'N') DEFAULT 'N',
+        HepADate DATE,
+        HepB ENUM('Y', 'N') DEFAULT 'N',
+        HepBDate DATE,
+        ChickenPox ENUM('Y', 'N') DEFAULT 'N',
+        ChickenPoxDate DATE,
+        Measles ENUM('Y', 'N') DEFAULT 'N',
+        MeaslesDate DATE,
+        COVID ENUM('Y', 'N') DEFAULT 'N',
+        COVIDDate DATE,
+        AnyOther VARCHAR(255),
+        CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        FOREIGN KEY (AdminNo) REFERENCES users(AdminNo) ON DELETE CASCADE
+    )
+    """,
+    
+    # Audit log table
+    """
+    CREATE TABLE IF NOT EXISTS audit_log (
+        LogID INT AUTO_INCREMENT PRIMARY KEY,
+        AdminID INT NOT NULL,
+        TargetAdminNo INT,
+        ActionType ENUM('CREATE', 'UPDATE', 'DELETE', 'LOGIN', 'PASSWORD_CHANGE') NOT NULL,
+        ChangedFields JSON,
+        OldValues JSON,
+        NewValues JSON,
+        IPAddress VARCHAR(45),
+        CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (AdminID) REFERENCES admins(AdminID)
+    )
+    """
+]
+
 def create_tables():
     """Create all necessary tables"""
     try:
-        conn = create_connection()
-        cr = conn.cursor()
-        
-        # Admins table with role-based auth
-        cr.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                AdminID INT AUTO_INCREMENT PRIMARY KEY,
-                Username VARCHAR(50) UNIQUE NOT NULL,
-                PasswordHash VARCHAR(255) NOT NULL,
-                FullName VARCHAR(100),
-                Email VARCHAR(100),
-                Role ENUM('SuperAdmin', 'Admin', 'Viewer') DEFAULT 'Admin',
-                IsActive BOOLEAN DEFAULT TRUE,
-                LoginAttempts INT DEFAULT 0,
-                LockedUntil DATETIME,
-                LastLogin DATETIME,
-                CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Users table
-        cr.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                AdminNo INT PRIMARY KEY,
-                Sname VARCHAR(25) NOT NULL
-            )
-        """)
-        
-        # Records table with constraints
-        cr.execute("""
-            CREATE TABLE IF NOT EXISTS records (
-                AdminNo INT PRIMARY KEY,
-                Sname VARCHAR(25) NOT NULL,
-                Sex ENUM('M', 'F', 'Other') NOT NULL,
-                Mname VARCHAR(20),
-                Fname VARCHAR(20),
-                Age INT NOT NULL CHECK (Age >= 5 AND Age <= 25),
-                ClassSec VARCHAR(10) NOT NULL,
-                DoB DATE NOT NULL,
-                BloodGroup VARCHAR(4) NOT NULL,
-                Height FLOAT CHECK (Height > 0),
-                Weight FLOAT CHECK (Weight > 0),
-                Allergies VARCHAR(255),
-                Tetanus ENUM('Y', 'N') DEFAULT 'N',
-                TetanusDate DATE,
-                Cholera ENUM('Y', 'N') DEFAULT 'N',
-                CholeraDate DATE,
-                Typhoid ENUM('Y', 'N') DEFAULT 'N',
-                TyphoidDate DATE,
-                HepA ENUM('Y', 'N') DEFAULT 'N',
-                HepADate DATE,
-                HepB ENUM('Y', 'N') DEFAULT 'N',
-                HepBDate DATE,
-                ChickenPox ENUM('Y', 'N') DEFAULT 'N',
-                ChickenPoxDate DATE,
-                Measles ENUM('Y', 'N') DEFAULT 'N',
-                MeaslesDate DATE,
-                COVID ENUM('Y', 'N') DEFAULT 'N',
-                COVIDDate DATE,
-                AnyOther VARCHAR(255),
-                CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                FOREIGN KEY (AdminNo) REFERENCES users(AdminNo) ON DELETE CASCADE
-            )
-        """)
-        
-        # Audit log table
-        cr.execute("""
-            CREATE TABLE IF NOT EXISTS audit_log (
-                LogID INT AUTO_INCREMENT PRIMARY KEY,
-                AdminID INT NOT NULL,
-                TargetAdminNo INT,
-                ActionType ENUM('CREATE', 'UPDATE', 'DELETE', 'LOGIN', 'PASSWORD_CHANGE') NOT NULL,
-                ChangedFields JSON,
-                OldValues JSON,
-                NewValues JSON,
-                IPAddress VARCHAR(45),
-                CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (AdminID) REFERENCES admins(AdminID)
-            )
-        """)
-        
-        conn.commit()
+        with get_connection() as conn:
+            cr = conn.cursor()
+            for statement in SCHEMA:
+                for translated in BACKEND.translate_ddl(statement):
+                    cr.execute(translated)
+            
+            conn.commit()
+            cr.close()
         logger.info("Database tables created successfully")
-        cr.close()
-        conn.close()
-    except sql.Error as e:
+        
+        # Bring indexes and later schema changes up to date
+        from migrations import migrate
+        applied = migrate()
+        if applied:
+            logger.info(f"Applied schema migrations: {applied}")
+    except DatabaseError as e:
         logger.error(f"Error creating tables: {e}")
         raise
 
-def log_audit(admin_id, action_type, target_admin_no=None, changed_fields=None, old_values=None, new_values=None, ip_address=None):
-    """Log an action to audit_log table"""
+def schema_fingerprint():
+    """Hash of the base schema, migrations and target database"""
+    from migrations import MIGRATIONS
+    if BACKEND.name == 'sqlite':
+        target = os.path.abspath(BACKEND.path)
+    else:
+        target = f"{BACKEND.config['host']}/{BACKEND.config['database']}"
+    digest = hashlib.sha256()
+    digest.update(f"{BACKEND.name}:{target}\n".encode())
+    for statement in SCHEMA:
+        digest.update(statement.encode())
+    for version, description, _ in MIGRATIONS:
+        digest.update(f"{version}:{description}\n".encode())
+    return digest.hexdigest()
+
+def ensure_schema(force=False):
+    """Create tables and run migrations unless the cached fingerprint matches
+    
+    The fingerprint of the last successful create_tables() is kept in
+    SCHEMA_CACHE_PATH, so a relaunch against an unchanged schema sends no
+    DDL at all. Set SCHEMA_FAST_PATH=false (or pass force=True) to always
+    run it. Returns True if DDL was run.
+    """
+    fingerprint = schema_fingerprint()
+    if not force and SCHEMA_CACHE['fast_path']:
+        missing_file = BACKEND.name == 'sqlite' and not os.path.exists(BACKEND.path)
+        try:
+            with open(SCHEMA_CACHE['path'], 'r') as f:
+                cached = f.read().strip()
+        except OSError:
+            cached = None
+        if cached == fingerprint and not missing_file:
+            logger.debug("Schema fingerprint matches; skipping DDL")
+            return False
+    
+    create_tables()
     try:
-        conn = create_connection()
-        cr = conn.cursor()
-        
-        import json
-        cr.execute("""
-            INSERT INTO audit_log 
-            (AdminID, TargetAdminNo, ActionType, ChangedFields, OldValues, NewValues, IPAddress)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
-            admin_id,
-            target_admin_no,
-            action_type,
-            json.dumps(changed_fields) if changed_fields else None,
-            json.dumps(old_values) if old_values else None,
-            json.dumps(new_values) if new_values else None,
-            ip_address
-        ))
-        
-        conn.commit()
-        cr.close()
-        conn.close()
-        logger.info(f"Audit logged: {action_type} by admin {admin_id}")
-    except sql.Error as e:
-        logger.error(f"Error logging audit: {e}")
+        with open(SCHEMA_CACHE['path'], 'w') as f:
+            f.write(fingerprint)
+    except OSError as e:
+        logger.warning(f"Could not write schema cache: {e}")
+    return True
+
+def log_audit(admin_id, action_type, target_admin_no=None, changed_fields=None, old_values=None, new_values=None, ip_address=None):
+    """Queue an action for the audit_log table
+    
+    Entries are written in batches by the background writer in audit.py;
+    call audit.flush() to write them immediately.
+    """
+    from audit import get_audit_writer, make_event
+    get_audit_writer().log(make_event(
+        admin_id, action_type, target_admin_no,
+        changed_fields, old_values, new_values, ip_address
+    ))
+    logger.info(f"Audit logged: {action_type} by admin {admin_id}")
 
 def get_audit_logs(limit=50):
     """Retrieve audit logs"""
     try:
-        conn = create_connection()
-        cr = conn.cursor()
-        
-        cr.execute("""
-            SELECT LogID, AdminID, TargetAdminNo, ActionType, CreatedAt 
-            FROM audit_log 
-            ORDER BY CreatedAt DESC 
-            LIMIT %s
-        """, (limit,))
-        
-        logs = cr.fetchall()
-        cr.close()
-        conn.close()
+        with get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("""
+                SELECT LogID, AdminID, TargetAdminNo, ActionType, CreatedAt 
+                FROM audit_log 
+                ORDER BY CreatedAt DESC 
+                LIMIT %s
+            """, (limit,))
+            
+            logs = cr.fetchall()
+            cr.close()
         return logs
-    except sql.Error as e:
+    except DatabaseError as e:
         logger.error(f"Error retrieving audit logs: {e}")
         return []
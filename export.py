@@ -0,0 +1,101 @@
+"""
+Streaming CSV export of student records
+
+Rows are read from a streaming cursor in batches and written straight
+to a csvsink sink (a file path or stdout, plain, gzip or zstd), so
+memory stays flat however many students are exported.
+
+Run directly to export from the command line:
+    python export.py -o records.csv.gz
+    python export.py --report health --where class_sec=9A,9B -o - | gzip -d | head
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+from csvsink import COMPRESSIONS, Progress, export_rows
+from models import StudentRecords, RECORD_FIELDS, FIELD_COLUMNS, record_fields
+
+logger = logging.getLogger(__name__)
+
+# CSV header for each exported StudentRecord attribute
+CSV_HEADERS = dict(zip(RECORD_FIELDS[:29], (
+    'AdminNo', 'StudentName', 'Sex', 'MotherName', 'FatherName', 'Age',
+    'ClassSection', 'DateOfBirth', 'BloodGroup', 'Height', 'Weight', 'Allergies',
+    'Tetanus', 'TetanusDate', 'Cholera', 'CholeraDate', 'Typhoid', 'TyphoidDate',
+    'HepA', 'HepADate', 'HepB', 'HepBDate', 'ChickenPox', 'ChickenPoxDate',
+    'Measles', 'MeaslesDate', 'COVID', 'COVIDDate', 'OtherInfo'
+)))
+
+# Column sets for the named reports
+REPORT_COLUMNS = {
+    'comprehensive': RECORD_FIELDS[:29],
+    'health': ('admin_no', 'name', 'age', 'class_sec', 'height', 'weight', 'blood_group', 'allergies'),
+}
+
+def record_batches(columns, filter=None, batch_size=1000):
+    """Yield lists of record tuples (in `columns` order) from StudentRecords.iter_records()"""
+    records = StudentRecords.iter_records(filter=filter, columns=columns, batch_size=batch_size)
+    try:
+        while True:
+            batch = [record.as_tuple(columns) for record in itertools.islice(records, batch_size)]
+            if not batch:
+                break
+            yield batch
+    finally:
+        records.close()
+
+def export_records(target=None, columns=None, filter=None, compression=None, batch_size=1000, progress=None):
+    """Stream records to a CSV sink
+    
+    `columns` selects StudentRecord attributes (default: the
+    comprehensive report) and `filter` is passed to iter_records(). The
+    streaming cursor keeps one pooled connection until the export ends.
+    Returns {'rows', 'seconds', 'rows_per_sec'}; errors propagate.
+    """
+    columns = record_fields(columns or REPORT_COLUMNS['comprehensive'])
+    header = [CSV_HEADERS.get(field, FIELD_COLUMNS[field]) for field in columns]
+    return export_rows(record_batches(columns, filter, batch_size), header, target, compression, progress)
+
+def parse_filters(conditions):
+    """Turn ['class_sec=9A,9B', 'sex=F'] into an iter_records() filter"""
+    filters = {}
+    for condition in conditions or ():
+        field, sep, value = condition.partition('=')
+        if not sep:
+            raise ValueError(f"Filter must be field=value: {condition}")
+        values = [part.strip() for part in value.split(',')]
+        filters[field.strip()] = values if len(values) > 1 else values[0]
+    return filters
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Export student records as CSV")
+    parser.add_argument('-o', '--output', default='-', help="file path, or - for stdout (default)")
+    parser.add_argument('--report', choices=sorted(REPORT_COLUMNS), default='comprehensive')
+    parser.add_argument('--columns', help="comma-separated record fields, overriding --report")
+    parser.add_argument('--where', action='append', metavar='FIELD=VALUE[,VALUE]', help="filter (repeatable)")
+    parser.add_argument('--compress', choices=sorted(COMPRESSIONS), help="default: from the output suffix")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+    
+    columns = args.columns.split(',') if args.columns else REPORT_COLUMNS[args.report]
+    # Progress goes to stderr so stdout can carry the CSV
+    progress = Progress(report=lambda rows, seconds, rate: print(
+        f"{rows} rows, {seconds:.1f}s, {rate:.0f} rows/s", file=sys.stderr
+    ))
+    try:
+        stats = export_records(
+            args.output, columns, parse_filters(args.where), args.compress, args.batch_size, progress
+        )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if args.output != '-':
+        print(f"Wrote {stats['rows']} rows to {args.output} ({os.path.getsize(args.output)} bytes)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
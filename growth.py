@@ -0,0 +1,237 @@
+"""
+BMI-for-age z-scores and percentiles from LMS growth references
+
+Adult BMI cut-offs do not apply to children, so students are assessed
+against an LMS reference: for each sex and age in months, L (skewness),
+M (median) and S (coefficient of variation) give
+
+    z = ((BMI / M) ** L - 1) / (L * S)
+
+with WHO's restricted tails beyond +/-3 SD. The reference is held as one
+flat array per parameter, indexed by sex and month offset, so a whole
+population is scored with a few array lookups (NumPy when installed).
+
+No reference data is bundled: point GROWTH_REFERENCE_PATH at the monthly
+WHO 2007 (or CDC) LMS table. Until then children get no BMI category.
+"""
+import csv
+import logging
+import math
+import os
+import threading
+from array import array
+from utils import BMI_CATEGORIES, age_in_months, calculate_bmi
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Age in months from which the adult cut-offs apply (WHO 5-19 ends at 228)
+ADULT_AGE_MONTHS = 229
+
+def classify(z):
+    """WHO 5-19 category for a BMI-for-age z-score, using the adult names
+    
+    Thinness (< -2 SD) is reported as Underweight, > +1 SD as Overweight
+    and > +2 SD as Obese.
+    """
+    if z < -2:
+        return 'Underweight'
+    if z <= 1:
+        return 'Normal'
+    if z <= 2:
+        return 'Overweight'
+    return 'Obese'
+
+def percentile(z):
+    """Percentile (0-100) of a z-score under the standard normal"""
+    return 50 * (1 + math.erf(z / math.sqrt(2)))
+
+def lms_z(value, l, m, s):
+    """LMS z-score with WHO's linear extrapolation beyond +/-3 SD (L must be non-zero)"""
+    z = ((value / m) ** l - 1) / (l * s)
+    if abs(z) <= 3:
+        return z
+    sd = lambda k: m * (1 + l * s * k) ** (1 / l)
+    if z > 3:
+        return 3 + (value - sd(3)) / (sd(3) - sd(2))
+    return -3 + (value - sd(-3)) / (sd(-2) - sd(-3))
+
+class GrowthReference:
+    """LMS parameters per sex for consecutive months first_month..last_month"""
+    
+    def __init__(self, first_month, tables):
+        lengths = {len(values) for params in tables.values() for values in params}
+        if len(lengths) != 1:
+            raise ValueError("Every sex needs L, M and S for the same months")
+        if any(value == 0 for l, m, s in tables.values() for value in l):
+            raise ValueError("L must be non-zero")
+        self.first_month = first_month
+        self.last_month = first_month + lengths.pop() - 1
+        self.sexes = sorted(tables)
+        self.index = {sex: i for i, sex in enumerate(self.sexes)}
+        # One flat array per parameter: row = sex, column = month offset
+        self.L, self.M, self.S = (
+            array('d', [value for sex in self.sexes for value in tables[sex][k]]) for k in range(3)
+        )
+        self.width = self.last_month - first_month + 1
+        self._arrays = None
+    
+    @classmethod
+    def from_knots(cls, knots):
+        """Build a monthly reference by linear interpolation between (month, L, M, S) knots"""
+        first = max(rows[0][0] for rows in knots.values())
+        last = min(rows[-1][0] for rows in knots.values())
+        tables = {}
+        for sex, rows in knots.items():
+            params = ([], [], [])
+            for month in range(first, last + 1):
+                i = max(j for j, row in enumerate(rows) if row[0] <= month)
+                low, high = rows[i], rows[min(i + 1, len(rows) - 1)]
+                t = (month - low[0]) / (high[0] - low[0]) if high[0] != low[0] else 0
+                for k in range(3):
+                    params[k].append(low[k + 1] + (high[k + 1] - low[k + 1]) * t)
+            tables[sex] = params
+        return cls(first, tables)
+    
+    @classmethod
+    def load(cls, path):
+        """Load a CSV with columns sex, age_months, L, M, S (one row per sex and month)"""
+        knots = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                knots.setdefault(row['sex'].strip().upper(), []).append(
+                    (int(row['age_months']), float(row['L']), float(row['M']), float(row['S']))
+                )
+        for rows in knots.values():
+            rows.sort()
+            if [month for month, *_ in rows] != list(range(rows[0][0], rows[-1][0] + 1)):
+                raise ValueError(f"{path}: months must be consecutive for each sex")
+        return cls.from_knots(knots)
+    
+    def lms(self, sex, age_months):
+        """(L, M, S) for a sex and age, or None outside the reference"""
+        row = self.index.get(sex)
+        if row is None or not self.first_month <= age_months <= self.last_month:
+            return None
+        i = row * self.width + age_months - self.first_month
+        return self.L[i], self.M[i], self.S[i]
+    
+    def zscore(self, bmi, sex, age_months):
+        """BMI-for-age z-score, or None if BMI is missing or the age/sex is not covered"""
+        lms = self.lms(sex, age_months)
+        if lms is None or not bmi or bmi <= 0:
+            return None
+        return lms_z(bmi, *lms)
+    
+    def zscores(self, bmi, sex_codes, sexes, age_months):
+        """Vectorized zscore(): NaN where zscore() would return None
+        
+        `sex_codes` index into the `sexes` labels (as in HealthColumns).
+        """
+        if np is None:
+            return [
+                math.nan if z is None else z
+                for z in (
+                    self.zscore(None if math.isnan(value) else value, sexes[code], int(months))
+                    for value, code, months in zip(bmi, sex_codes, age_months)
+                )
+            ]
+        
+        if self._arrays is None:
+            self._arrays = tuple(np.frombuffer(values, dtype=np.float64) for values in (self.L, self.M, self.S))
+        bmi = np.asarray(bmi, dtype=np.float64)
+        rows = np.array([self.index.get(sex, -1) for sex in sexes], dtype=np.int64)[np.asarray(sex_codes, dtype=np.int64)]
+        offsets = np.asarray(age_months, dtype=np.int64) - self.first_month
+        valid = (rows >= 0) & (offsets >= 0) & (offsets < self.width) & (bmi > 0)
+        
+        z = np.full(bmi.shape, np.nan)
+        flat = rows[valid] * self.width + offsets[valid]
+        l, m, s = (values[flat] for values in self._arrays)
+        x = bmi[valid]
+        core = ((x / m) ** l - 1) / (l * s)
+        sd = lambda k: m * (1 + l * s * k) ** (1 / l)
+        with np.errstate(invalid='ignore'):
+            core = np.where(core > 3, 3 + (x - sd(3)) / (sd(3) - sd(2)), core)
+            core = np.where(core < -3, -3 + (x - sd(-3)) / (sd(-2) - sd(-3)), core)
+        z[valid] = core
+        return z
+
+def percentiles_of(z):
+    """Vectorized percentile() (NaN stays NaN)"""
+    if np is None:
+        return [math.nan if math.isnan(value) else percentile(value) for value in z]
+    # Abramowitz-Stegun 7.1.26 erf (|error| < 1.5e-7); NumPy has no erf
+    x = np.abs(np.asarray(z, dtype=np.float64)) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - poly * np.exp(-x * x)
+    return 50 * (1 + np.sign(z) * erf)
+
+def category_counts(z):
+    """Count z-scores per category (NaN skipped)"""
+    counts = dict.fromkeys(BMI_CATEGORIES, 0)
+    if np is not None:
+        z = np.asarray(z, dtype=np.float64)
+        below = [
+            np.count_nonzero(z < -2.0), np.count_nonzero(z <= 1.0),
+            np.count_nonzero(z <= 2.0), np.count_nonzero(~np.isnan(z))
+        ]
+        for category, low, high in zip(counts, [0] + below, below):
+            counts[category] = int(high - low)
+        return counts
+    for value in z:
+        if not math.isnan(value):
+            counts[classify(value)] += 1
+    return counts
+
+# Not loaded yet; None once loading found no GROWTH_REFERENCE_PATH
+_UNLOADED = object()
+_reference = _UNLOADED
+_reference_lock = threading.Lock()
+
+def get_growth_reference():
+    """Return the process-wide reference from GROWTH_REFERENCE_PATH, or None if it is not set"""
+    global _reference
+    if _reference is _UNLOADED:
+        with _reference_lock:
+            if _reference is _UNLOADED:
+                path = os.getenv('GROWTH_REFERENCE_PATH')
+                if path:
+                    _reference = GrowthReference.load(path)
+                else:
+                    logger.warning("GROWTH_REFERENCE_PATH is not set; children get no BMI-for-age category")
+                    _reference = None
+    return _reference
+
+def assess(height, weight, sex, dob, on=None):
+    """BMI assessment for one student
+    
+    Returns {'bmi', 'z', 'percentile', 'category', 'reference'}: 'age'
+    (BMI-for-age) when the reference covers the student; None with no
+    category for a child it does not cover (or when no reference is
+    configured); otherwise 'adult' with utils.calculate_bmi's cut-offs
+    (also used when dob is unknown). z and percentile are only set for
+    'age'. Returns None if height or weight is missing.
+    """
+    bmi, status = calculate_bmi(height, weight)
+    if bmi is None:
+        return None
+    if dob:
+        months = age_in_months(dob, on)
+        reference = get_growth_reference()
+        z = reference.zscore(weight / (height / 100) ** 2, sex, months) if reference else None
+        if z is not None:
+            return {
+                'bmi': bmi,
+                'z': round(z, 2),
+                'percentile': round(percentile(z), 1),
+                'category': classify(z),
+                'reference': 'age'
+            }
+        if months < ADULT_AGE_MONTHS:
+            return {'bmi': bmi, 'z': None, 'percentile': None, 'category': None, 'reference': None}
+    return {'bmi': bmi, 'z': None, 'percentile': None, 'category': status, 'reference': 'adult'}
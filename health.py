@@ -1,6 +1,7 @@
 import pymysql as sql
-import csv
 from datetime import datetime, timedelta
+from itertools import chain
+from csvsink import Progress, cursor_batches, export_rows
 
 # Admin Credentials
 ADMIN_NAME = "GOD01"
@@ -526,30 +527,30 @@ def export_to_csv():
     """Export all records to CSV file"""
     try:
         conn = create_connection()
-        cr = conn.cursor()
+        # Unbuffered cursor: rows are streamed to the file, not held in memory
+        cr = conn.cursor(sql.cursors.SSCursor)
         
         cr.execute("SELECT * FROM records")
-        records = cr.fetchall()
+        first = cr.fetchmany(1000)
         
-        if not records:
+        if not first:
             print("No records to export.")
+            cr.close()
+            conn.close()
             return
         
         filename = f"medical_records_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        with open(filename, 'w', newline='') as csvfile:
-            fieldnames = [
-                'AdminNo', 'StudentName', 'Sex', 'MotherName', 'FatherName', 'Age', 
-                'ClassSection', 'DateOfBirth', 'BloodGroup', 'Height', 'Weight', 'Allergies',
-                'Tetanus', 'TetanusDate', 'Cholera', 'CholeraDate', 'Typhoid', 'TyphoidDate',
-                'HepA', 'HepADate', 'HepB', 'HepBDate', 'ChickenPox', 'ChickenPoxDate',
-                'Measles', 'MeaslesDate', 'COVID', 'COVIDDate', 'OtherInfo'
-            ]
-            writer = csv.writer(csvfile)
-            writer.writerow(fieldnames)
-            writer.writerows(records)
-        
-        print(f"Records exported successfully to {filename}")
+        fieldnames = [
+            'AdminNo', 'StudentName', 'Sex', 'MotherName', 'FatherName', 'Age', 
+            'ClassSection', 'DateOfBirth', 'BloodGroup', 'Height', 'Weight', 'Allergies',
+            'Tetanus', 'TetanusDate', 'Cholera', 'CholeraDate', 'Typhoid', 'TyphoidDate',
+            'HepA', 'HepADate', 'HepB', 'HepBDate', 'ChickenPox', 'ChickenPoxDate',
+            'Measles', 'MeaslesDate', 'COVID', 'COVIDDate', 'OtherInfo'
+        ]
+        progress = Progress(report=lambda rows, seconds, rate: print(f"  {rows} rows ({rate:.0f} rows/s)"))
+        stats = export_rows(chain([first], cursor_batches(cr)), fieldnames, filename, progress=progress)
+        
+        print(f"{stats['rows']} records exported successfully to {filename}")
         cr.close()
         conn.close()
     except sql.Error as e:
@@ -4,8 +4,7 @@ Main application entry point
 import logging
 import sys
 from logger_config import setup_logger
-from db import create_tables
-from ui import CLI
+from db import ensure_schema
 
 # Setup logger
 logger = setup_logger()
@@ -15,13 +14,18 @@ def main():
     try:
         logger.info("Application starting...")
         
-        # Create database tables
-        create_tables()
+        # Create database tables (skipped when the cached schema fingerprint matches)
+        ensure_schema()
         
         # Initialize CLI
+        from ui import CLI
+        from security import get_password_hasher
+        
+        # Pick the bcrypt cost in the background while the menu is shown
+        get_password_hasher().warm_up()
         cli = CLI()
         cli.main_menu()
-        
+    
     except KeyboardInterrupt:
         logger.info("Application interrupted by user")
         print("\nApplication terminated.")
@@ -30,6 +34,12 @@ def main():
         logger.error(f"Unexpected error: {e}", exc_info=True)
         print(f"An error occurred: {e}")
         sys.exit(1)
+    finally:
+        # Write any audit events still queued in the background writer; the
+        # writer module is only loaded once the models have been imported
+        audit = sys.modules.get('audit')
+        if audit is not None:
+            audit.flush()
 
 if __name__ == "__main__":
     main()
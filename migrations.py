@@ -0,0 +1,305 @@
+"""
+Versioned schema migrations and index management
+
+Run directly to inspect or upgrade the database:
+    python migrations.py status
+    python migrations.py migrate
+    python migrations.py index-report
+    python migrations.py repair-indexes
+"""
+import argparse
+import logging
+import sys
+from collections import namedtuple
+from functools import partial
+import db
+from db import get_connection
+from summary import rebuild_counts
+from utils import tokenize_allergies
+
+logger = logging.getLogger(__name__)
+
+Index = namedtuple('Index', ['table', 'name', 'columns'])
+
+# Secondary indexes the application's queries rely on. Composite indexes end
+# in AdminNo so sorted listings can page with a (sort_key, AdminNo) cursor.
+INDEXES = [
+    Index('records', 'idx_records_sname', ('Sname', 'AdminNo')),
+    Index('records', 'idx_records_classsec', ('ClassSec', 'AdminNo')),
+    Index('records', 'idx_records_age', ('Age', 'AdminNo')),
+    Index('records', 'idx_records_bloodgroup', ('BloodGroup', 'AdminNo')),
+    Index('audit_log', 'idx_audit_created', ('CreatedAt',)),
+    Index('audit_log', 'idx_audit_target', ('TargetAdminNo', 'CreatedAt')),
+    Index('student_vaccinations', 'idx_vaccinations_vaccine', ('Vaccine', 'AdminNo', 'Date')),
+    Index('student_allergies', 'idx_allergies_student', ('AdminNo',)),
+    Index('measurements', 'idx_measurements_student', ('AdminNo', 'MeasuredAt')),
+    Index('measurements', 'idx_measurements_time', ('MeasuredAt', 'AdminNo')),
+]
+
+SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        Version INT PRIMARY KEY,
+        Description VARCHAR(255) NOT NULL,
+        AppliedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+def list_indexes(cr, table):
+    """Return the names of the indexes on `table`"""
+    if db.BACKEND.name == 'sqlite':
+        cr.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s",
+            (table,)
+        )
+    else:
+        cr.execute("""
+            SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+    return {row[0] for row in cr.fetchall()}
+
+def ensure_index(cr, index):
+    """Create `index` unless it already exists; returns True if created"""
+    if index.name in list_indexes(cr, index.table):
+        return False
+    cr.execute(f"CREATE INDEX {index.name} ON {index.table} ({', '.join(index.columns)})")
+    logger.info(f"Created index {index.name} on {index.table}")
+    return True
+
+def ensure_indexes(cr, tables=None):
+    """Create every missing index in INDEXES (optionally only on `tables`)"""
+    for index in INDEXES:
+        if tables is None or index.table in tables:
+            ensure_index(cr, index)
+
+STUDENT_VACCINATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS student_vaccinations (
+        AdminNo INT NOT NULL,
+        Vaccine VARCHAR(20) NOT NULL,
+        Dose INT NOT NULL DEFAULT 1,
+        Date DATE,
+        PRIMARY KEY (AdminNo, Vaccine, Dose),
+        FOREIGN KEY (AdminNo) REFERENCES users(AdminNo) ON DELETE CASCADE
+    )
+"""
+
+# Vaccine name -> (status column, date column) on records as of migration 2
+LEGACY_VACCINE_COLUMNS = {
+    'tetanus': ('Tetanus', 'TetanusDate'),
+    'cholera': ('Cholera', 'CholeraDate'),
+    'typhoid': ('Typhoid', 'TyphoidDate'),
+    'hep_a': ('HepA', 'HepADate'),
+    'hep_b': ('HepB', 'HepBDate'),
+    'chicken_pox': ('ChickenPox', 'ChickenPoxDate'),
+    'measles': ('Measles', 'MeaslesDate'),
+    'covid': ('COVID', 'COVIDDate'),
+}
+
+def backfill_vaccinations(cr):
+    """Copy each 'Y' vaccine column on records into a dose-1 row"""
+    for vaccine, (status_column, date_column) in LEGACY_VACCINE_COLUMNS.items():
+        cr.execute(f"""
+            INSERT INTO student_vaccinations (AdminNo, Vaccine, Dose, Date)
+            SELECT AdminNo, %s, 1, {date_column} FROM records r
+            WHERE {status_column} = 'Y' AND NOT EXISTS (
+                SELECT 1 FROM student_vaccinations v
+                WHERE v.AdminNo = r.AdminNo AND v.Vaccine = %s
+            )
+        """, (vaccine, vaccine))
+
+STUDENT_ALLERGIES_TABLE = """
+    CREATE TABLE IF NOT EXISTS student_allergies (
+        Term VARCHAR(40) NOT NULL,
+        AdminNo INT NOT NULL,
+        PRIMARY KEY (Term, AdminNo),
+        FOREIGN KEY (AdminNo) REFERENCES users(AdminNo) ON DELETE CASCADE
+    )
+"""
+
+def backfill_allergies(cr):
+    """Index the terms of every records.Allergies note"""
+    cr.execute("SELECT AdminNo, Allergies FROM records WHERE Allergies IS NOT NULL AND Allergies <> ''")
+    rows = [(term, admin_no) for admin_no, allergies in cr.fetchall() for term in tokenize_allergies(allergies)]
+    cr.execute("DELETE FROM student_allergies")
+    if rows:
+        cr.executemany("INSERT INTO student_allergies (Term, AdminNo) VALUES (%s, %s)", rows)
+
+SUMMARY_COUNTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS summary_counts (
+        Dimension VARCHAR(20) NOT NULL,
+        Value VARCHAR(40) NOT NULL,
+        Count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (Dimension, Value)
+    )
+"""
+
+MEASUREMENTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS measurements (
+        MeasurementID INT AUTO_INCREMENT PRIMARY KEY,
+        AdminNo INT NOT NULL,
+        MeasuredAt DATETIME NOT NULL,
+        Height FLOAT,
+        Weight FLOAT,
+        FOREIGN KEY (AdminNo) REFERENCES users(AdminNo) ON DELETE CASCADE
+    )
+"""
+
+def backfill_measurements(cr):
+    """Seed each student's history with their current height and weight"""
+    cr.execute("""
+        INSERT INTO measurements (AdminNo, MeasuredAt, Height, Weight)
+        SELECT AdminNo, COALESCE(UpdatedAt, CreatedAt, NOW()), Height, Weight FROM records r
+        WHERE (Height IS NOT NULL OR Weight IS NOT NULL) AND NOT EXISTS (
+            SELECT 1 FROM measurements m WHERE m.AdminNo = r.AdminNo
+        )
+    """)
+
+# Ordered migrations: (version, description, steps). Each step is SQL or a
+# callable taking a cursor, and must be safe to run again if a previous
+# attempt was interrupted (MySQL commits DDL implicitly).
+MIGRATIONS = [
+    (1, "Secondary indexes for record search, sorting and audit log",
+        [partial(ensure_indexes, tables=('records', 'audit_log'))]),
+    (2, "Normalized student_vaccinations table backfilled from records",
+        [STUDENT_VACCINATIONS_TABLE, backfill_vaccinations,
+         partial(ensure_indexes, tables=('student_vaccinations',))]),
+    (3, "Inverted index of allergy terms in student_allergies",
+        [STUDENT_ALLERGIES_TABLE, backfill_allergies,
+         partial(ensure_indexes, tables=('student_allergies',))]),
+    (4, "Dashboard summary_counts maintained on every record write",
+        [SUMMARY_COUNTS_TABLE, rebuild_counts]),
+    (5, "Height/weight history in measurements, seeded from records",
+        [MEASUREMENTS_TABLE, backfill_measurements,
+         partial(ensure_indexes, tables=('measurements',))]),
+]
+
+def applied_versions(cr):
+    """Return the set of migration versions recorded as applied"""
+    cr.execute("SELECT Version FROM schema_version")
+    return {row[0] for row in cr.fetchall()}
+
+def current_version():
+    """Return the highest applied migration version (0 if none)"""
+    with get_connection() as conn:
+        cr = conn.cursor()
+        for statement in db.BACKEND.translate_ddl(SCHEMA_VERSION_TABLE):
+            cr.execute(statement)
+        versions = applied_versions(cr)
+        cr.close()
+    return max(versions, default=0)
+
+def migrate():
+    """Apply pending migrations in order; returns the versions applied"""
+    applied = []
+    with get_connection() as conn:
+        cr = conn.cursor()
+        for statement in db.BACKEND.translate_ddl(SCHEMA_VERSION_TABLE):
+            cr.execute(statement)
+        done = applied_versions(cr)
+        
+        for version, description, steps in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(cr)
+                else:
+                    for statement in db.BACKEND.translate_ddl(step):
+                        cr.execute(statement)
+            cr.execute(
+                "INSERT INTO schema_version (Version, Description) VALUES (%s, %s)",
+                (version, description)
+            )
+            conn.commit()
+            applied.append(version)
+        cr.close()
+    return applied
+
+def unused_indexes(cr):
+    """Return {(table, index)} with no recorded reads, or None if unknown
+    
+    Uses MySQL's sys.schema_unused_indexes (performance_schema must be
+    enabled); counters reset on server restart. SQLite keeps no usage
+    statistics.
+    """
+    if db.BACKEND.name == 'sqlite':
+        return None
+    try:
+        cr.execute("""
+            SELECT object_name, index_name FROM sys.schema_unused_indexes
+            WHERE object_schema = DATABASE()
+        """)
+        return {(row[0], row[1]) for row in cr.fetchall()}
+    except db.DatabaseError as e:
+        logger.warning(f"Index usage statistics unavailable: {e}")
+        return None
+
+def index_report():
+    """Compare the live indexes with INDEXES
+    
+    Returns a dict with 'missing' (expected but absent), 'unmanaged'
+    (idx_* indexes no longer listed in INDEXES) and 'unused' (expected
+    indexes with no recorded reads, or None if the backend cannot tell).
+    """
+    tables = sorted({index.table for index in INDEXES})
+    expected = {(index.table, index.name) for index in INDEXES}
+    with get_connection() as conn:
+        cr = conn.cursor()
+        present = set()
+        for table in tables:
+            present |= {(table, name) for name in list_indexes(cr, table)}
+        unused = unused_indexes(cr)
+        cr.close()
+    
+    return {
+        'missing': sorted(expected - present),
+        'unmanaged': sorted(key for key in present - expected if key[1].startswith('idx_')),
+        'unused': sorted(unused & expected) if unused is not None else None
+    }
+
+def print_indexes(title, indexes):
+    """Print a titled list of (table, index) pairs"""
+    print(title)
+    if indexes is None:
+        print("  usage statistics not available on this backend")
+    elif not indexes:
+        print("  none")
+    for table, name in indexes or []:
+        print(f"  {table}.{name}")
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Manage the MedRep database schema")
+    parser.add_argument('command', choices=['status', 'migrate', 'index-report', 'repair-indexes'])
+    args = parser.parse_args(argv)
+    
+    if args.command == 'status':
+        version = current_version()
+        latest = MIGRATIONS[-1][0]
+        print(f"Schema version: {version} (latest: {latest})")
+        for number, description, _ in MIGRATIONS:
+            print(f"  [{'x' if number <= version else ' '}] {number}: {description}")
+    elif args.command == 'migrate':
+        db.create_tables()
+        print(f"Schema is at version {current_version()}")
+    elif args.command == 'repair-indexes':
+        with get_connection() as conn:
+            cr = conn.cursor()
+            ensure_indexes(cr)
+            conn.commit()
+            cr.close()
+        print("All managed indexes present.")
+    else:
+        report = index_report()
+        print_indexes("Missing indexes:", report['missing'])
+        print_indexes("Unmanaged indexes:", report['unmanaged'])
+        print_indexes("Unused managed indexes:", report['unused'])
+        if report['missing']:
+            print("\nRun 'python migrations.py repair-indexes' to create missing indexes.")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
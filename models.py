@@ -1,163 +1,937 @@
 """
 Models and database operations for users, records, and admins
 """
-import pymysql as sql
-from datetime import datetime
+import csv
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 import logging
+from typing import Optional
 from utils import (
     validate_date, validate_blood_group, validate_sex, validate_age,
-    validate_vaccination_status, validate_admin_no, hash_password, verify_password
+    validate_vaccination_status, validate_admin_no, hash_password, verify_password,
+    normalize_sex, normalize_vaccine, normalize_allergy_term, tokenize_allergies, sanitize_string,
+    ALLERGY_STOPWORDS
 )
-from db import create_connection, log_audit
+import db
+from db import get_connection, stream_cursor, upsert_sql, update_returning, period_sql, log_audit
+from audit import get_audit_writer, make_event
+from search import TrigramIndex
+from summary import track_summary
+from security import login_allowed, get_password_hasher, SessionManager
 
 logger = logging.getLogger(__name__)
 
+# Columns written by create_record, in insert order
+RECORD_COLUMNS = (
+    'AdminNo', 'Sname', 'Sex', 'Mname', 'Fname', 'Age', 'ClassSec', 'DoB', 'BloodGroup',
+    'Height', 'Weight', 'Allergies',
+    'Tetanus', 'TetanusDate', 'Cholera', 'CholeraDate', 'Typhoid', 'TyphoidDate',
+    'HepA', 'HepADate', 'HepB', 'HepBDate', 'ChickenPox', 'ChickenPoxDate',
+    'Measles', 'MeaslesDate', 'COVID', 'COVIDDate', 'AnyOther'
+)
+
+INSERT_RECORD = f"""
+    INSERT INTO records ({', '.join(RECORD_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(RECORD_COLUMNS))})
+"""
+
+# student_data keys for the Y/N vaccination columns
+VACCINATION_FIELDS = ('tetanus', 'cholera', 'typhoid', 'hep_a', 'hep_b', 'chicken_pox', 'measles', 'covid')
+
+# Spellings of the legacy vaccines that normalize_vaccine() does not map
+VACCINE_ALIASES = {'hepa': 'hep_a', 'hepb': 'hep_b', 'chickenpox': 'chicken_pox'}
+
+# Vaccines every student is expected to have
+CRITICAL_VACCINES = ('hep_b', 'covid', 'measles')
+
+# Days after the latest dose when a booster is due
+BOOSTER_INTERVAL_DAYS = {'tetanus': 5 * 365}
+
+INSERT_ALLERGY = "INSERT INTO student_allergies (Term, AdminNo) VALUES (%s, %s)"
+
+INSERT_VACCINATION = """
+    INSERT INTO student_vaccinations (AdminNo, Vaccine, Dose, Date)
+    VALUES (%s, %s, %s, %s)
+"""
+
+INSERT_MEASUREMENT = """
+    INSERT INTO measurements (AdminNo, MeasuredAt, Height, Weight)
+    VALUES (%s, %s, %s, %s)
+"""
+
+# measurements columns for the metrics MeasurementHistory analyses
+METRIC_COLUMNS = {'height': 'Height', 'weight': 'Weight'}
+
+# StudentRecord attribute for each records column, in table order
+RECORD_FIELDS = (
+    'admin_no', 'name', 'sex', 'mother_name', 'father_name', 'age', 'class_sec', 'dob', 'blood_group',
+    'height', 'weight', 'allergies',
+    'tetanus', 'tetanus_date', 'cholera', 'cholera_date', 'typhoid', 'typhoid_date',
+    'hep_a', 'hep_a_date', 'hep_b', 'hep_b_date', 'chicken_pox', 'chicken_pox_date',
+    'measles', 'measles_date', 'covid', 'covid_date', 'other_info',
+    'created_at', 'updated_at'
+)
+
+# StudentRecord attribute -> records column
+FIELD_COLUMNS = dict(zip(RECORD_FIELDS, RECORD_COLUMNS + ('CreatedAt', 'UpdatedAt')))
+
+SELECT_RECORD = f"SELECT {', '.join(FIELD_COLUMNS.values())} FROM records"
+
+# Sort orders offered by record listings: key -> records column
+SORT_KEYS = {'name': 'Sname', 'age': 'Age', 'class': 'ClassSec', 'blood_group': 'BloodGroup'}
+
+# StudentRecord attribute holding each sort key's value
+SORT_FIELDS = {'name': 'name', 'age': 'age', 'class': 'class_sec', 'blood_group': 'blood_group'}
+
+VACCINE_LABELS = {
+    'tetanus': 'Tetanus', 'cholera': 'Cholera', 'typhoid': 'Typhoid', 'hep_a': 'Hep A',
+    'hep_b': 'Hep B', 'chicken_pox': 'Chickenpox', 'measles': 'Measles', 'covid': 'COVID'
+}
+
+class StudentRecord:
+    """One row of the records table
+    
+    Attributes are the student_data keys (plus created_at/updated_at) and
+    are filled straight from a cursor row in SELECT_RECORD column order.
+    """
+    
+    __slots__ = RECORD_FIELDS
+    
+    admin_no: int
+    name: str
+    sex: str
+    mother_name: Optional[str]
+    father_name: Optional[str]
+    age: int
+    class_sec: str
+    dob: date
+    blood_group: str
+    height: Optional[float]
+    weight: Optional[float]
+    allergies: Optional[str]
+    tetanus: str
+    tetanus_date: Optional[date]
+    cholera: str
+    cholera_date: Optional[date]
+    typhoid: str
+    typhoid_date: Optional[date]
+    hep_a: str
+    hep_a_date: Optional[date]
+    hep_b: str
+    hep_b_date: Optional[date]
+    chicken_pox: str
+    chicken_pox_date: Optional[date]
+    measles: str
+    measles_date: Optional[date]
+    covid: str
+    covid_date: Optional[date]
+    other_info: Optional[str]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    
+    @classmethod
+    def from_row(cls, row, fields=RECORD_FIELDS):
+        """Build a record from a row whose columns are `fields`, in order
+        
+        Attributes not in `fields` are left unset; reading them raises
+        AttributeError rather than silently returning a wrong column.
+        """
+        record = cls.__new__(cls)
+        for field, value in zip(fields, row):
+            setattr(record, field, value)
+        return record
+    
+    @property
+    def vaccinations(self):
+        """Vaccination statuses and dates as a VaccinationView"""
+        return VaccinationView(self)
+    
+    def as_tuple(self, fields=RECORD_FIELDS):
+        """Return the values of `fields` (None where unset), in order"""
+        return tuple(getattr(self, field, None) for field in fields)
+    
+    def __eq__(self, other):
+        if not isinstance(other, StudentRecord):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+    
+    def __repr__(self):
+        return f"StudentRecord(admin_no={self.admin_no!r}, name={self.name!r})"
+
+class VaccinationView:
+    """Read-only view of a StudentRecord's vaccination columns"""
+    
+    __slots__ = ('_record',)
+    
+    def __init__(self, record):
+        self._record = record
+    
+    def status(self, vaccine):
+        """Return 'Y' or 'N' for a VACCINATION_FIELDS key"""
+        return getattr(self._record, vaccine)
+    
+    def date(self, vaccine):
+        """Return the vaccination date for a VACCINATION_FIELDS key"""
+        return getattr(self._record, f"{vaccine}_date")
+    
+    def missing(self):
+        """Return the vaccines not marked 'Y'"""
+        return [vaccine for vaccine in VACCINATION_FIELDS if self.status(vaccine) != 'Y']
+    
+    def __iter__(self):
+        """Yield (label, status, date) for each vaccine"""
+        for vaccine in VACCINATION_FIELDS:
+            yield VACCINE_LABELS[vaccine], self.status(vaccine), self.date(vaccine)
+
+def record_fields(columns, *required):
+    """Validate a column projection; returns the StudentRecord fields to select"""
+    fields = tuple(columns) if columns else RECORD_FIELDS
+    unknown = [field for field in fields + required if field not in FIELD_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown record fields: {', '.join(unknown)}")
+    # Paging needs the cursor columns even if the caller did not ask for them
+    return fields + tuple(field for field in required if field not in fields)
+
+def record_query(fields, conditions=(), params=(), sort_by=None, after=None, limit=None):
+    """Build a records SELECT with optional keyset pagination
+    
+    Rows are ordered by (SORT_KEYS[sort_by], AdminNo), or AdminNo alone,
+    which the composite (sort_key, AdminNo) indexes serve directly.
+    `after` is the page_cursor() of the last row already seen, so every
+    page is an index range scan no matter how deep it is.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after is not None:
+        if sort_by is None:
+            conditions.append("AdminNo > %s")
+            params.append(after[-1])
+        else:
+            # Expanded form of (key, AdminNo) > (%s, %s) that MySQL can range-scan
+            column = SORT_KEYS[sort_by]
+            conditions.append(f"({column} > %s OR ({column} = %s AND AdminNo > %s))")
+            params.extend([after[0], after[0], after[1]])
+    
+    query = f"SELECT {', '.join(FIELD_COLUMNS[field] for field in fields)} FROM records"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if sort_by is None:
+        query += " ORDER BY AdminNo ASC"
+    else:
+        query += f" ORDER BY {SORT_KEYS[sort_by]} ASC, AdminNo ASC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(int(limit))
+    return query, params
+
+def vaccine_key(name):
+    """Return the stored name of a vaccine, or None if the name is invalid"""
+    key = normalize_vaccine(name)
+    return VACCINE_ALIASES.get(key, key)
+
+def vaccination_rows(admin_no, student_data):
+    """Build student_vaccinations rows for the 'Y' vaccines in student_data"""
+    return [
+        (admin_no, vaccine, 1, student_data.get(f"{vaccine}_date") or None)
+        for vaccine in VACCINATION_FIELDS
+        if (student_data.get(vaccine) or 'N').upper() == 'Y'
+    ]
+
+def sync_vaccination(cr, admin_no, vaccine, status, date):
+    """Mirror a legacy Y/N vaccine column edit into student_vaccinations
+    
+    'Y' records dose 1 if the student has no dose yet, otherwise sets the
+    date of the latest dose; 'N' removes every dose of the vaccine.
+    """
+    if (status or 'N').upper() != 'Y':
+        cr.execute(
+            "DELETE FROM student_vaccinations WHERE AdminNo = %s AND Vaccine = %s",
+            (admin_no, vaccine)
+        )
+        return
+    cr.execute(
+        "SELECT MAX(Dose) FROM student_vaccinations WHERE AdminNo = %s AND Vaccine = %s",
+        (admin_no, vaccine)
+    )
+    latest = cr.fetchone()[0]
+    if latest is None:
+        cr.execute(INSERT_VACCINATION, (admin_no, vaccine, 1, date or None))
+    elif date:
+        cr.execute(
+            "UPDATE student_vaccinations SET Date = %s WHERE AdminNo = %s AND Vaccine = %s AND Dose = %s",
+            (date, admin_no, vaccine, latest)
+        )
+
+def measurement_rows(admin_no, student_data, measured_at):
+    """Build the measurements row for student_data's height and weight, if any"""
+    height, weight = student_data.get('height'), student_data.get('weight')
+    if height is None and weight is None:
+        return []
+    return [(admin_no, measured_at, height, weight)]
+
+def now_timestamp():
+    """Current local time as a DATETIME string"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def allergy_rows(admin_no, allergies):
+    """Build student_allergies rows for a free-text allergy note"""
+    return [(term, admin_no) for term in tokenize_allergies(allergies)]
+
+def sync_allergies(cr, admin_no, allergies):
+    """Replace a student's indexed allergy terms"""
+    cr.execute("DELETE FROM student_allergies WHERE AdminNo = %s", (admin_no,))
+    rows = allergy_rows(admin_no, allergies)
+    if rows:
+        cr.executemany(INSERT_ALLERGY, rows)
+
+def allergy_condition(query_term):
+    """Return (SQL, params) matching student_allergies rows for one query term
+    
+    A trailing '*' makes it a prefix match, written as a half-open range
+    on Term so it stays a primary-key range scan.
+    """
+    if query_term.endswith('*'):
+        prefix = query_term.rstrip('*').lower()
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return "Term >= %s AND Term < %s", [prefix, upper]
+    return "Term = %s", [normalize_allergy_term(query_term)]
+
+def validate_student_data(admin_no, student_data):
+    """Return an error message for invalid student data, or None"""
+    if not validate_admin_no(admin_no):
+        return "Invalid Admin No."
+    if not student_data.get('name'):
+        return "Student name is required"
+    if not validate_sex(student_data['sex']):
+        return "Invalid sex value (M/F/Other)"
+    if not validate_age(student_data['age']):
+        return "Age must be between 5 and 25"
+    if not validate_date(student_data['dob']):
+        return "Invalid date format for DoB (YYYY-MM-DD)"
+    if not validate_blood_group(student_data['blood_group']):
+        return "Invalid blood group"
+    for field in VACCINATION_FIELDS:
+        if not validate_vaccination_status(student_data.get(field) or 'N'):
+            return f"Invalid vaccination status for {field} (Y/N)"
+        date = student_data.get(f"{field}_date")
+        if date and not validate_date(date):
+            return f"Invalid date format for {field}_date (YYYY-MM-DD)"
+    return None
+
+def record_params(admin_no, student_data):
+    """Build the INSERT_RECORD parameters for validated student data"""
+    return (
+        admin_no,
+        student_data['name'],
+        normalize_sex(student_data['sex']),
+        student_data.get('mother_name'),
+        student_data.get('father_name'),
+        student_data['age'],
+        student_data['class_sec'],
+        student_data['dob'],
+        student_data['blood_group'].upper(),
+        student_data.get('height'),
+        student_data.get('weight'),
+        student_data.get('allergies'),
+        (student_data.get('tetanus') or 'N').upper(),
+        student_data.get('tetanus_date'),
+        (student_data.get('cholera') or 'N').upper(),
+        student_data.get('cholera_date'),
+        (student_data.get('typhoid') or 'N').upper(),
+        student_data.get('typhoid_date'),
+        (student_data.get('hep_a') or 'N').upper(),
+        student_data.get('hep_a_date'),
+        (student_data.get('hep_b') or 'N').upper(),
+        student_data.get('hep_b_date'),
+        (student_data.get('chicken_pox') or 'N').upper(),
+        student_data.get('chicken_pox_date'),
+        (student_data.get('measles') or 'N').upper(),
+        student_data.get('measles_date'),
+        (student_data.get('covid') or 'N').upper(),
+        student_data.get('covid_date'),
+        student_data.get('other_info')
+    )
+
+def read_import_rows(f, file_format):
+    """Yield (line_number, row_dict) from an open CSV or NDJSON file"""
+    if file_format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError:
+                yield line_no, {'_error': "Invalid JSON"}
+
+def coerce_import_row(raw):
+    """Convert an import row into (admin_no, student_data); raises ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError("Row is not an object")
+    if '_error' in raw:
+        raise ValueError(raw['_error'])
+    
+    def text(key, max_length=None):
+        value = raw.get(key)
+        if value is None or str(value).strip() == '':
+            return None
+        return sanitize_string(str(value), max_length)
+    
+    def number(key, kind):
+        value = text(key)
+        if value is None:
+            return None
+        try:
+            return kind(value)
+        except ValueError:
+            raise ValueError(f"Invalid {key}: {value}")
+    
+    admin_no = number('admin_no', int)
+    if admin_no is None:
+        raise ValueError("admin_no is required")
+    for key in ('name', 'sex', 'age', 'class_sec', 'dob', 'blood_group'):
+        if text(key) is None:
+            raise ValueError(f"{key} is required")
+    
+    student_data = {
+        'name': text('name', 25),
+        'sex': text('sex'),
+        'mother_name': text('mother_name', 20),
+        'father_name': text('father_name', 20),
+        'age': number('age', int),
+        'class_sec': text('class_sec', 10),
+        'dob': text('dob'),
+        'blood_group': text('blood_group'),
+        'height': number('height', float),
+        'weight': number('weight', float),
+        'allergies': text('allergies', 255),
+        'other_info': text('other_info', 255)
+    }
+    for field in VACCINATION_FIELDS:
+        student_data[field] = (text(field) or 'N').upper()
+        student_data[f"{field}_date"] = text(f"{field}_date")
+    return admin_no, student_data
+
+class RecordCache:
+    """Thread-safe LRU cache of student records with a time-to-live"""
+    
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # admin_no -> (expires_at, record)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a read that raced a write is not cached
+        self._generation = 0
+    
+    def get(self, admin_no):
+        """Return (record, token); record is None on a miss"""
+        with self._lock:
+            entry = self._entries.get(admin_no)
+            if entry is not None:
+                expires_at, record = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(admin_no)
+                    self.hits += 1
+                    return record, self._generation
+                del self._entries[admin_no]
+            self.misses += 1
+            return None, self._generation
+    
+    def put(self, admin_no, record, token):
+        """Cache a record read after get() returned `token`"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if token != self._generation:
+                return
+            self._entries[admin_no] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(admin_no)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, *admin_nos):
+        """Drop cached records for the given students"""
+        with self._lock:
+            self._generation += 1
+            for admin_no in admin_nos:
+                self._entries.pop(admin_no, None)
+    
+    def clear(self):
+        """Drop every cached record"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+    
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+RECORD_CACHE = RecordCache(
+    max_size=int(os.getenv('RECORD_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('RECORD_CACHE_TTL', '300'))
+)
+
+def load_admin_state(admin_id):
+    """Return (Role, IsActive, LockedUntil) for an admin, or None"""
+    try:
+        with get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("SELECT Role, IsActive, LockedUntil FROM admins WHERE AdminID = %s", (admin_id,))
+            row = cr.fetchone()
+            cr.close()
+        return tuple(row) if row else None
+    except db.DatabaseError as e:
+        logger.error(f"Error loading admin state: {e}")
+        return None
+
+# Admin session tokens and cached role/state used by the permission checks
+SESSIONS = SessionManager(
+    load_admin_state,
+    secret=os.getenv('SESSION_SECRET'),
+    ttl=float(os.getenv('SESSION_TTL', str(8 * 3600))),
+    cache_ttl=float(os.getenv('SESSION_CACHE_TTL', '30'))
+)
+
+# Trigram index of student names for fuzzy_search, reloaded after NAME_INDEX_TTL
+# seconds so writes made by other processes are picked up
+NAME_INDEX = TrigramIndex(ttl=float(os.getenv('NAME_INDEX_TTL', '600')))
+
 class StudentRecords:
     """Handle student record operations"""
     
     @staticmethod
-    def create_user(admin_no, student_name):
+    @SESSIONS.requires('write')
+    def create_user(admin_no, admin_id, student_name):
         """Create a new user"""
         try:
             if not validate_admin_no(admin_no):
                 return False, "Invalid Admin No."
             
-            conn = create_connection()
-            cr = conn.cursor()
-            cr.execute(
-                "INSERT INTO users (AdminNo, Sname) VALUES (%s, %s)",
-                (admin_no, student_name)
-            )
-            conn.commit()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(
+                    "INSERT INTO users (AdminNo, Sname) VALUES (%s, %s)",
+                    (admin_no, student_name)
+                )
+                conn.commit()
+                cr.close()
             return True, "User created successfully"
-        except sql.IntegrityError:
+        except db.IntegrityError:
             logger.warning(f"Duplicate Admin No.: {admin_no}")
             return False, "Admin No. already exists"
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error creating user: {e}")
             return False, str(e)
     
     @staticmethod
-    def create_record(admin_no, student_data):
+    @SESSIONS.requires('write')
+    def create_record(admin_no, admin_id, student_data):
         """Create a complete student record with validation"""
         try:
             # Validate all fields
-            if not validate_admin_no(admin_no):
-                return False, "Invalid Admin No."
-            if not validate_sex(student_data['sex']):
-                return False, "Invalid sex value (M/F/Other)"
-            if not validate_age(student_data['age']):
-                return False, "Age must be between 5 and 25"
-            if not validate_date(student_data['dob']):
-                return False, "Invalid date format for DoB (YYYY-MM-DD)"
-            if not validate_blood_group(student_data['blood_group']):
-                return False, "Invalid blood group"
-            
-            conn = create_connection()
-            cr = conn.cursor()
+            error = validate_student_data(admin_no, student_data)
+            if error:
+                return False, error
             
-            cr.execute("""
-                INSERT INTO records VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-            """, (
-                admin_no,
-                student_data['name'],
-                student_data['sex'].upper(),
-                student_data.get('mother_name'),
-                student_data.get('father_name'),
-                student_data['age'],
-                student_data['class_sec'],
-                student_data['dob'],
-                student_data['blood_group'].upper(),
-                student_data.get('height'),
-                student_data.get('weight'),
-                student_data.get('allergies'),
-                student_data.get('tetanus', 'N'),
-                student_data.get('tetanus_date'),
-                student_data.get('cholera', 'N'),
-                student_data.get('cholera_date'),
-                student_data.get('typhoid', 'N'),
-                student_data.get('typhoid_date'),
-                student_data.get('hep_a', 'N'),
-                student_data.get('hep_a_date'),
-                student_data.get('hep_b', 'N'),
-                student_data.get('hep_b_date'),
-                student_data.get('chicken_pox', 'N'),
-                student_data.get('chicken_pox_date'),
-                student_data.get('measles', 'N'),
-                student_data.get('measles_date'),
-                student_data.get('covid', 'N'),
-                student_data.get('covid_date'),
-                student_data.get('other_info')
-            ))
-            
-            conn.commit()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                with track_summary(cr, [admin_no]):
+                    cr.execute(INSERT_RECORD, record_params(admin_no, student_data))
+                    vaccinations = vaccination_rows(admin_no, student_data)
+                    if vaccinations:
+                        cr.executemany(INSERT_VACCINATION, vaccinations)
+                sync_allergies(cr, admin_no, student_data.get('allergies'))
+                measurements = measurement_rows(admin_no, student_data, now_timestamp())
+                if measurements:
+                    cr.executemany(INSERT_MEASUREMENT, measurements)
+                conn.commit()
+                cr.close()
+            RECORD_CACHE.invalidate(admin_no)
+            NAME_INDEX.add(admin_no, student_data['name'])
             return True, "Record created successfully"
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error creating record: {e}")
             return False, str(e)
     
     @staticmethod
-    def get_record(admin_no):
-        """Get a student record"""
+    @SESSIONS.requires('write')
+    def bulk_import(path, admin_id, file_format=None, chunk_size=500):
+        """Import students from a CSV or NDJSON file in chunked transactions
+        
+        Rows use the student_data keys plus 'admin_no'. Each chunk of valid
+        rows is inserted into users and records with executemany in one
+        transaction; invalid or duplicate rows are reported, not fatal.
+        Returns (True, report) with 'imported', 'failed' and 'errors', a
+        list of (line, admin_no, message), or (False, message).
+        """
+        if file_format is None:
+            file_format = 'ndjson' if path.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+        if file_format not in ('csv', 'ndjson'):
+            return False, "Unsupported format (csv/ndjson)"
+        
+        report = {'imported': 0, 'failed': 0, 'errors': []}
+        seen = set()
+        chunk = []
+        
+        def fail(line_no, admin_no, message):
+            report['failed'] += 1
+            report['errors'].append((line_no, admin_no, message))
+        
         try:
-            conn = create_connection()
+            with open(path, 'r', newline='', encoding='utf-8') as f:
+                for line_no, raw in read_import_rows(f, file_format):
+                    try:
+                        admin_no, student_data = coerce_import_row(raw)
+                    except (ValueError, TypeError) as e:
+                        fail(line_no, raw.get('admin_no') if isinstance(raw, dict) else None, str(e))
+                        continue
+                    
+                    error = validate_student_data(admin_no, student_data)
+                    if not error and admin_no in seen:
+                        error = "Duplicate Admin No. in file"
+                    if error:
+                        fail(line_no, admin_no, error)
+                        continue
+                    
+                    seen.add(admin_no)
+                    chunk.append((line_no, admin_no, student_data))
+                    if len(chunk) >= chunk_size:
+                        StudentRecords._import_chunk(chunk, admin_id, report, fail)
+                        chunk = []
+            
+            if chunk:
+                StudentRecords._import_chunk(chunk, admin_id, report, fail)
+        except OSError as e:
+            logger.error(f"Error reading import file: {e}")
+            return False, str(e)
+        except db.DatabaseError as e:
+            logger.error(f"Error importing students: {e}")
+            return False, str(e)
+        
+        report['errors'].sort(key=lambda error: error[0])
+        logger.info(f"Bulk import from {path}: {report['imported']} imported, {report['failed']} failed")
+        return True, report
+    
+    @staticmethod
+    def _import_chunk(chunk, admin_id, report, fail):
+        """Insert one chunk of validated rows in a single transaction"""
+        with get_connection() as conn:
             cr = conn.cursor()
-            cr.execute("SELECT * FROM records WHERE AdminNo = %s", (admin_no,))
-            record = cr.fetchone()
+            
+            # Existing students are reported instead of failing the chunk
+            admin_nos = [admin_no for _, admin_no, _ in chunk]
+            cr.execute(
+                f"SELECT AdminNo FROM users WHERE AdminNo IN ({', '.join(['%s'] * len(admin_nos))})",
+                admin_nos
+            )
+            existing = {row[0] for row in cr.fetchall()}
+            rows = []
+            for line_no, admin_no, student_data in chunk:
+                if admin_no in existing:
+                    fail(line_no, admin_no, "Admin No. already exists")
+                else:
+                    rows.append((line_no, admin_no, student_data))
+            
+            try:
+                cr.executemany(
+                    "INSERT INTO users (AdminNo, Sname) VALUES (%s, %s)",
+                    [(admin_no, data['name']) for _, admin_no, data in rows]
+                )
+                with track_summary(cr, [admin_no for _, admin_no, _ in rows]):
+                    cr.executemany(INSERT_RECORD, [record_params(admin_no, data) for _, admin_no, data in rows])
+                    vaccinations = [row for _, admin_no, data in rows for row in vaccination_rows(admin_no, data)]
+                    if vaccinations:
+                        cr.executemany(INSERT_VACCINATION, vaccinations)
+                allergies = [row for _, admin_no, data in rows for row in allergy_rows(admin_no, data.get('allergies'))]
+                if allergies:
+                    cr.executemany(INSERT_ALLERGY, allergies)
+                measured_at = now_timestamp()
+                measurements = [row for _, admin_no, data in rows for row in measurement_rows(admin_no, data, measured_at)]
+                if measurements:
+                    cr.executemany(INSERT_MEASUREMENT, measurements)
+                conn.commit()
+                imported = rows
+            except db.DatabaseError as e:
+                # Fall back to row-by-row so the error lands on the right row
+                logger.warning(f"Import chunk failed ({e}); retrying row by row")
+                conn.rollback()
+                imported = []
+                for line_no, admin_no, data in rows:
+                    try:
+                        cr.execute("INSERT INTO users (AdminNo, Sname) VALUES (%s, %s)", (admin_no, data['name']))
+                        with track_summary(cr, [admin_no]):
+                            cr.execute(INSERT_RECORD, record_params(admin_no, data))
+                            for vaccination in vaccination_rows(admin_no, data):
+                                cr.execute(INSERT_VACCINATION, vaccination)
+                        sync_allergies(cr, admin_no, data.get('allergies'))
+                        for measurement in measurement_rows(admin_no, data, now_timestamp()):
+                            cr.execute(INSERT_MEASUREMENT, measurement)
+                        conn.commit()
+                        imported.append((line_no, admin_no, data))
+                    except db.DatabaseError as row_error:
+                        conn.rollback()
+                        fail(line_no, admin_no, str(row_error))
             cr.close()
-            conn.close()
+        
+        RECORD_CACHE.invalidate(*(admin_no for _, admin_no, _ in imported))
+        for _, admin_no, data in imported:
+            NAME_INDEX.add(admin_no, data['name'])
+        report['imported'] += len(imported)
+        if admin_id is not None and imported:
+            get_audit_writer().log_many([
+                make_event(admin_id, 'CREATE', admin_no, ['bulk_import'])
+                for _, admin_no, _ in imported
+            ])
+    
+    @staticmethod
+    def authenticate_student(admin_no, student_name):
+        """Check a student's Admin No. and name with one primary-key lookup
+        
+        Only Sname is read (or a cached record is reused); the full record
+        is left for the caller to load when needed. Returns
+        (admin_no, message) on success or (None, message).
+        """
+        record, _ = RECORD_CACHE.get(admin_no)
+        try:
+            if record is not None:
+                stored_name = record.name
+            else:
+                with get_connection() as conn:
+                    cr = conn.cursor()
+                    cr.execute("SELECT Sname FROM records WHERE AdminNo = %s", (admin_no,))
+                    row = cr.fetchone()
+                    cr.close()
+                stored_name = row[0] if row else None
+        except db.DatabaseError as e:
+            logger.error(f"Error authenticating student: {e}")
+            return None, "Login unavailable, please try again"
+        
+        if stored_name is None or stored_name != student_name:
+            return None, "Invalid credentials"
+        return admin_no, "Login successful"
+    
+    @staticmethod
+    def get_record(admin_no):
+        """Get a student record (served from RECORD_CACHE when possible)"""
+        record, token = RECORD_CACHE.get(admin_no)
+        if record is not None:
+            return record
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(SELECT_RECORD + " WHERE AdminNo = %s", (admin_no,))
+                row = cr.fetchone()
+                cr.close()
+            if row is None:
+                return None
+            record = StudentRecord.from_row(row)
+            RECORD_CACHE.put(admin_no, record, token)
             return record
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error retrieving record: {e}")
             return None
     
     @staticmethod
-    def get_all_records():
-        """Get all student records"""
+    def get_all_records(sort_by=None, columns=None, after=None, limit=None):
+        """Get student records, optionally sorted, projected and paged
+        
+        `sort_by` is a SORT_KEYS key, `columns` the StudentRecord fields to
+        fetch, and `after`/`limit` select a keyset page (see page_cursor).
+        """
+        fields = record_fields(columns, *StudentRecords._cursor_fields(sort_by))
+        query, params = record_query(fields, sort_by=sort_by, after=after, limit=limit)
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            cr.execute("SELECT * FROM records")
-            records = cr.fetchall()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(query, params or None)
+                records = [StudentRecord.from_row(row, fields) for row in cr.fetchall()]
+                cr.close()
             return records
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error retrieving records: {e}")
             return []
     
     @staticmethod
-    def search_records(field, value):
-        """Search records by field"""
-        try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            if field == "name":
-                cr.execute("SELECT * FROM records WHERE Sname LIKE %s", (f"%{value}%",))
-            elif field == "class":
-                cr.execute("SELECT * FROM records WHERE ClassSec = %s", (value,))
-            elif field == "admin_no":
-                cr.execute("SELECT * FROM records WHERE AdminNo = %s", (value,))
+    def iter_records(filter=None, columns=None, batch_size=1000):
+        """Yield StudentRecords one at a time without buffering the table
+        
+        `filter` maps StudentRecord attributes to a required value (or a
+        list/tuple/set of accepted values) and `columns` limits the
+        attributes fetched (default: all). Rows are
+        read through a streaming cursor (an unbuffered SSCursor on MySQL)
+        `batch_size` at a time, so memory stays flat for any table size.
+        The pooled connection is held until the generator is exhausted or
+        closed; database errors propagate to the caller.
+        """
+        fields = record_fields(columns)
+        unknown = [field for field in filter or () if field not in FIELD_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown record fields: {', '.join(unknown)}")
+        
+        query = f"SELECT {', '.join(FIELD_COLUMNS[field] for field in fields)} FROM records"
+        conditions = []
+        params = []
+        for field, value in (filter or {}).items():
+            if value is None:
+                conditions.append(f"{FIELD_COLUMNS[field]} IS NULL")
+            elif isinstance(value, (list, tuple, set, frozenset)):
+                values = sorted(value)
+                conditions.append(
+                    f"{FIELD_COLUMNS[field]} IN ({', '.join(['%s'] * len(values))})" if values else "1 = 0"
+                )
+                params.extend(values)
             else:
-                return []
-            
-            records = cr.fetchall()
-            cr.close()
-            conn.close()
+                conditions.append(f"{FIELD_COLUMNS[field]} = %s")
+                params.append(value)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        with get_connection() as conn:
+            cr = stream_cursor(conn)
+            try:
+                cr.execute(query, params or None)
+                while True:
+                    rows = cr.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield StudentRecord.from_row(row, fields)
+            finally:
+                cr.close()
+    
+    @staticmethod
+    def search_records(field, value, columns=None, sort_by=None, after=None, limit=None):
+        """Search records by field ("name", "class" or "admin_no")
+        
+        Accepts the same projection and keyset paging arguments as
+        get_all_records.
+        """
+        if field == "name":
+            condition, param = "Sname LIKE %s", f"%{value}%"
+        elif field == "class":
+            condition, param = "ClassSec = %s", value
+        elif field == "admin_no":
+            condition, param = "AdminNo = %s", value
+        else:
+            return []
+        
+        fields = record_fields(columns, *StudentRecords._cursor_fields(sort_by))
+        query, params = record_query(fields, [condition], [param], sort_by, after, limit)
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(query, params)
+                records = [StudentRecord.from_row(row, fields) for row in cr.fetchall()]
+                cr.close()
             return records
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error searching records: {e}")
             return []
     
     @staticmethod
+    def search_allergies(query, match='any', columns=('admin_no', 'name', 'age', 'class_sec', 'allergies')):
+        """Find students by allergy terms using the student_allergies index
+        
+        `query` is one or more words; each is matched as a whole, normalized
+        term ('peanuts' finds 'Peanut', 'nut' does not), or as a prefix when
+        it ends in '*'. `match` is 'any' (OR) or 'all' (AND). Returns
+        StudentRecords projected to `columns`, ordered by class and name.
+        """
+        terms = [
+            word for word in re.findall(r'[a-z0-9]+\*?', (query or '').lower())
+            if word.rstrip('*') and (word.endswith('*') or normalize_allergy_term(word) not in ALLERGY_STOPWORDS)
+        ]
+        if not terms:
+            return []
+        fields = record_fields(columns)
+        
+        subqueries = []
+        params = []
+        for term in terms:
+            condition, term_params = allergy_condition(term)
+            subqueries.append(f"AdminNo IN (SELECT AdminNo FROM student_allergies WHERE {condition})")
+            params.extend(term_params)
+        joiner = " AND " if match == 'all' else " OR "
+        
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(f"""
+                    SELECT {', '.join(FIELD_COLUMNS[field] for field in fields)} FROM records
+                    WHERE {joiner.join(subqueries)}
+                    ORDER BY ClassSec, Sname, AdminNo
+                """, params)
+                records = [StudentRecord.from_row(row, fields) for row in cr.fetchall()]
+                cr.close()
+            return records
+        except db.DatabaseError as e:
+            logger.error(f"Error searching allergies: {e}")
+            return []
+    
+    @staticmethod
+    def fuzzy_search(name, limit=10, min_score=0.3):
+        """Rank students by trigram similarity to a possibly misspelt name
+        
+        Returns up to `limit` (StudentRecord, score) pairs, best first, with
+        the admin_no, name, age and class_sec fields. The in-process
+        NAME_INDEX is loaded from the database on first use.
+        """
+        try:
+            if not NAME_INDEX.is_fresh():
+                NAME_INDEX.load(
+                    (record.admin_no, record.name)
+                    for record in StudentRecords.iter_records(columns=('admin_no', 'name'))
+                )
+            hits = NAME_INDEX.search(name, limit, min_score)
+            if not hits:
+                return []
+            
+            fields = ('admin_no', 'name', 'age', 'class_sec')
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(
+                    f"SELECT AdminNo, Sname, Age, ClassSec FROM records WHERE AdminNo IN ({', '.join(['%s'] * len(hits))})",
+                    [admin_no for admin_no, _, _ in hits]
+                )
+                records = {row[0]: StudentRecord.from_row(row, fields) for row in cr.fetchall()}
+                cr.close()
+            return [(records[admin_no], score) for admin_no, _, score in hits if admin_no in records]
+        except db.DatabaseError as e:
+            logger.error(f"Error in fuzzy name search: {e}")
+            return []
+    
+    @staticmethod
+    def page_cursor(record, sort_by=None):
+        """Return the `after` value that continues a listing past `record`"""
+        if sort_by is None:
+            return (record.admin_no,)
+        return (getattr(record, SORT_FIELDS[sort_by]), record.admin_no)
+    
+    @staticmethod
+    def _cursor_fields(sort_by):
+        if sort_by is None:
+            return ('admin_no',)
+        return (SORT_FIELDS[sort_by], 'admin_no')
+    
+    @staticmethod
+    @SESSIONS.requires('write')
     def update_record(admin_no, admin_id, **kwargs):
         """Update a student record with audit logging"""
         try:
@@ -166,72 +940,497 @@ class StudentRecords:
             if not old_record:
                 return False, "Record not found"
             
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            # Build update query
-            updates = []
-            params = []
-            changed_fields = []
-            
-            valid_fields = {
-                'height': 'Height', 'weight': 'Weight', 'class_sec': 'ClassSec',
-                'allergies': 'Allergies', 'tetanus': 'Tetanus', 'tetanus_date': 'TetanusDate',
-                'cholera': 'Cholera', 'cholera_date': 'CholeraDate',
-                'typhoid': 'Typhoid', 'typhoid_date': 'TyphoidDate',
-                'hep_a': 'HepA', 'hep_a_date': 'HepADate',
-                'hep_b': 'HepB', 'hep_b_date': 'HepBDate',
-                'chicken_pox': 'ChickenPox', 'chicken_pox_date': 'ChickenPoxDate',
-                'measles': 'Measles', 'measles_date': 'MeaslesDate',
-                'covid': 'COVID', 'covid_date': 'COVIDDate',
-                'other_info': 'AnyOther'
-            }
-            
-            for key, value in kwargs.items():
-                if key in valid_fields:
-                    updates.append(f"{valid_fields[key]} = %s")
-                    params.append(value)
-                    changed_fields.append(key)
-            
-            if not updates:
-                return False, "No valid fields to update"
-            
-            params.append(admin_no)
-            query = "UPDATE records SET " + ", ".join(updates) + " WHERE AdminNo = %s"
-            cr.execute(query, params)
-            
-            # Log audit
-            log_audit(admin_id, 'UPDATE', admin_no, changed_fields)
-            
-            conn.commit()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                
+                # Build update query
+                updates = []
+                params = []
+                changed_fields = []
+                
+                valid_fields = {
+                    'height': 'Height', 'weight': 'Weight', 'class_sec': 'ClassSec',
+                    'allergies': 'Allergies', 'tetanus': 'Tetanus', 'tetanus_date': 'TetanusDate',
+                    'cholera': 'Cholera', 'cholera_date': 'CholeraDate',
+                    'typhoid': 'Typhoid', 'typhoid_date': 'TyphoidDate',
+                    'hep_a': 'HepA', 'hep_a_date': 'HepADate',
+                    'hep_b': 'HepB', 'hep_b_date': 'HepBDate',
+                    'chicken_pox': 'ChickenPox', 'chicken_pox_date': 'ChickenPoxDate',
+                    'measles': 'Measles', 'measles_date': 'MeaslesDate',
+                    'covid': 'COVID', 'covid_date': 'COVIDDate',
+                    'other_info': 'AnyOther'
+                }
+                
+                for key, value in kwargs.items():
+                    if key in valid_fields:
+                        updates.append(f"{valid_fields[key]} = %s")
+                        params.append(value)
+                        changed_fields.append(key)
+                
+                if not updates:
+                    return False, "No valid fields to update"
+                
+                params.append(admin_no)
+                query = "UPDATE records SET " + ", ".join(updates) + " WHERE AdminNo = %s"
+                with track_summary(cr, [admin_no]):
+                    cr.execute(query, params)
+                    
+                    # Keep student_vaccinations in step with the legacy columns
+                    for vaccine in VACCINATION_FIELDS:
+                        if vaccine in kwargs or f"{vaccine}_date" in kwargs:
+                            sync_vaccination(
+                                cr, admin_no, vaccine,
+                                kwargs.get(vaccine, getattr(old_record, vaccine)),
+                                kwargs.get(f"{vaccine}_date", getattr(old_record, f"{vaccine}_date"))
+                            )
+                
+                if 'allergies' in kwargs:
+                    sync_allergies(cr, admin_no, kwargs['allergies'])
+                
+                if 'height' in kwargs or 'weight' in kwargs:
+                    cr.execute(INSERT_MEASUREMENT, (
+                        admin_no, now_timestamp(),
+                        kwargs.get('height', old_record.height), kwargs.get('weight', old_record.weight)
+                    ))
+                
+                # Log audit
+                log_audit(admin_id, 'UPDATE', admin_no, changed_fields)
+                
+                conn.commit()
+                cr.close()
+            RECORD_CACHE.invalidate(admin_no)
             return True, "Record updated successfully"
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error updating record: {e}")
             return False, str(e)
     
     @staticmethod
+    @SESSIONS.requires('write')
+    def bulk_update_measurements(measurements, admin_id, chunk_size=1000, measured_at=None):
+        """Apply many (admin_no, height, weight) updates in one transaction
+        
+        Each chunk is applied with a single multi-row CASE UPDATE; a None
+        height or weight leaves that column unchanged. Every updated
+        student gets a measurements row stamped `measured_at` (default
+        now), so a measurement day can be entered later. Unknown students,
+        invalid values and malformed items are reported rather than
+        aborting the run, and one batch of UPDATE audit events is queued
+        at the end. Returns (True, report) with 'updated', 'failed' and
+        'errors', a list of (position, admin_no, message) where admin_no
+        is None for a malformed item, or (False, message) if the
+        transaction was rolled back.
+        """
+        report = {'updated': 0, 'failed': 0, 'errors': []}
+        
+        def fail(position, admin_no, message):
+            report['failed'] += 1
+            report['errors'].append((position, admin_no, message))
+        
+        # Validate up front; a later row for the same student wins
+        pending = {}
+        for position, item in enumerate(measurements, 1):
+            try:
+                admin_no, height, weight = item
+            except (TypeError, ValueError):
+                fail(position, None, "Expected (admin_no, height, weight)")
+                continue
+            try:
+                admin_no = int(admin_no)
+                height = float(height) if height not in (None, '') else None
+                weight = float(weight) if weight not in (None, '') else None
+            except (TypeError, ValueError):
+                fail(position, admin_no, "Invalid number")
+                continue
+            if height is None and weight is None:
+                fail(position, admin_no, "No measurement given")
+            elif (height is not None and height <= 0) or (weight is not None and weight <= 0):
+                fail(position, admin_no, "Height and weight must be positive")
+            else:
+                pending[admin_no] = (position, height, weight)
+        
+        events = []
+        history = []
+        measured_at = measured_at or now_timestamp()
+        items = list(pending.items())
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                for start in range(0, len(items), chunk_size):
+                    chunk = items[start:start + chunk_size]
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    cr.execute(
+                        f"SELECT AdminNo, Height, Weight FROM records WHERE AdminNo IN ({placeholders})",
+                        [admin_no for admin_no, _ in chunk]
+                    )
+                    old = {row[0]: (row[1], row[2]) for row in cr.fetchall()}
+                    
+                    found = []
+                    for admin_no, (position, height, weight) in chunk:
+                        if admin_no in old:
+                            found.append((admin_no, height, weight))
+                        else:
+                            fail(position, admin_no, "Record not found")
+                    if not found:
+                        continue
+                    
+                    cases = ' '.join(['WHEN %s THEN COALESCE(%s, Height)'] * len(found))
+                    weight_cases = ' '.join(['WHEN %s THEN COALESCE(%s, Weight)'] * len(found))
+                    params = [value for admin_no, height, _ in found for value in (admin_no, height)]
+                    params += [value for admin_no, _, weight in found for value in (admin_no, weight)]
+                    params += [admin_no for admin_no, _, _ in found]
+                    with track_summary(cr, [admin_no for admin_no, _, _ in found]):
+                        cr.execute(f"""
+                            UPDATE records
+                            SET Height = CASE AdminNo {cases} ELSE Height END,
+                                Weight = CASE AdminNo {weight_cases} ELSE Weight END
+                            WHERE AdminNo IN ({', '.join(['%s'] * len(found))})
+                        """, params)
+                    
+                    for admin_no, height, weight in found:
+                        old_height, old_weight = old[admin_no]
+                        new_height = old_height if height is None else height
+                        new_weight = old_weight if weight is None else weight
+                        history.append((admin_no, measured_at, new_height, new_weight))
+                        events.append(make_event(
+                            admin_id, 'UPDATE', admin_no, ['height', 'weight'],
+                            {'height': old_height, 'weight': old_weight},
+                            {'height': new_height, 'weight': new_weight}
+                        ))
+                
+                if history:
+                    cr.executemany(INSERT_MEASUREMENT, history)
+                conn.commit()
+                cr.close()
+        except db.DatabaseError as e:
+            logger.error(f"Error applying bulk measurements: {e}")
+            return False, str(e)
+        
+        RECORD_CACHE.invalidate(*(event[1] for event in events))
+        report['updated'] = len(events)
+        get_audit_writer().log_many(events)
+        report['errors'].sort(key=lambda error: error[0])
+        logger.info(f"Bulk measurement update: {report['updated']} updated, {report['failed']} failed")
+        return True, report
+    
+    @staticmethod
+    @SESSIONS.requires('write')
+    def add_vaccination(admin_no, admin_id, vaccine, date=None, dose=None):
+        """Record a vaccine dose (the next dose unless `dose` is given)
+        
+        Any vaccine name is accepted; for the eight legacy vaccines the
+        Y/N and date columns on records are updated to match.
+        """
+        vaccine = vaccine_key(vaccine)
+        if vaccine is None:
+            return False, "Invalid vaccine name"
+        if date and not validate_date(str(date)):
+            return False, "Invalid date format (YYYY-MM-DD)"
+        if dose is not None and dose < 1:
+            return False, "Dose must be 1 or more"
+        
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                if dose is None:
+                    cr.execute(
+                        "SELECT COALESCE(MAX(Dose), 0) + 1 FROM student_vaccinations WHERE AdminNo = %s AND Vaccine = %s",
+                        (admin_no, vaccine)
+                    )
+                    dose = cr.fetchone()[0]
+                with track_summary(cr, [admin_no]):
+                    cr.execute(
+                        upsert_sql('student_vaccinations', ('AdminNo', 'Vaccine', 'Dose', 'Date'), ('AdminNo', 'Vaccine', 'Dose')),
+                        (admin_no, vaccine, dose, date or None)
+                    )
+                    
+                    if vaccine in VACCINATION_FIELDS:
+                        column = FIELD_COLUMNS[vaccine]
+                        cr.execute(f"""
+                            UPDATE records SET {column} = 'Y', {column}Date = (
+                                SELECT Date FROM student_vaccinations
+                                WHERE AdminNo = %s AND Vaccine = %s ORDER BY Dose DESC LIMIT 1
+                            )
+                            WHERE AdminNo = %s
+                        """, (admin_no, vaccine, admin_no))
+                
+                log_audit(admin_id, 'UPDATE', admin_no, [vaccine], new_values={'dose': dose, 'date': date})
+                
+                conn.commit()
+                cr.close()
+            RECORD_CACHE.invalidate(admin_no)
+            return True, f"Recorded {vaccine} dose {dose}"
+        except db.IntegrityError:
+            return False, "Student not found"
+        except db.DatabaseError as e:
+            logger.error(f"Error adding vaccination: {e}")
+            return False, str(e)
+    
+    @staticmethod
+    def get_vaccinations(admin_no):
+        """Get a student's doses as (vaccine, dose, date), by vaccine and dose"""
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute("""
+                    SELECT Vaccine, Dose, Date FROM student_vaccinations
+                    WHERE AdminNo = %s ORDER BY Vaccine, Dose
+                """, (admin_no,))
+                doses = cr.fetchall()
+                cr.close()
+            return doses
+        except db.DatabaseError as e:
+            logger.error(f"Error retrieving vaccinations: {e}")
+            return []
+    
+    @staticmethod
+    def students_missing_vaccine(vaccine, columns=('admin_no', 'name', 'class_sec')):
+        """Get StudentRecords (projected to `columns`) with no dose of `vaccine`
+        
+        Each student costs one probe of the (AdminNo, Vaccine, Dose)
+        primary key rather than a scan of the vaccine columns.
+        """
+        vaccine = vaccine_key(vaccine)
+        fields = record_fields(columns)
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(f"""
+                    SELECT {', '.join(FIELD_COLUMNS[field] for field in fields)} FROM records r
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM student_vaccinations v
+                        WHERE v.AdminNo = r.AdminNo AND v.Vaccine = %s
+                    )
+                    ORDER BY AdminNo
+                """, (vaccine,))
+                records = [StudentRecord.from_row(row, fields) for row in cr.fetchall()]
+                cr.close()
+            return records
+        except db.DatabaseError as e:
+            logger.error(f"Error finding missing vaccinations: {e}")
+            return []
+    
+    @staticmethod
+    def students_due_for_booster(vaccine, interval_days=None):
+        """Get (AdminNo, Sname, ClassSec, last dose date) for overdue boosters
+        
+        A booster is due when the latest dated dose is older than
+        `interval_days` (default BOOSTER_INTERVAL_DAYS for the vaccine).
+        """
+        vaccine = vaccine_key(vaccine)
+        if interval_days is None:
+            interval_days = BOOSTER_INTERVAL_DAYS.get(vaccine, 5 * 365)
+        cutoff = (datetime.now() - timedelta(days=interval_days)).strftime('%Y-%m-%d')
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                # Range scan on idx_vaccinations_vaccine (Vaccine, AdminNo, Date)
+                cr.execute("""
+                    SELECT r.AdminNo, r.Sname, r.ClassSec, MAX(v.Date) AS LastDose
+                    FROM student_vaccinations v
+                    JOIN records r ON r.AdminNo = v.AdminNo
+                    WHERE v.Vaccine = %s
+                    GROUP BY r.AdminNo, r.Sname, r.ClassSec
+                    HAVING MAX(v.Date) < %s
+                    ORDER BY r.AdminNo
+                """, (vaccine, cutoff))
+                due = cr.fetchall()
+                cr.close()
+            return due
+        except db.DatabaseError as e:
+            logger.error(f"Error finding due boosters: {e}")
+            return []
+    
+    @staticmethod
+    @SESSIONS.requires('delete')
     def delete_record(admin_no, admin_id):
         """Delete a student record with audit logging"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            # Log audit before deletion
-            log_audit(admin_id, 'DELETE', admin_no)
-            
-            cr.execute("DELETE FROM records WHERE AdminNo = %s", (admin_no,))
-            cr.execute("DELETE FROM users WHERE AdminNo = %s", (admin_no,))
-            
-            conn.commit()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                
+                # Log audit before deletion
+                log_audit(admin_id, 'DELETE', admin_no)
+                
+                with track_summary(cr, [admin_no]):
+                    cr.execute("DELETE FROM records WHERE AdminNo = %s", (admin_no,))
+                    cr.execute("DELETE FROM users WHERE AdminNo = %s", (admin_no,))
+                
+                conn.commit()
+                cr.close()
+            RECORD_CACHE.invalidate(admin_no)
+            NAME_INDEX.remove(admin_no)
             return True, "Record deleted successfully"
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error deleting record: {e}")
             return False, str(e)
 
+def time_range(column, start=None, end=None):
+    """WHERE conditions and params for the half-open range [start, end) on `column`"""
+    conditions, params = [], []
+    for bound, op in ((start, '>='), (end, '<')):
+        if bound is not None:
+            if isinstance(bound, date):
+                bound = bound.strftime('%Y-%m-%d %H:%M:%S')
+            conditions.append(f"{column} {op} %s")
+            params.append(bound)
+    return conditions, params
+
+def metric_column(metric):
+    """measurements column for 'height' or 'weight'"""
+    if metric not in METRIC_COLUMNS:
+        raise ValueError(f"Unknown metric: {metric} ({', '.join(METRIC_COLUMNS)})")
+    return METRIC_COLUMNS[metric]
+
+def velocities(series, metric):
+    """Change per year between consecutive (MeasuredAt, Height, Weight) points
+    
+    Points missing the metric are skipped, as are repeat measurements on
+    the same day. Returns (from, to, change, change per year) tuples.
+    """
+    index = 1 if metric_column(metric) == 'Height' else 2
+    points = [(row[0], row[index]) for row in series if row[index] is not None]
+    result = []
+    for (start, low), (end, high) in zip(points, points[1:]):
+        days = (end - start).total_seconds() / 86400
+        if days >= 1:
+            result.append((start, end, round(high - low, 2), round((high - low) * 365.25 / days, 2)))
+    return result
+
+class MeasurementHistory:
+    """Time-series queries over the measurements height/weight history
+    
+    Every write that sets a height or weight appends a row, so growth is
+    analysed from here instead of replaying audit_log. Time ranges are
+    half-open, [start, end), and take dates or DATETIME strings.
+    """
+    
+    @staticmethod
+    def student(admin_no, start=None, end=None):
+        """Get a student's (MeasuredAt, Height, Weight) points in time order"""
+        conditions, params = time_range('MeasuredAt', start, end)
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                # Range scan on idx_measurements_student (AdminNo, MeasuredAt)
+                cr.execute(f"""
+                    SELECT MeasuredAt, Height, Weight FROM measurements
+                    WHERE {' AND '.join(['AdminNo = %s'] + conditions)}
+                    ORDER BY MeasuredAt, MeasurementID
+                """, [admin_no] + params)
+                series = cr.fetchall()
+                cr.close()
+            return series
+        except db.DatabaseError as e:
+            logger.error(f"Error retrieving measurements: {e}")
+            return []
+    
+    @staticmethod
+    def cohort(class_sec, start=None, end=None):
+        """Get (AdminNo, MeasuredAt, Height, Weight) for a class, by student and time"""
+        conditions, params = time_range('m.MeasuredAt', start, end)
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(f"""
+                    SELECT m.AdminNo, m.MeasuredAt, m.Height, m.Weight
+                    FROM records r
+                    JOIN measurements m ON m.AdminNo = r.AdminNo
+                    WHERE {' AND '.join(['r.ClassSec = %s'] + conditions)}
+                    ORDER BY m.AdminNo, m.MeasuredAt, m.MeasurementID
+                """, [class_sec] + params)
+                rows = cr.fetchall()
+                cr.close()
+            return rows
+        except db.DatabaseError as e:
+            logger.error(f"Error retrieving cohort measurements: {e}")
+            return []
+    
+    @staticmethod
+    def rolling(admin_no, metric='weight', window_days=365):
+        """Trailing statistics of a student's metric at each measurement
+        
+        Returns (MeasuredAt, value, mean, min, max, count) over the
+        measurements in the `window_days` up to and including each one.
+        """
+        index = 1 if metric_column(metric) == 'Height' else 2
+        points = [(row[0], row[index]) for row in MeasurementHistory.student(admin_no) if row[index] is not None]
+        window = timedelta(days=window_days)
+        result = []
+        first = 0
+        for measured_at, value in points:
+            while points[first][0] <= measured_at - window:
+                first += 1
+            values = [v for _, v in points[first:len(result) + 1]]
+            result.append((
+                measured_at, value, round(sum(values) / len(values), 2), min(values), max(values), len(values)
+            ))
+        return result
+    
+    @staticmethod
+    def velocity(admin_no, metric='height', start=None, end=None):
+        """A student's growth between consecutive measurements
+        
+        Returns (from, to, change, change per year) tuples in time order.
+        """
+        return velocities(MeasurementHistory.student(admin_no, start, end), metric)
+    
+    @staticmethod
+    def cohort_velocity(class_sec, start=None, end=None, metric='height'):
+        """Each student's overall change per year across [start, end)
+        
+        Returns {admin_no: change per year} for students with measurements
+        at least a day apart.
+        """
+        metric_column(metric)  # reject an unknown metric before querying
+        series = {}
+        for admin_no, *point in MeasurementHistory.cohort(class_sec, start, end):
+            series.setdefault(admin_no, []).append(point)
+        result = {}
+        for admin_no, points in series.items():
+            steps = velocities(points, metric)
+            if steps:
+                days = (steps[-1][1] - steps[0][0]).total_seconds() / 86400
+                result[admin_no] = round(sum(step[2] for step in steps) * 365.25 / days, 2)
+        return result
+    
+    @staticmethod
+    def trend(class_sec=None, bucket='month', start=None, end=None):
+        """Downsampled series: (period, mean height, mean weight, measurements)
+        
+        Measurements are grouped into 'day', 'month' or 'year' periods,
+        optionally for one class only.
+        """
+        period = period_sql('m.MeasuredAt', bucket)
+        conditions, params = time_range('m.MeasuredAt', start, end)
+        join = ''
+        if class_sec is not None:
+            join = 'JOIN records r ON r.AdminNo = m.AdminNo'
+            conditions.insert(0, 'r.ClassSec = %s')
+            params.insert(0, class_sec)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute(f"""
+                    SELECT {period} AS Period, AVG(m.Height), AVG(m.Weight), COUNT(*)
+                    FROM measurements m {join} {where}
+                    GROUP BY {period} ORDER BY Period
+                """, params)
+                series = [
+                    (label, None if height is None else round(height, 2),
+                     None if weight is None else round(weight, 2), count)
+                    for label, height, weight, count in cr.fetchall()
+                ]
+                cr.close()
+            return series
+        except db.DatabaseError as e:
+            logger.error(f"Error retrieving measurement trend: {e}")
+            return []
+
+# Failed admin logins before the account is locked, and for how long
+MAX_LOGIN_ATTEMPTS = 5
+LOCKOUT_MINUTES = 15
+
 class AdminAuth:
     """Handle admin authentication and authorization"""
     
@@ -240,134 +1439,166 @@ class AdminAuth:
         """Create a new admin user"""
         try:
             hashed_password = hash_password(password)
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                INSERT INTO admins (Username, PasswordHash, FullName, Email, Role, IsActive)
-                VALUES (%s, %s, %s, %s, %s, TRUE)
-            """, (username, hashed_password, full_name, email, role))
-            
-            conn.commit()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                
+                cr.execute("""
+                    INSERT INTO admins (Username, PasswordHash, FullName, Email, Role, IsActive)
+                    VALUES (%s, %s, %s, %s, %s, TRUE)
+                """, (username, hashed_password, full_name, email, role))
+                
+                conn.commit()
+                cr.close()
             logger.info(f"Admin created: {username}")
             return True, "Admin created successfully"
-        except sql.IntegrityError:
+        except db.IntegrityError:
             logger.warning(f"Username already exists: {username}")
             return False, "Username already exists"
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error creating admin: {e}")
             return False, str(e)
     
     @staticmethod
-    def authenticate(username, password):
-        """Authenticate admin user with brute-force protection"""
+    def authenticate(username, password, ip_address=None):
+        """Authenticate admin user with brute-force protection
+        
+        Floods are rejected by the in-memory limiters before any query.
+        A failed password is then counted by one conditional UPDATE that
+        also sets LockedUntil on the MAX_LOGIN_ATTEMPTS-th failure (and
+        resets the counter), skipping accounts that are currently locked,
+        so concurrent attempts cannot race past the limit.
+        """
+        if not login_allowed(username, ip_address):
+            logger.warning(f"Login rate limit hit for {username} from {ip_address or 'local'}")
+            return None, "Too many login attempts. Try again later."
+        
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                SELECT AdminID, PasswordHash, LockedUntil, IsActive 
-                FROM admins WHERE Username = %s
-            """, (username,))
-            
-            admin = cr.fetchone()
-            
-            if not admin:
-                cr.close()
-                conn.close()
-                return None, "Invalid credentials"
-            
-            admin_id, hashed_password, locked_until, is_active = admin
-            
-            # Check if account is locked
-            if locked_until:
-                from datetime import datetime
-                if datetime.now() < locked_until:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                
+                cr.execute("""
+                    SELECT AdminID, PasswordHash, LockedUntil, IsActive, Role 
+                    FROM admins WHERE Username = %s
+                """, (username,))
+                
+                admin = cr.fetchone()
+                
+                if not admin:
+                    cr.close()
+                    return None, "Invalid credentials"
+                
+                admin_id, hashed_password, locked_until, is_active, role = admin
+                now = datetime.now()
+                
+                # Check if account is locked
+                if locked_until and now < locked_until:
                     cr.close()
-                    conn.close()
                     return None, "Account is locked. Try again later."
-                else:
-                    # Unlock the account
-                    cr.execute("UPDATE admins SET LoginAttempts = 0, LockedUntil = NULL WHERE AdminID = %s", (admin_id,))
-            
-            if not is_active:
-                cr.close()
-                conn.close()
-                return None, "Account is inactive"
-            
-            # Verify password
-            if verify_password(password, hashed_password):
-                # Reset login attempts on successful login
-                cr.execute("""
-                    UPDATE admins 
-                    SET LoginAttempts = 0, LastLogin = NOW() 
-                    WHERE AdminID = %s
-                """, (admin_id,))
-                conn.commit()
-                cr.close()
-                conn.close()
-                logger.info(f"Admin authenticated: {username}")
-                return admin_id, "Authentication successful"
-            else:
-                # Increment login attempts
-                cr.execute("""
-                    SELECT LoginAttempts FROM admins WHERE AdminID = %s
-                """, (admin_id,))
-                attempts = cr.fetchone()[0] + 1
                 
-                # Lock after 5 failed attempts
-                if attempts >= 5:
-                    from datetime import datetime, timedelta
-                    lock_until = datetime.now() + timedelta(minutes=15)
+                if not is_active:
+                    cr.close()
+                    return None, "Account is inactive"
+                
+                # Verify password
+                if verify_password(password, hashed_password):
+                    # Reset login attempts, upgrading a hash made with an outdated cost
+                    hasher = get_password_hasher()
+                    if hasher.needs_rehash(hashed_password):
+                        hashed_password = hasher.hash(password)
+                        logger.info(f"Rehashed password for {username} at cost {hasher.rounds}")
                     cr.execute("""
                         UPDATE admins 
-                        SET LoginAttempts = %s, LockedUntil = %s 
+                        SET LoginAttempts = 0, LockedUntil = NULL, LastLogin = %s, PasswordHash = %s 
                         WHERE AdminID = %s
-                    """, (attempts, lock_until, admin_id))
-                    logger.warning(f"Account locked after failed attempts: {username}")
-                else:
-                    cr.execute("""
-                        UPDATE admins SET LoginAttempts = %s WHERE AdminID = %s
-                    """, (attempts, admin_id))
+                    """, (now, hashed_password, admin_id))
+                    conn.commit()
+                    cr.close()
+                    SESSIONS.prime(admin_id, (role, is_active, None))
+                    logger.info(f"Admin authenticated: {username}")
+                    return admin_id, "Authentication successful"
                 
+                # LockedUntil is assigned first so both backends see the old
+                # LoginAttempts; the counter restarts at 0 once the lock is set
+                attempts = update_returning(
+                    cr, 'admins',
+                    "LockedUntil = CASE WHEN LoginAttempts + 1 >= %s THEN %s ELSE LockedUntil END",
+                    'LoginAttempts',
+                    "CASE WHEN LoginAttempts + 1 >= %s THEN 0 ELSE LoginAttempts + 1 END",
+                    "AdminID = %s AND (LockedUntil IS NULL OR LockedUntil <= %s)",
+                    (MAX_LOGIN_ATTEMPTS, now + timedelta(minutes=LOCKOUT_MINUTES),
+                     MAX_LOGIN_ATTEMPTS, admin_id, now)
+                )
                 conn.commit()
                 cr.close()
-                conn.close()
-                return None, f"Invalid credentials ({5 - attempts} attempts remaining)"
-        except sql.Error as e:
+            
+            if not attempts:
+                # 0: this attempt set the lock; None: another attempt already had.
+                # Reload the cached state so open sessions see the lock now
+                SESSIONS.invalidate(admin_id)
+                logger.warning(f"Account locked after failed attempts: {username}")
+                return None, "Account is locked. Try again later."
+            return None, f"Invalid credentials ({MAX_LOGIN_ATTEMPTS - attempts} attempts remaining)"
+        except db.DatabaseError as e:
             logger.error(f"Error authenticating admin: {e}")
             return None, str(e)
     
+    @staticmethod
+    def login(username, password, ip_address=None):
+        """Authenticate and open a session; returns (token, message) or (None, message)"""
+        admin_id, message = AdminAuth.authenticate(username, password, ip_address)
+        if admin_id is None:
+            return None, message
+        return SESSIONS.issue(admin_id), message
+    
+    @staticmethod
+    @SESSIONS.requires('manage_admins', actor='acting_admin_id')
+    def set_active(admin_id, active, acting_admin_id):
+        """Activate or deactivate an admin, ending their current sessions"""
+        try:
+            with get_connection() as conn:
+                cr = conn.cursor()
+                cr.execute("UPDATE admins SET IsActive = %s WHERE AdminID = %s", (bool(active), admin_id))
+                if cr.rowcount == 0:
+                    cr.close()
+                    return False, "Admin not found"
+                log_audit(acting_admin_id, 'UPDATE', admin_id, ['IsActive'], new_values={'IsActive': bool(active)})
+                conn.commit()
+                cr.close()
+            SESSIONS.revoke(admin_id)
+            logger.info(f"Admin {admin_id} {'activated' if active else 'deactivated'} by {acting_admin_id}")
+            return True, "Admin updated successfully"
+        except db.DatabaseError as e:
+            logger.error(f"Error updating admin status: {e}")
+            return False, str(e)
+    
     @staticmethod
     def change_password(admin_id, old_password, new_password):
-        """Change admin password"""
+        """Change admin password and revoke the admin's session tokens"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("SELECT PasswordHash FROM admins WHERE AdminID = %s", (admin_id,))
-            result = cr.fetchone()
-            
-            if not result:
-                return False, "Admin not found"
-            
-            if not verify_password(old_password, result[0]):
-                return False, "Current password is incorrect"
-            
-            hashed_new = hash_password(new_password)
-            cr.execute("""
-                UPDATE admins SET PasswordHash = %s WHERE AdminID = %s
-            """, (hashed_new, admin_id))
-            
-            log_audit(admin_id, 'PASSWORD_CHANGE', admin_id)
-            
-            conn.commit()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                
+                cr.execute("SELECT PasswordHash FROM admins WHERE AdminID = %s", (admin_id,))
+                result = cr.fetchone()
+                
+                if not result:
+                    return False, "Admin not found"
+                
+                if not verify_password(old_password, result[0]):
+                    return False, "Current password is incorrect"
+                
+                hashed_new = hash_password(new_password)
+                cr.execute("""
+                    UPDATE admins SET PasswordHash = %s WHERE AdminID = %s
+                """, (hashed_new, admin_id))
+                
+                log_audit(admin_id, 'PASSWORD_CHANGE', admin_id)
+                
+                conn.commit()
+                cr.close()
+            SESSIONS.revoke(admin_id)
             logger.info(f"Password changed for admin: {admin_id}")
             return True, "Password changed successfully"
-        except sql.Error as e:
+        except db.DatabaseError as e:
             logger.error(f"Error changing password: {e}")
             return False, str(e)
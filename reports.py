@@ -1,14 +1,284 @@
 """
 Reports and analytics module
+
+Distribution reports read the summary_counts table (see summary.py),
+so their cost depends on the number of groups, not of students.
+Cross-tabs come from HealthCube, built in one pass and sliced in memory.
+
+Run directly to precompute the cube file read by get_cube():
+    python reports.py build-cube cube.json.gz
 """
-import csv
+import argparse
+import bisect
+import gzip
+import json
+import os
+import sys
+import threading
+import time
 from datetime import datetime
 import logging
-from db import create_connection
-from utils import calculate_bmi
+from db import get_connection, stream_cursor, begin_snapshot
+from analytics import HealthColumns
+from csvsink import COMPRESSIONS
+from export import REPORT_COLUMNS, export_records
+from growth import assess
+from models import FIELD_COLUMNS, VACCINATION_FIELDS, CRITICAL_VACCINES
+from summary import MISSING_FIELDS
+from utils import BMI_CATEGORIES
 
 logger = logging.getLogger(__name__)
 
+# Lower bound and label of each HealthCube age band
+AGE_BANDS = ((5, '5-8'), (9, '9-11'), (12, '12-14'), (15, '15-17'), (18, '18+'))
+
+# Seconds a cube (built or loaded from CUBE_PATH) is served before rebuilding
+CUBE_MAX_AGE = int(os.getenv('CUBE_MAX_AGE', '300'))
+
+def summary_rows(dimension=None):
+    """Return [(Dimension, Value, Count)] from summary_counts, optionally one dimension
+    
+    Zero counts are skipped; negative ones (drift) are kept so they show.
+    """
+    with get_connection() as conn:
+        cr = conn.cursor()
+        if dimension is None:
+            cr.execute("SELECT Dimension, Value, Count FROM summary_counts WHERE Count <> 0")
+        else:
+            cr.execute(
+                "SELECT Dimension, Value, Count FROM summary_counts WHERE Dimension = %s AND Count <> 0",
+                (dimension,)
+            )
+        rows = cr.fetchall()
+        cr.close()
+    return rows
+
+def group_counts(rows, dimension):
+    """Return {Value: Count} for one dimension of summary rows"""
+    return {value: count for row_dimension, value, count in rows if row_dimension == dimension}
+
+def blood_groups(rows):
+    """[(blood group, count)], most common first"""
+    return sorted(group_counts(rows, 'blood_group').items(), key=lambda item: (-item[1], item[0]))
+
+def classes(rows):
+    """[(class/section, count)] by class"""
+    return sorted(group_counts(rows, 'class').items())
+
+def bmi_counts(rows):
+    """{BMI category: count} with every category present"""
+    counts = group_counts(rows, 'bmi')
+    return {category: counts.get(category, 0) for category in BMI_CATEGORIES}
+
+def coverage(rows):
+    """Vaccination percentages keyed by legacy column name (e.g. 'HepB') or stored name"""
+    total = group_counts(rows, 'students').get('all', 0)
+    if not total:
+        return {}
+    counts = group_counts(rows, 'vaccine')
+    result = {}
+    for vaccine in VACCINATION_FIELDS + tuple(sorted(set(counts) - set(VACCINATION_FIELDS))):
+        result[FIELD_COLUMNS.get(vaccine, vaccine)] = round((counts.get(vaccine, 0) / total) * 100, 2)
+    return result
+
+def age_stats(rows):
+    """Min, max and mean age from the per-age counts"""
+    ages = {int(age): count for age, count in group_counts(rows, 'age').items()}
+    total = sum(ages.values())
+    return {
+        'min': min(ages, default=None),
+        'max': max(ages, default=None),
+        'avg': round(sum(age * count for age, count in ages.items()) / total, 2) if total else 0,
+        'total': total
+    }
+
+def missing_counts(rows):
+    """{field: students missing it} plus 'records' for any missing field"""
+    counts = group_counts(rows, 'missing')
+    return {field: counts.get(field, 0) for field in MISSING_FIELDS + ('records',)}
+
+def age_band(age):
+    """AGE_BANDS label for an age"""
+    return AGE_BANDS[max(bisect.bisect_right([low for low, _ in AGE_BANDS], age) - 1, 0)][1]
+
+def vaccine_status(vaccines):
+    """'complete' (every routine vaccine), 'partial', or 'critical_missing'
+    (lacks one of CRITICAL_VACCINES) for a set of received vaccines"""
+    if not vaccines.issuperset(CRITICAL_VACCINES):
+        return 'critical_missing'
+    return 'complete' if vaccines.issuperset(VACCINATION_FIELDS) else 'partial'
+
+class HealthCube:
+    """Counts and sums of students over class x sex x blood group x BMI x age band x vaccine status
+    
+    Each occupied combination of DIMENSIONS is one cell holding MEASURES,
+    and every dimension value keeps the set of its cells, so a slice is
+    a set intersection and a roll-up sums the surviving cells. The bmi
+    dimension is growth.assess()'s category (BMI-for-age for children),
+    'Unknown' without measurements or, for a child, without a reference.
+    Queries never touch the database; save()/load() keep a compact gzip
+    JSON copy.
+    """
+    
+    DIMENSIONS = ('class_sec', 'sex', 'blood_group', 'bmi', 'age_band', 'vaccine_status')
+    MEASURES = ('students', 'age_sum', 'height_count', 'height_sum', 'weight_count', 'weight_sum')
+    
+    def __init__(self, built_at=None):
+        self.cells = {}
+        self.members = [{} for _ in self.DIMENSIONS]
+        self.built_at = built_at or datetime.now()
+    
+    def __len__(self):
+        return len(self.cells)
+    
+    @classmethod
+    def build(cls, batch_size=1000):
+        """Aggregate every student in one pass over a consistent snapshot"""
+        cube = cls()
+        with get_connection() as conn:
+            cr = conn.cursor()
+            begin_snapshot(cr)
+            placeholders = ', '.join(['%s'] * len(VACCINATION_FIELDS))
+            cr.execute(
+                f"SELECT DISTINCT AdminNo, Vaccine FROM student_vaccinations WHERE Vaccine IN ({placeholders})",
+                VACCINATION_FIELDS
+            )
+            received = {}
+            for admin_no, vaccine in cr.fetchall():
+                received.setdefault(admin_no, set()).add(vaccine)
+            cr.close()
+            
+            cr = stream_cursor(conn)
+            try:
+                cr.execute("SELECT AdminNo, ClassSec, Sex, BloodGroup, Age, Height, Weight, DoB FROM records")
+                while True:
+                    rows = cr.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for admin_no, class_sec, sex, blood_group, age, height, weight, dob in rows:
+                        assessment = assess(height, weight, sex, dob, on=cube.built_at.date())
+                        key = (
+                            class_sec, sex, blood_group, (assessment or {}).get('category') or 'Unknown',
+                            age_band(age), vaccine_status(received.get(admin_no, set()))
+                        )
+                        cube.add(key, (
+                            1, age, int(height is not None), height or 0.0, int(weight is not None), weight or 0.0
+                        ))
+            finally:
+                cr.close()
+            conn.commit()
+        return cube
+    
+    def add(self, key, measures):
+        """Add MEASURES values to the cell at `key` (one value per dimension)"""
+        cell = self.cells.get(key)
+        if cell is None:
+            self.cells[key] = list(measures)
+            for members, value in zip(self.members, key):
+                members.setdefault(value, set()).add(key)
+        else:
+            for i, value in enumerate(measures):
+                cell[i] += value
+    
+    def dimension(self, name):
+        """Position of a dimension in cell keys"""
+        if name not in self.DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {name} ({', '.join(self.DIMENSIONS)})")
+        return self.DIMENSIONS.index(name)
+    
+    def values(self, name):
+        """Sorted members of a dimension"""
+        return sorted(self.members[self.dimension(name)])
+    
+    def slice(self, **filters):
+        """Keys of the cells matching `filters` (dimension=value or a collection of values)"""
+        keys = None
+        for name, wanted in filters.items():
+            members = self.members[self.dimension(name)]
+            if isinstance(wanted, (str, int)):
+                wanted = (wanted,)
+            matched = set().union(*(members.get(value, ()) for value in wanted))
+            keys = matched if keys is None else keys & matched
+        return self.cells.keys() if keys is None else keys
+    
+    def query(self, by=(), **filters):
+        """Roll up the slice `filters` to the dimensions `by`
+        
+        Returns {(values of `by`): measures()} sorted by group; drill down
+        by adding dimensions to `by`, roll up by removing them.
+        """
+        positions = [self.dimension(name) for name in by]
+        groups = {}
+        for key in self.slice(**filters):
+            group = tuple(key[i] for i in positions)
+            total = groups.get(group)
+            if total is None:
+                groups[group] = list(self.cells[key])
+            else:
+                for i, value in enumerate(self.cells[key]):
+                    total[i] += value
+        return {group: self.measures(total) for group, total in sorted(groups.items())}
+    
+    def total(self, **filters):
+        """measures() of the whole slice `filters`"""
+        return self.query(**filters).get((), self.measures([0] * len(self.MEASURES)))
+    
+    def measures(self, values):
+        """MEASURES as a dict, plus mean age, height and weight"""
+        result = dict(zip(self.MEASURES, values))
+        result['height_sum'] = round(result['height_sum'], 2)
+        result['weight_sum'] = round(result['weight_sum'], 2)
+        for name, total, count in (
+            ('mean_age', 'age_sum', 'students'),
+            ('mean_height', 'height_sum', 'height_count'),
+            ('mean_weight', 'weight_sum', 'weight_count')
+        ):
+            result[name] = round(result[total] / result[count], 2) if result[count] else None
+        return result
+    
+    def save(self, path):
+        """Write the cube as gzip-compressed JSON (one array per cell)"""
+        payload = {
+            'built_at': self.built_at.isoformat(),
+            'dimensions': self.DIMENSIONS,
+            'measures': self.MEASURES,
+            'cells': [list(key) + values for key, values in self.cells.items()]
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, separators=(',', ':'))
+    
+    @classmethod
+    def load(cls, path):
+        """Read a cube written by save()"""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if tuple(payload['dimensions']) != cls.DIMENSIONS or tuple(payload['measures']) != cls.MEASURES:
+            raise ValueError(f"{path}: cube layout does not match this version")
+        cube = cls(datetime.fromisoformat(payload['built_at']))
+        width = len(cls.DIMENSIONS)
+        for cell in payload['cells']:
+            cube.add(tuple(cell[:width]), cell[width:])
+        return cube
+
+_cube = None
+_cube_lock = threading.Lock()
+
+def get_cube(refresh=False):
+    """Return the process-wide cube, at most CUBE_MAX_AGE seconds old
+    
+    A file at CUBE_PATH (from 'python reports.py build-cube') is used
+    while fresh enough; otherwise the cube is rebuilt from the database.
+    """
+    global _cube
+    with _cube_lock:
+        if refresh or _cube is None or (datetime.now() - _cube.built_at).total_seconds() > CUBE_MAX_AGE:
+            path = os.getenv('CUBE_PATH')
+            if not refresh and path and os.path.exists(path) and time.time() - os.path.getmtime(path) <= CUBE_MAX_AGE:
+                _cube = HealthCube.load(path)
+            else:
+                _cube = HealthCube.build()
+        return _cube
+
 class ReportsAnalytics:
     """Generate reports and statistics"""
     
@@ -16,82 +286,29 @@ class ReportsAnalytics:
     def blood_group_distribution():
         """Get count of students per blood group"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                SELECT BloodGroup, COUNT(*) as Count 
-                FROM records 
-                GROUP BY BloodGroup 
-                ORDER BY Count DESC
-            """)
-            
-            results = cr.fetchall()
-            cr.close()
-            conn.close()
-            return results
+            return blood_groups(summary_rows('blood_group'))
         except Exception as e:
             logger.error(f"Error getting blood group distribution: {e}")
             return []
     
     @staticmethod
     def bmi_distribution():
-        """Get BMI distribution across students"""
+        """Get BMI distribution across students (adult cut-offs, from summary_counts)"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                SELECT AdminNo, Sname, Height, Weight 
-                FROM records 
-                WHERE Height IS NOT NULL AND Weight IS NOT NULL
-            """)
-            
-            records = cr.fetchall()
-            cr.close()
-            conn.close()
-            
-            distribution = {
-                'Underweight': 0,
-                'Normal': 0,
-                'Overweight': 0,
-                'Obese': 0
-            }
-            
-            for record in records:
-                bmi, status = calculate_bmi(record[2], record[3])
-                if status in distribution:
-                    distribution[status] += 1
-            
-            return distribution
+            return bmi_counts(summary_rows('bmi'))
         except Exception as e:
             logger.error(f"Error getting BMI distribution: {e}")
             return {}
     
     @staticmethod
     def vaccination_coverage():
-        """Get vaccination coverage percentages"""
+        """Get vaccination coverage percentages
+        
+        Keys are the records column names for the legacy vaccines (e.g.
+        'HepB') and the stored name for any other vaccine.
+        """
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("SELECT COUNT(*) FROM records")
-            total = cr.fetchone()[0]
-            
-            if total == 0:
-                return {}
-            
-            vaccinations = ['Tetanus', 'Cholera', 'Typhoid', 'HepA', 'HepB', 'ChickenPox', 'Measles', 'COVID']
-            coverage = {}
-            
-            for vacc in vaccinations:
-                cr.execute(f"SELECT COUNT(*) FROM records WHERE {vacc} = 'Y'")
-                count = cr.fetchone()[0]
-                coverage[vacc] = round((count / total) * 100, 2)
-            
-            cr.close()
-            conn.close()
-            return coverage
+            return coverage(summary_rows())
         except Exception as e:
             logger.error(f"Error getting vaccination coverage: {e}")
             return {}
@@ -100,20 +317,7 @@ class ReportsAnalytics:
     def class_distribution():
         """Get student count per class/section"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                SELECT ClassSec, COUNT(*) as Count 
-                FROM records 
-                GROUP BY ClassSec 
-                ORDER BY ClassSec
-            """)
-            
-            results = cr.fetchall()
-            cr.close()
-            conn.close()
-            return results
+            return classes(summary_rows('class'))
         except Exception as e:
             logger.error(f"Error getting class distribution: {e}")
             return []
@@ -122,28 +326,7 @@ class ReportsAnalytics:
     def age_statistics():
         """Get age statistics"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                SELECT 
-                    MIN(Age) as MinAge,
-                    MAX(Age) as MaxAge,
-                    AVG(Age) as AvgAge,
-                    COUNT(*) as TotalStudents
-                FROM records
-            """)
-            
-            result = cr.fetchone()
-            cr.close()
-            conn.close()
-            
-            return {
-                'min': result[0],
-                'max': result[1],
-                'avg': round(result[2], 2) if result[2] else 0,
-                'total': result[3]
-            }
+            return age_stats(summary_rows('age'))
         except Exception as e:
             logger.error(f"Error getting age statistics: {e}")
             return {}
@@ -152,63 +335,119 @@ class ReportsAnalytics:
     def missing_records():
         """Find students with incomplete records"""
         try:
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            cr.execute("""
-                SELECT AdminNo, Sname, 
-                       CASE WHEN Height IS NULL THEN 1 ELSE 0 END as MissingHeight,
-                       CASE WHEN Weight IS NULL THEN 1 ELSE 0 END as MissingWeight,
-                       CASE WHEN Allergies IS NULL OR Allergies = '' THEN 1 ELSE 0 END as MissingAllergies
-                FROM records
-                WHERE Height IS NULL OR Weight IS NULL OR Allergies IS NULL OR Allergies = ''
-            """)
-            
-            results = cr.fetchall()
-            cr.close()
-            conn.close()
+            with get_connection() as conn:
+                cr = conn.cursor()
+                
+                cr.execute("""
+                    SELECT AdminNo, Sname, 
+                           CASE WHEN Height IS NULL THEN 1 ELSE 0 END as MissingHeight,
+                           CASE WHEN Weight IS NULL THEN 1 ELSE 0 END as MissingWeight,
+                           CASE WHEN Allergies IS NULL OR Allergies = '' THEN 1 ELSE 0 END as MissingAllergies
+                    FROM records
+                    WHERE Height IS NULL OR Weight IS NULL OR Allergies IS NULL OR Allergies = ''
+                """)
+                
+                results = cr.fetchall()
+                cr.close()
             return results
         except Exception as e:
             logger.error(f"Error getting missing records: {e}")
             return []
     
     @staticmethod
-    def export_report_csv(report_type='comprehensive'):
-        """Export report to CSV"""
+    def bmi_analytics():
+        """Population BMI percentiles and per-class means from a columnar snapshot
+        
+        Returns HealthColumns.summary(): 'students', 'measured',
+        'adult_bmi' category counts, 'bmi_percentiles' and 'class_means'.
+        """
         try:
-            filename = f"report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            if report_type == 'comprehensive':
-                cr.execute("SELECT * FROM records")
-                records = cr.fetchall()
-                fieldnames = [
-                    'AdminNo', 'StudentName', 'Sex', 'MotherName', 'FatherName', 'Age',
-                    'ClassSection', 'DateOfBirth', 'BloodGroup', 'Height', 'Weight', 'Allergies',
-                    'Tetanus', 'TetanusDate', 'Cholera', 'CholeraDate', 'Typhoid', 'TyphoidDate',
-                    'HepA', 'HepADate', 'HepB', 'HepBDate', 'ChickenPox', 'ChickenPoxDate',
-                    'Measles', 'MeaslesDate', 'COVID', 'COVIDDate', 'OtherInfo'
-                ]
-            elif report_type == 'health':
-                cr.execute("SELECT AdminNo, Sname, Age, ClassSec, Height, Weight, BloodGroup, Allergies FROM records")
-                records = cr.fetchall()
-                fieldnames = ['AdminNo', 'StudentName', 'Age', 'ClassSection', 'Height', 'Weight', 'BloodGroup', 'Allergies']
-            else:
-                cr.close()
-                conn.close()
-                return None
-            
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(fieldnames)
-                writer.writerows(records)
-            
-            cr.close()
-            conn.close()
-            logger.info(f"Report exported: {filename}")
-            return filename
+            return HealthColumns.load().summary()
+        except Exception as e:
+            logger.error(f"Error computing BMI analytics: {e}")
+            return {}
+    
+    @staticmethod
+    def growth_screening(threshold=2.0):
+        """Screen every student's BMI-for-age; see HealthColumns.growth_screening()"""
+        try:
+            return HealthColumns.load().growth_screening(threshold=threshold)
+        except Exception as e:
+            logger.error(f"Error screening BMI-for-age: {e}")
+            return {}
+    
+    @staticmethod
+    def cross_tab(by=(), **filters):
+        """Student counts and means per group of `by`, within the slice `filters`
+        
+        Answered from the cached HealthCube, e.g. cross_tab(('bmi',),
+        class_sec='9A', sex='F', blood_group='O-'). Returns {} on error.
+        """
+        try:
+            return get_cube().query(by, **filters)
+        except Exception as e:
+            logger.error(f"Error building cross-tab: {e}")
+            return {}
+    
+    @staticmethod
+    def dashboard():
+        """Every summary statistic from one read of summary_counts
+        
+        Returns a dict with 'total', 'blood_groups', 'bmi',
+        'vaccination_coverage', 'classes' and 'age' shaped like the
+        individual reports, plus 'missing': counts of records lacking
+        height, weight, allergies, and any of them.
+        """
+        try:
+            rows = summary_rows()
+            return {
+                'total': group_counts(rows, 'students').get('all', 0),
+                'blood_groups': blood_groups(rows),
+                'bmi': bmi_counts(rows),
+                'vaccination_coverage': coverage(rows),
+                'classes': classes(rows),
+                'age': age_stats(rows),
+                'missing': missing_counts(rows)
+            }
+        except Exception as e:
+            logger.error(f"Error building dashboard: {e}")
+            return {}
+    
+    @staticmethod
+    def export_report_csv(report_type='comprehensive', path=None, compression=None, filter=None, progress=None):
+        """Stream a report to CSV; returns the file written, or None on error
+        
+        `report_type` is a key of export.REPORT_COLUMNS. Without `path`
+        the file is report_<type>_<timestamp>.csv in the current directory,
+        plus .gz or .zst when `compression` is 'gzip' or 'zstd'. `filter`
+        and `progress` are passed to export.export_records().
+        """
+        if report_type not in REPORT_COLUMNS:
+            return None
+        if path is None:
+            suffix = COMPRESSIONS.get(compression or 'none', '')
+            path = f"report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv{suffix}"
+        try:
+            stats = export_records(path, REPORT_COLUMNS[report_type], filter, compression, progress=progress)
+            logger.info(f"Report exported: {path} ({stats['rows']} rows, {stats['rows_per_sec']} rows/s)")
+            return path
         except Exception as e:
             logger.error(f"Error exporting report: {e}")
             return None
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Precompute report data")
+    parser.add_argument('command', choices=['build-cube'])
+    parser.add_argument('path', help="gzip JSON file to write (set CUBE_PATH to serve it)")
+    args = parser.parse_args(argv)
+    
+    cube = HealthCube.build()
+    cube.save(args.path)
+    print(f"Wrote {len(cube)} cells for {cube.total()['students']} students to {args.path}")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+In-process trigram index for typo-tolerant student name search
+"""
+import math
+import threading
+import time
+from array import array
+
+def name_words(text):
+    """Split a name into lowercase alphanumeric words"""
+    return ''.join(ch if ch.isalnum() else ' ' for ch in text.lower()).split()
+
+def trigrams(word):
+    """Return the set of trigrams of one word, padded pg_trgm style"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """Trigram index over the distinct words of indexed names
+    
+    Names share words (surnames especially), so the trigram postings are
+    built over the word vocabulary, which stays small even for very large
+    schools; each word then lists the ids of the names that contain it.
+    """
+    
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.names = {}
+        self.loaded_at = None
+        self._word_ids = {}
+        self._words = []
+        self._word_grams = []
+        self._gram_words = {}
+        self._word_entries = []
+        self._lock = threading.RLock()
+    
+    def load(self, entries):
+        """Replace the index contents with (id, name) pairs"""
+        with self._lock:
+            self.names = {}
+            self._word_ids = {}
+            self._words = []
+            self._word_grams = []
+            self._gram_words = {}
+            self._word_entries = []
+            for entry_id, name in entries:
+                self._insert(entry_id, name)
+            self.loaded_at = time.monotonic()
+    
+    def invalidate(self):
+        """Force the next is_fresh() check to fail so the owner reloads"""
+        self.loaded_at = None
+    
+    def is_fresh(self):
+        """True if loaded less than `ttl` seconds ago"""
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+    
+    def add(self, entry_id, name):
+        """Index (or re-index) one name"""
+        with self._lock:
+            if self.names.get(entry_id) == name:
+                return
+            self.remove(entry_id)
+            self._insert(entry_id, name)
+    
+    def remove(self, entry_id):
+        """Drop one name from the index"""
+        with self._lock:
+            name = self.names.pop(entry_id, None)
+            if name is None:
+                return
+            for word in set(name_words(name)):
+                self._word_entries[self._word_ids[word]].remove(entry_id)
+    
+    def similar_words(self, word, min_score):
+        """Return {word_id: Jaccard similarity} for vocabulary words near `word`
+        
+        A word with Jaccard similarity s to the n query trigrams must share
+        at least m = ceil(s * n) of them, so (pigeonhole) it appears in one
+        of the n - m + 1 rarest posting lists; only those are scanned.
+        """
+        grams = trigrams(word)
+        needed = max(1, math.ceil(min_score * len(grams)))
+        lists = sorted((self._gram_words.get(gram, ()) for gram in grams), key=len)
+        candidates = set()
+        for postings in lists[:len(grams) - needed + 1]:
+            candidates.update(postings)
+        
+        matches = {}
+        for word_id in candidates:
+            word_grams = self._word_grams[word_id]
+            shared = len(grams & word_grams)
+            if shared >= needed:
+                score = shared / (len(grams) + len(word_grams) - shared)
+                if score >= min_score:
+                    matches[word_id] = score
+        return matches
+    
+    def search(self, query, limit=10, min_score=0.3):
+        """Return up to `limit` (id, name, score) tuples, best first
+        
+        Each query word is matched to its most similar word in a name (0 if
+        none reaches `min_score`); a name's score is the average over the
+        query words. Ties go to the shorter name, then the lower id.
+        """
+        words = name_words(query)
+        if not words:
+            return []
+        with self._lock:
+            scores = {}
+            for position, word in enumerate(words):
+                for word_id, similarity in self.similar_words(word, min_score).items():
+                    for entry_id in self._word_entries[word_id]:
+                        best = scores.get(entry_id)
+                        if best is None:
+                            best = scores[entry_id] = [0.0] * len(words)
+                        if similarity > best[position]:
+                            best[position] = similarity
+            
+            ranked = sorted(
+                (-sum(best) / len(words), len(self.names[entry_id]), entry_id)
+                for entry_id, best in scores.items()
+            )[:limit]
+            return [(entry_id, self.names[entry_id], round(-score, 3)) for score, _, entry_id in ranked]
+    
+    def _insert(self, entry_id, name):
+        self.names[entry_id] = name
+        for word in set(name_words(name)):
+            word_id = self._word_ids.get(word)
+            if word_id is None:
+                word_id = self._word_ids[word] = len(self._words)
+                self._words.append(word)
+                self._word_grams.append(frozenset(trigrams(word)))
+                self._word_entries.append(array('q'))
+                for gram in self._word_grams[word_id]:
+                    self._gram_words.setdefault(gram, array('q')).append(word_id)
+            self._word_entries[word_id].append(entry_id)
@@ -0,0 +1,323 @@
+"""
+Login protection: rate limiting, pooled password hashing and admin sessions
+"""
+import functools
+import hashlib
+import hmac
+import inspect
+import logging
+import math
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `capacity` attempts at once, refilled at `rate`/second
+    
+    Buckets live only in this process. Full buckets are pruned once more
+    than `max_keys` keys are tracked, so a flood of distinct keys cannot
+    grow memory without bound.
+    """
+    
+    def __init__(self, capacity, rate, max_keys=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+    
+    def allow(self, key):
+        """Take one token for `key`; returns False if the bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return allowed
+    
+    def reset(self, key=None):
+        """Forget one key's bucket, or every bucket"""
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+    
+    def _prune(self, now):
+        full_after = self.capacity / self.rate if self.rate else float('inf')
+        for key, (_, updated_at) in list(self._buckets.items()):
+            if now - updated_at >= full_after:
+                del self._buckets[key]
+
+# Login attempts allowed per username and per client address
+USER_LOGIN_LIMITER = TokenBucketLimiter(
+    capacity=int(os.getenv('LOGIN_RATE_USER_BURST', '10')),
+    rate=float(os.getenv('LOGIN_RATE_USER_PER_SEC', '0.2'))
+)
+IP_LOGIN_LIMITER = TokenBucketLimiter(
+    capacity=int(os.getenv('LOGIN_RATE_IP_BURST', '30')),
+    rate=float(os.getenv('LOGIN_RATE_IP_PER_SEC', '1'))
+)
+
+def login_allowed(username, ip_address=None):
+    """Apply the per-address then per-username limits to one login attempt"""
+    if ip_address is not None and not IP_LOGIN_LIMITER.allow(ip_address):
+        return False
+    return USER_LOGIN_LIMITER.allow(username.lower())
+
+HASH_CONFIG = {
+    'workers': int(os.getenv('BCRYPT_WORKERS', '4')),
+    'target_ms': float(os.getenv('BCRYPT_TARGET_MS', '250')),
+    'rounds': int(os.getenv('BCRYPT_ROUNDS')) if os.getenv('BCRYPT_ROUNDS') else None
+}
+
+_COST_RE = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+@functools.lru_cache(maxsize=None)
+def load_bcrypt():
+    """Import bcrypt on first use (keeps it off the startup path); None if not installed"""
+    try:
+        import bcrypt
+    except ImportError:
+        return None
+    return bcrypt
+
+class PasswordHasher:
+    """Run bcrypt on a bounded thread pool with a calibrated cost factor
+    
+    bcrypt releases the GIL while hashing, so `workers` logins can hash in
+    parallel without stalling other sessions, and extra requests queue
+    instead of oversubscribing the CPU. Unless `rounds` is fixed, the cost
+    is chosen on first use by timing a cheap hash and doubling up to the
+    largest cost that stays within `target_ms`.
+    """
+    
+    MIN_ROUNDS = 10
+    MAX_ROUNDS = 15
+    
+    def __init__(self, workers=4, target_ms=250, rounds=None):
+        self.workers = workers
+        self.target_ms = target_ms
+        self._rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._lock = threading.Lock()
+    
+    @property
+    def rounds(self):
+        """The bcrypt cost for new hashes (calibrated on first access)"""
+        if self._rounds is None:
+            with self._lock:
+                if self._rounds is None:
+                    self._rounds = self.calibrate()
+        return self._rounds
+    
+    @rounds.setter
+    def rounds(self, value):
+        self._rounds = value
+    
+    def calibrate(self, probe_rounds=8):
+        """Return the largest cost whose hash time stays within target_ms"""
+        bcrypt = load_bcrypt()
+        if bcrypt is None:
+            return self.MIN_ROUNDS
+        started = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(probe_rounds))
+        elapsed_ms = max((time.perf_counter() - started) * 1000, 0.01)
+        rounds = probe_rounds + int(math.floor(math.log2(self.target_ms / elapsed_ms)))
+        rounds = max(self.MIN_ROUNDS, min(self.MAX_ROUNDS, rounds))
+        logger.info(f"bcrypt cost {rounds} selected ({elapsed_ms:.1f} ms at cost {probe_rounds}, target {self.target_ms} ms)")
+        return rounds
+    
+    def warm_up(self):
+        """Calibrate on a background thread so startup does not wait; returns the thread
+        
+        A login arriving first waits on the same lock instead of calibrating again.
+        """
+        thread = threading.Thread(target=lambda: self.rounds, name='bcrypt-calibrate', daemon=True)
+        thread.start()
+        return thread
+    
+    def hash(self, password):
+        """Hash a password on the worker pool"""
+        bcrypt = load_bcrypt()
+        if bcrypt is None:
+            logger.warning("bcrypt not installed, using plain password (NOT SECURE)")
+            return password
+        rounds = self.rounds
+        return self._executor.submit(
+            lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+        ).result()
+    
+    def verify(self, password, hashed):
+        """Check a password against a stored hash on the worker pool"""
+        bcrypt = load_bcrypt()
+        if bcrypt is None:
+            return password == hashed
+        try:
+            return self._executor.submit(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8')).result()
+        except ValueError:
+            # Not a bcrypt hash (e.g. stored while bcrypt was unavailable)
+            return False
+    
+    def needs_rehash(self, hashed):
+        """True if `hashed` was made with a lower cost than the current one"""
+        if load_bcrypt() is None:
+            return False
+        match = _COST_RE.match(hashed or '')
+        return match is None or int(match.group(1)) < self.rounds
+    
+    def shutdown(self):
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=True)
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def get_password_hasher():
+    """Return the process-wide password hasher, creating it on first use"""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(**HASH_CONFIG)
+    return _hasher
+
+# Permissions granted to each admins.Role value
+ROLE_PERMISSIONS = {
+    'SuperAdmin': {'read', 'write', 'delete', 'manage_admins'},
+    'Admin': {'read', 'write', 'delete'},
+    'Viewer': {'read'},
+}
+
+class SessionManager:
+    """Signed admin session tokens plus a short-lived cache of admin state
+    
+    A token is "admin_id.issued_ms.nonce.signature", HMAC-SHA256 signed with
+    `secret`, so validating one needs no query. Each admin's (role,
+    is_active, locked_until) is loaded through `loader(admin_id)` at most
+    once per `cache_ttl` seconds; invalidate() pushes changes immediately.
+    """
+    
+    def __init__(self, loader, secret=None, ttl=8 * 3600, cache_ttl=30):
+        self.loader = loader
+        self.secret = (secret or secrets.token_hex(32)).encode('utf-8')
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._states = {}  # admin_id -> (loaded_at, (role, is_active, locked_until))
+        self._revoked_before = {}  # admin_id -> tokens issued before this (ms) are void
+        self._lock = threading.Lock()
+    
+    def issue(self, admin_id, state=None):
+        """Return a new session token; `state` primes the cache if already known"""
+        if state is not None:
+            self.prime(admin_id, state)
+        # Never stamp a new token at or before the admin's last revoke
+        issued_ms = max(int(time.time() * 1000), self._revoked_before.get(admin_id, -1) + 1)
+        payload = f"{admin_id}.{issued_ms}.{secrets.token_hex(8)}"
+        return f"{payload}.{self._sign(payload)}"
+    
+    def validate(self, token):
+        """Return the admin_id for a valid, unexpired, unrevoked token, else None"""
+        if not isinstance(token, str):
+            return None
+        try:
+            admin_id, issued_ms, nonce, signature = token.split('.')
+            admin_id, issued_ms = int(admin_id), int(issued_ms)
+        except ValueError:
+            return None
+        if not hmac.compare_digest(signature, self._sign(f"{admin_id}.{issued_ms}.{nonce}")):
+            return None
+        if issued_ms + self.ttl * 1000 < time.time() * 1000:
+            return None
+        if issued_ms <= self._revoked_before.get(admin_id, 0):
+            return None
+        return admin_id
+    
+    def revoke(self, admin_id):
+        """Void every token issued to `admin_id` up to now"""
+        with self._lock:
+            self._revoked_before[admin_id] = int(time.time() * 1000)
+            self._states.pop(admin_id, None)
+    
+    def prime(self, admin_id, state):
+        """Cache (role, is_active, locked_until) read elsewhere"""
+        with self._lock:
+            self._states[admin_id] = (time.monotonic(), state)
+    
+    def invalidate(self, admin_id=None):
+        """Drop cached state for one admin (or all) so it is reloaded"""
+        with self._lock:
+            if admin_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(admin_id, None)
+    
+    def state(self, admin_id):
+        """Return (role, is_active, locked_until), or None for unknown admins"""
+        with self._lock:
+            cached = self._states.get(admin_id)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        state = self.loader(admin_id)
+        if state is not None:
+            self.prime(admin_id, state)
+        return state
+    
+    def authorize(self, admin_id, permission):
+        """True if the admin is active, not locked and their role grants `permission`"""
+        if admin_id is None:
+            return False
+        state = self.state(admin_id)
+        if state is None:
+            return False
+        role, is_active, locked_until = state
+        if not is_active or (locked_until is not None and locked_until > datetime.now()):
+            return False
+        return permission in ROLE_PERMISSIONS.get(role, ())
+    
+    def requires(self, permission, actor='admin_id'):
+        """Decorator: authorize a call by its session token
+        
+        Callers pass a token from issue() as `session`, in the position of
+        the wrapped function's `actor` parameter. The call returns (False,
+        "Permission denied") unless the token is valid and its admin holds
+        `permission`; otherwise the function runs with `actor` set to
+        that admin's id.
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+            public = signature.replace(parameters=[
+                parameter.replace(name='session') if parameter.name == actor else parameter
+                for parameter in signature.parameters.values()
+            ])
+            
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = public.bind(*args, **kwargs)
+                admin_id = self.validate(bound.arguments['session'])
+                if admin_id is None or not self.authorize(admin_id, permission):
+                    logger.warning(f"Permission '{permission}' denied to admin {admin_id} for {func.__name__}")
+                    return False, "Permission denied"
+                arguments = dict(bound.arguments, **{actor: admin_id})
+                del arguments['session']
+                call = inspect.BoundArguments(signature, {
+                    name: arguments[name] for name in signature.parameters if name in arguments
+                })
+                return func(*call.args, **call.kwargs)
+            wrapper.__signature__ = public
+            return wrapper
+        return decorator
+    
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
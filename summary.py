@@ -0,0 +1,189 @@
+"""
+Incrementally maintained summary counts behind the reports dashboard
+
+summary_counts holds one row per (Dimension, Value) with the number of
+students in that group. Every write to records or student_vaccinations
+goes through track_summary() in the same transaction, so the counts move
+with the data; rebuild reconciles any drift. BMI groups use the adult
+cut-offs on purpose: BMI-for-age categories change with the date, so a
+stored count could not be moved out of the group it was added to.
+
+Run directly to verify or rebuild the counts:
+    python summary.py check
+    python summary.py rebuild
+"""
+import argparse
+import logging
+import sys
+from collections import Counter
+from contextlib import contextmanager
+import db
+from db import get_connection, upsert_sql, begin_snapshot
+from utils import BMI_CATEGORIES, calculate_bmi
+
+logger = logging.getLogger(__name__)
+
+# Fields reported as missing, and the 'records' group for any of them
+MISSING_FIELDS = ('height', 'weight', 'allergies')
+
+# records columns that decide a student's groups, in student_keys() order
+SUMMARY_COLUMNS = ('ClassSec', 'Sex', 'BloodGroup', 'Age', 'Height', 'Weight', 'Allergies')
+
+def student_keys(class_sec, sex, blood_group, age, height, weight, allergies):
+    """Return the (Dimension, Value) groups one records row belongs to"""
+    keys = [
+        ('students', 'all'), ('class', class_sec), ('sex', sex),
+        ('blood_group', blood_group), ('age', str(age))
+    ]
+    _, status = calculate_bmi(height, weight)
+    if status in BMI_CATEGORIES:
+        keys.append(('bmi', status))
+    missing = [
+        field for field, absent in zip(MISSING_FIELDS, (height is None, weight is None, not allergies))
+        if absent
+    ]
+    if missing:
+        keys += [('missing', field) for field in missing + ['records']]
+    return keys
+
+def student_counts(cr, admin_nos):
+    """Count the groups of `admin_nos` as currently stored, locking their rows
+    
+    Vaccines count once per student with at least one dose, and only for
+    students who have a records row.
+    """
+    counts = Counter()
+    if not admin_nos:
+        return counts
+    placeholders = ', '.join(['%s'] * len(admin_nos))
+    cr.execute(
+        f"SELECT AdminNo, {', '.join(SUMMARY_COLUMNS)} FROM records "
+        f"WHERE AdminNo IN ({placeholders}) {db.BACKEND.row_lock}",
+        list(admin_nos)
+    )
+    found = set()
+    for row in cr.fetchall():
+        found.add(row[0])
+        counts.update(student_keys(*row[1:]))
+    if found:
+        cr.execute(
+            f"SELECT AdminNo, Vaccine FROM student_vaccinations "
+            f"WHERE AdminNo IN ({placeholders}) {db.BACKEND.row_lock}",
+            list(admin_nos)
+        )
+        counts.update(('vaccine', vaccine) for admin_no, vaccine in set(cr.fetchall()) if admin_no in found)
+    return counts
+
+def apply_delta(cr, before, after):
+    """Add the difference between two group counts to summary_counts"""
+    delta = Counter(after)
+    delta.subtract(before)
+    # Sorted so concurrent writers lock summary rows in the same order
+    rows = [(dimension, value, count) for (dimension, value), count in sorted(delta.items()) if count]
+    if rows:
+        cr.executemany(
+            upsert_sql('summary_counts', ('Dimension', 'Value', 'Count'), ('Dimension', 'Value'), increment=('Count',)),
+            rows
+        )
+
+@contextmanager
+def track_summary(cr, admin_nos):
+    """Update summary_counts for whatever the block writes to `admin_nos`
+    
+    The students' groups are read before and after the block on the same
+    cursor, so the adjustment commits or rolls back with the block's own
+    writes.
+    """
+    admin_nos = list(admin_nos)
+    before = student_counts(cr, admin_nos)
+    yield
+    apply_delta(cr, before, student_counts(cr, admin_nos))
+
+def count_all(cr):
+    """Count every group from scratch with one pass over records"""
+    counts = Counter()
+    cr.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM records")
+    while True:
+        rows = cr.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            counts.update(student_keys(*row))
+    cr.execute("""
+        SELECT v.Vaccine, COUNT(DISTINCT v.AdminNo)
+        FROM student_vaccinations v
+        JOIN records r ON r.AdminNo = v.AdminNo
+        GROUP BY v.Vaccine
+    """)
+    for vaccine, count in cr.fetchall():
+        counts[('vaccine', vaccine)] = count
+    return counts
+
+def read_counts(cr):
+    """Return the stored non-zero counts as a Counter keyed by (Dimension, Value)"""
+    cr.execute("SELECT Dimension, Value, Count FROM summary_counts WHERE Count <> 0")
+    return Counter({(dimension, value): count for dimension, value, count in cr.fetchall()})
+
+def rebuild_counts(cr):
+    """Replace summary_counts with freshly counted groups (caller commits)"""
+    counts = count_all(cr)
+    cr.execute("DELETE FROM summary_counts")
+    if counts:
+        cr.executemany(
+            "INSERT INTO summary_counts (Dimension, Value, Count) VALUES (%s, %s, %s)",
+            [(dimension, value, count) for (dimension, value), count in sorted(counts.items())]
+        )
+    return counts
+
+def rebuild():
+    """Recount every group; returns the number of groups stored
+    
+    Edits committed while the rebuild runs may be lost from the counts,
+    so run it when records are not being changed.
+    """
+    with get_connection() as conn:
+        cr = conn.cursor()
+        counts = rebuild_counts(cr)
+        conn.commit()
+        cr.close()
+    logger.info(f"Rebuilt summary counts: {len(counts)} groups")
+    return len(counts)
+
+def drift():
+    """Return {(Dimension, Value): (stored, actual)} for every wrong count"""
+    with get_connection() as conn:
+        cr = conn.cursor()
+        begin_snapshot(cr)
+        stored = read_counts(cr)
+        actual = count_all(cr)
+        conn.commit()
+        cr.close()
+    return {
+        key: (stored.get(key, 0), actual.get(key, 0))
+        for key in sorted(set(stored) | set(actual))
+        if stored.get(key, 0) != actual.get(key, 0)
+    }
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Check or rebuild the dashboard summary counts")
+    parser.add_argument('command', choices=['check', 'rebuild'])
+    args = parser.parse_args(argv)
+    
+    if args.command == 'rebuild':
+        print(f"Rebuilt {rebuild()} summary groups.")
+        return 0
+    
+    wrong = drift()
+    if not wrong:
+        print("Summary counts match the records.")
+        return 0
+    print("Drifted summary counts (stored -> actual):")
+    for (dimension, value), (stored, actual) in wrong.items():
+        print(f"  {dimension}={value}: {stored} -> {actual}")
+    print("\nRun 'python summary.py rebuild' to reconcile.")
+    return 1
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
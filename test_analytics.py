@@ -0,0 +1,169 @@
+"""
+Tests for columnar health analytics, with and without NumPy
+"""
+import math
+from datetime import date
+
+import pytest
+
+import analytics
+import growth
+from analytics import HealthColumns, bmi_values, category_counts, percentiles, group_means
+from growth import GrowthReference
+from models import StudentRecords
+from utils import calculate_bmi
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def kernels(request, monkeypatch):
+    """Run each test with the NumPy kernels and with the pure-Python fallback"""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(analytics, 'np', None)
+        monkeypatch.setattr(growth, 'np', None)
+    return request.param
+
+
+class TestKernels:
+    """Test the column kernels"""
+    
+    def test_bmi_and_categories_match_scalar(self, kernels):
+        """Test vectorized BMI and buckets agree with calculate_bmi"""
+        heights = [165.0, 170.0, 150.0, math.nan, 160.0, 180.0]
+        weights = [55.0, 80.0, 40.0, 50.0, 100.0, 59.94]
+        bmi = list(bmi_values(heights, weights))
+        statuses = {'Underweight': 0, 'Normal': 0, 'Overweight': 0, 'Obese': 0}
+        for height, weight, value in zip(heights, weights, bmi):
+            expected, status = calculate_bmi(None if math.isnan(height) else height, weight)
+            assert math.isnan(value) if expected is None else round(value, 2) == expected
+            if status in statuses:
+                statuses[status] += 1
+        assert category_counts(bmi) == statuses
+        assert statuses == {'Underweight': 2, 'Normal': 1, 'Overweight': 1, 'Obese': 1}
+    
+    def test_percentiles_and_group_means(self, kernels):
+        """Test interpolated percentiles and NaN-skipping group means"""
+        values = [4.0, 1.0, math.nan, 3.0, 2.0]
+        assert percentiles(values, (0, 50, 75, 100)) == {0: 1.0, 50: 2.5, 75: 3.25, 100: 4.0}
+        assert percentiles([math.nan]) == {}
+        means = group_means([0, 1, 0, 1, 2], ['9A', '10B', 'empty'], [1.0, 2.0, 3.0, math.nan, math.nan])
+        assert means == {'9A': 2.0, '10B': 2.0}
+
+
+class TestGrowthReference:
+    """Test LMS z-scores, percentiles and reference loading"""
+    
+    def test_scalar_scores(self, growth_reference):
+        """Test the median scores 0 and tails follow the WHO cut-offs"""
+        reference = growth_reference
+        assert (reference.first_month, reference.last_month) == (61, 228)
+        l, m, s = reference.lms('M', 120)
+        assert reference.zscore(m, 'M', 120) == pytest.approx(0)
+        assert reference.zscore(m * (1 + l * s * 2) ** (1 / l), 'M', 120) == pytest.approx(2)
+        assert reference.zscore(m, 'Other', 120) is None
+        assert reference.zscore(m, 'M', 240) is None
+        assert growth.percentile(0) == 50
+        assert [growth.classify(z) for z in (-2.1, -2, 1, 1.5, 2.1)] == [
+            'Underweight', 'Normal', 'Normal', 'Overweight', 'Obese'
+        ]
+    
+    def test_vectorized_matches_scalar(self, kernels, growth_reference):
+        """Test batch z-scores and percentiles equal the scalar ones"""
+        reference = growth_reference
+        bmi = [12.0, 16.5, 21.0, 35.0, math.nan, 18.0, 18.0]
+        codes = [0, 0, 1, 1, 0, 2, 0]
+        months = [120, 120, 150, 200, 130, 120, 300]
+        z = list(reference.zscores(bmi, codes, ['M', 'F', 'Other'], months))
+        for value, code, age, score in zip(bmi, codes, months, z):
+            expected = reference.zscore(None if math.isnan(value) else value, ['M', 'F', 'Other'][code], age)
+            assert math.isnan(score) if expected is None else score == pytest.approx(expected)
+        assert list(growth.percentiles_of(z))[:4] == pytest.approx([growth.percentile(v) for v in z[:4]], abs=1e-5)
+        assert growth.category_counts(z) == {'Underweight': 1, 'Normal': 2, 'Overweight': 0, 'Obese': 1}
+    
+    def test_load_csv(self, tmp_path):
+        """Test a monthly LMS file loads and gaps are rejected"""
+        path = tmp_path / 'lms.csv'
+        path.write_text(
+            "sex,age_months,L,M,S\n"
+            "M,61,-0.7,15.3,0.08\nM,62,-0.7,15.4,0.08\n"
+            "F,61,-0.9,15.2,0.09\nF,62,-0.9,15.3,0.09\n"
+        )
+        reference = GrowthReference.load(str(path))
+        assert reference.lms('F', 62) == pytest.approx((-0.9, 15.3, 0.09))
+        path.write_text("sex,age_months,L,M,S\nM,61,-0.7,15.3,0.08\nM,63,-0.7,15.4,0.08\n")
+        with pytest.raises(ValueError):
+            GrowthReference.load(str(path))
+    
+    def test_mismatched_lengths_rejected(self):
+        """Test L, M and S must cover the same months for every sex"""
+        with pytest.raises(ValueError):
+            GrowthReference(61, {'M': ([-0.7, -0.7], [15.3, 15.4], [0.08])})
+        with pytest.raises(ValueError):
+            GrowthReference(61, {'M': ([-0.7], [15.3], [0.08]), 'F': ([-0.9] * 2, [15.2] * 2, [0.09] * 2)})
+    
+    def test_no_reference_without_path(self, monkeypatch, caplog):
+        """Test children get no category, with a warning, when no reference is configured"""
+        monkeypatch.delenv('GROWTH_REFERENCE_PATH', raising=False)
+        monkeypatch.setattr(growth, '_reference', growth._UNLOADED)
+        with caplog.at_level('WARNING', logger='growth'):
+            assert growth.get_growth_reference() is None
+        assert 'GROWTH_REFERENCE_PATH' in caplog.text
+        child = growth.assess(140, 36.26, 'M', '2014-01-15', on=date(2024, 1, 15))
+        assert child == {'bmi': 18.5, 'z': None, 'percentile': None, 'category': None, 'reference': None}
+        adult = growth.assess(170, 80, 'F', date(2000, 1, 1), on=date(2024, 1, 1))
+        assert adult['category'] == 'Overweight' and adult['reference'] == 'adult'
+        with pytest.raises(ValueError):
+            HealthColumns().growth_screening()
+    
+    def test_assess_child_and_adult(self, growth_reference):
+        """Test children get BMI-for-age and adults the adult cut-offs"""
+        child = growth.assess(140, 36.26, 'M', '2014-01-15', on=date(2024, 1, 15))
+        assert child['reference'] == 'age'
+        assert child['category'] == 'Normal'
+        assert 50 < child['percentile'] < 100
+        adult = growth.assess(170, 80, 'F', date(2000, 1, 1), on=date(2024, 1, 1))
+        assert adult == {'bmi': 27.68, 'z': None, 'percentile': None, 'category': 'Overweight', 'reference': 'adult'}
+        assert growth.assess(None, 80, 'F', '2014-01-01') is None
+
+
+class TestHealthColumns:
+    """Test loading a snapshot from the database"""
+    
+    def add_student(self, session, admin_no, class_sec, height, weight):
+        StudentRecords.create_user(admin_no, session, f"Student {admin_no}")
+        success, message = StudentRecords.create_record(admin_no, session, {
+            'name': f"Student {admin_no}", 'sex': 'F', 'age': 14, 'class_sec': class_sec,
+            'dob': '2010-05-15', 'blood_group': 'O+', 'height': height, 'weight': weight
+        })
+        assert success, message
+    
+    def test_summary(self, sqlite_db, kernels):
+        """Test the population summary over a loaded snapshot"""
+        self.add_student(sqlite_db, 101, '9A', 165.0, 55.0)
+        self.add_student(sqlite_db, 102, '9A', 170.0, 80.0)
+        self.add_student(sqlite_db, 103, '10B', None, 50.0)
+        columns = HealthColumns.load(batch_size=2)
+        assert len(columns) == 3
+        summary = columns.summary(qs=(50,))
+        assert summary['students'] == 3
+        assert summary['measured'] == 2
+        # Labelled adult: the same 14-year-olds are categorized by growth_screening()
+        assert summary['adult_bmi'] == {'Underweight': 0, 'Normal': 1, 'Overweight': 1, 'Obese': 0}
+        assert summary['bmi_percentiles'] == {50: round((55 / 1.65 ** 2 + 80 / 1.7 ** 2) / 2, 2)}
+        assert summary['class_means'] == {
+            '10B': {'weight': 50.0},
+            '9A': {'bmi': round((55 / 1.65 ** 2 + 80 / 1.7 ** 2) / 2, 2), 'height': 167.5, 'weight': 67.5}
+        }
+    
+    def test_growth_screening(self, sqlite_db, kernels, growth_reference):
+        """Test at-risk students are flagged, most extreme first"""
+        self.add_student(sqlite_db, 101, '9A', 140.0, 36.0)
+        self.add_student(sqlite_db, 102, '9A', 140.0, 60.0)
+        self.add_student(sqlite_db, 103, '10B', 150.0, 25.0)
+        self.add_student(sqlite_db, 104, '10B', None, 25.0)
+        screening = HealthColumns.load(on=date(2024, 5, 15)).growth_screening()
+        assert screening['assessed'] == 3
+        assert screening['categories']['Normal'] == 1
+        assert [(admin_no, class_sec) for admin_no, class_sec, _, _ in screening['at_risk']] == [(103, '10B'), (102, '9A')]
+        assert screening['at_risk'][0][2] < -2 and screening['at_risk'][1][2] > 2
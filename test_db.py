@@ -0,0 +1,223 @@
+"""
+Unit tests for the database layer
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import date
+
+import pytest
+
+import db
+
+
+class FakeConnection:
+    """Minimal stand-in for a DB-API connection"""
+    
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+    
+    def ping(self, reconnect=False):
+        if self.closed:
+            raise sqlite3.OperationalError("connection closed")
+    
+    def rollback(self):
+        self.rollbacks += 1
+    
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+    """Make the pool open FakeConnections instead of real ones"""
+    opened = []
+    
+    def connect():
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+    
+    monkeypatch.setattr(db, 'create_connection', connect)
+    return opened
+
+
+class TestConnectionPool:
+    """Test connection pool checkout and reuse"""
+    
+    def test_connection_reused(self, fake_connect):
+        """Test a returned connection is handed out again"""
+        pool = db.ConnectionPool(size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        assert first is second
+        assert len(fake_connect) == 1
+        assert first.rollbacks == 2
+    
+    def test_pool_is_bounded(self, fake_connect):
+        """Test checkout times out when every connection is in use"""
+        pool = db.ConnectionPool(size=1, timeout=0.05)
+        with pool.connection():
+            with pytest.raises(TimeoutError):
+                pool.acquire()
+    
+    def test_dead_connection_replaced(self, fake_connect):
+        """Test a connection failing ping is discarded"""
+        pool = db.ConnectionPool(size=1, ping=True)
+        with pool.connection() as conn:
+            pass
+        conn.closed = True
+        with pool.connection() as fresh:
+            pass
+        assert fresh is not conn
+        assert len(fake_connect) == 2
+    
+    def test_expired_connection_replaced(self, fake_connect):
+        """Test connections past max lifetime are not reused"""
+        pool = db.ConnectionPool(size=1, max_lifetime=0.000001, ping=False)
+        with pool.connection() as conn:
+            pass
+        with pool.connection() as fresh:
+            pass
+        assert fresh is not conn
+        assert conn.closed
+    
+    def test_pymysql_loaded_on_first_connect(self):
+        """Test PyMySQL is imported by the first MySQL connect, not by main or db"""
+        code = (
+            "import sys, db, main; print('pymysql' in sys.modules, 'audit' in sys.modules)\n"
+            "db.load_pymysql(); print(db.pymysql.IntegrityError in db.IntegrityError)"
+        )
+        env = dict(os.environ, DB_ENGINE='mysql')
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+        )
+        assert result.stdout.split() == ['False', 'False', 'True']
+
+
+class TestSQLiteBackend:
+    """Test MySQL-to-SQLite translation"""
+    
+    def test_translate_ddl(self):
+        """Test ENUM, JSON, AUTO_INCREMENT and ON UPDATE are rewritten"""
+        statements = db.SQLiteBackend(':memory:').translate_ddl("""
+            CREATE TABLE IF NOT EXISTS t (
+                ID INT AUTO_INCREMENT PRIMARY KEY,
+                Kind ENUM('A', 'B') NOT NULL,
+                Payload JSON,
+                UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+        table = statements[0]
+        assert 'INTEGER PRIMARY KEY AUTOINCREMENT' in table
+        assert "Kind TEXT CHECK (Kind COLLATE NOCASE IN ('A', 'B'))" in table
+        assert 'Payload TEXT' in table
+        assert 'ON UPDATE' not in table
+        assert len(statements) == 2
+        assert 'CREATE TRIGGER IF NOT EXISTS t_UpdatedAt_on_update' in statements[1]
+    
+    def test_query_placeholders(self, tmp_path):
+        """Test %s placeholders and dates round-trip"""
+        from datetime import date
+        conn = db.SQLiteBackend(tmp_path / 'x.db').connect()
+        cr = conn.cursor()
+        cr.execute("CREATE TABLE t (Name TEXT, Born DATE)")
+        cr.execute("INSERT INTO t VALUES (%s, %s)", ('a%b', date(2010, 5, 15)))
+        cr.execute("SELECT Name, Born FROM t WHERE Name LIKE %s", ('a%%',))
+        assert cr.fetchone() == ('a%b', date(2010, 5, 15))
+        conn.close()
+
+
+class TestMigrations:
+    """Test versioned migrations and the index report"""
+    
+    def test_create_tables_applies_migrations(self, sqlite_backend):
+        """Test a fresh database ends at the latest version with all indexes"""
+        import migrations
+        db.create_tables()
+        assert migrations.current_version() == migrations.MIGRATIONS[-1][0]
+        assert migrations.index_report()['missing'] == []
+    
+    def test_migrate_is_idempotent(self, sqlite_backend):
+        """Test re-running migrations applies nothing"""
+        import migrations
+        db.create_tables()
+        assert migrations.migrate() == []
+    
+    def test_report_and_repair_missing_index(self, sqlite_backend):
+        """Test a dropped index is reported and recreated"""
+        import migrations
+        db.create_tables()
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("DROP INDEX idx_records_sname")
+            assert migrations.ensure_index(cr, migrations.INDEXES[0]) is True
+            cr.close()
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("DROP INDEX idx_records_age")
+            cr.close()
+        assert migrations.index_report()['missing'] == [('records', 'idx_records_age')]
+        assert migrations.main(['repair-indexes']) == 0
+        assert migrations.index_report()['missing'] == []
+    
+    
+    def test_vaccinations_and_allergies_backfilled(self, sqlite_backend, monkeypatch):
+        """Test migrations 2 and 3 index data already in records"""
+        import migrations
+        monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:1])
+        db.create_tables()
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("INSERT INTO users (AdminNo, Sname) VALUES (1, 'Ann')")
+            cr.execute("""
+                INSERT INTO records (AdminNo, Sname, Sex, Age, ClassSec, DoB, BloodGroup, HepB, HepBDate, COVID, Allergies)
+                VALUES (1, 'Ann', 'F', 12, '7A', '2013-01-01', 'A+', 'Y', '2020-05-05', 'Y', 'Peanuts, shellfish')
+            """)
+            conn.commit()
+            cr.close()
+        monkeypatch.undo()
+        assert migrations.migrate()[:2] == [2, 3]
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("SELECT Vaccine, Dose, Date FROM student_vaccinations ORDER BY Vaccine")
+            assert cr.fetchall() == [('covid', 1, None), ('hep_b', 1, date(2020, 5, 5))]
+            cr.execute("SELECT Term FROM student_allergies ORDER BY Term")
+            assert cr.fetchall() == [('peanut',), ('shellfish',)]
+            cr.close()
+
+
+class TestSchemaFastPath:
+    """Test startup skips DDL when the schema fingerprint is cached"""
+    
+    @pytest.fixture
+    def sqlite_backend(self, sqlite_backend, monkeypatch):
+        monkeypatch.setitem(db.SCHEMA_CACHE, 'fast_path', True)
+        return sqlite_backend
+    
+    def test_second_start_skips_ddl(self, sqlite_backend):
+        """Test DDL runs once, then is skipped"""
+        assert db.ensure_schema() is True
+        assert db.ensure_schema() is False
+        assert db.ensure_schema(force=True) is True
+    
+    def test_new_migration_invalidates_cache(self, sqlite_backend, monkeypatch):
+        """Test a schema change is picked up on the next start"""
+        import migrations
+        db.ensure_schema()
+        monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [(99, "Test", [])])
+        assert db.ensure_schema() is True
+        assert migrations.current_version() == 99
+    
+    def test_missing_database_file_rebuilt(self, sqlite_backend):
+        """Test a deleted SQLite file is recreated despite the cache"""
+        import os
+        db.ensure_schema()
+        db.set_backend(db.BACKEND)  # close pooled connections
+        os.remove(sqlite_backend / 'medrep.db')
+        assert db.ensure_schema() is True
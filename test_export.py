@@ -0,0 +1,105 @@
+"""
+Tests for the CSV sinks and the streaming record export
+"""
+import csv
+import gzip
+import io
+
+import pytest
+
+import csvsink
+import export
+from csvsink import Progress, export_rows, open_sink
+from export import export_records
+from models import StudentRecords
+from reports import ReportsAnalytics
+
+
+@pytest.fixture
+def students(sqlite_db):
+    """Three students in the shared fresh database (see conftest.py)"""
+    for admin_no, name, class_sec in ((101, 'Alice Johnson', '9A'), (102, 'Bob Smith', '9B'), (103, 'Cara Diaz', '10A')):
+        StudentRecords.create_user(admin_no, sqlite_db, name)
+        success, message = StudentRecords.create_record(admin_no, sqlite_db, {
+            'name': name, 'sex': 'F', 'age': 14, 'class_sec': class_sec,
+            'dob': '2010-05-15', 'blood_group': 'O+', 'height': 160.0, 'weight': 50.0
+        })
+        assert success, message
+
+
+def read_gzip_csv(path):
+    with gzip.open(path, 'rt', newline='') as f:
+        return list(csv.reader(f))
+
+
+class TestSinks:
+    """Test sink selection and compression"""
+    
+    def test_compression_follows_suffix(self, tmp_path):
+        """Test .gz targets are compressed and plain ones are not"""
+        for name, opener in (('rows.csv.gz', gzip.open), ('rows.csv', open)):
+            path = tmp_path / name
+            export_rows([[(1, 'a')], [(2, 'b,c')]], ['id', 'value'], str(path))
+            with opener(path, 'rt', newline='') as f:
+                assert list(csv.reader(f)) == [['id', 'value'], ['1', 'a'], ['2', 'b,c']]
+    
+    def test_stdout(self, capsysbinary):
+        """Test None/'-' writes to stdout, optionally gzipped"""
+        export_rows([[(1, 'a')]], ['id', 'value'], '-')
+        assert capsysbinary.readouterr().out == b'id,value\r\n1,a\r\n'
+        export_rows([[(1, 'a')]], ['id', 'value'], compression='gzip')
+        assert gzip.decompress(capsysbinary.readouterr().out) == b'id,value\r\n1,a\r\n'
+    
+    def test_zstd(self, tmp_path, monkeypatch):
+        """Test zstd needs the zstandard package and round-trips when present"""
+        monkeypatch.setattr(csvsink, 'zstandard', None)
+        with pytest.raises(ValueError):
+            with open_sink(str(tmp_path / 'rows.csv.zst')):
+                pass
+        monkeypatch.undo()
+        zstandard = pytest.importorskip('zstandard')
+        path = tmp_path / 'rows.csv.zst'
+        export_rows([[(1, 'a')]], ['id', 'value'], str(path))
+        with open(path, 'rb') as f:
+            text = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f), newline='').read()
+        assert text == 'id,value\r\n1,a\r\n'
+    
+    def test_unknown_compression(self):
+        """Test an unsupported compression is rejected"""
+        with pytest.raises(ValueError):
+            export_rows([], ['id'], compression='bz2')
+
+
+class TestExportRecords:
+    """Test record exports"""
+    
+    def test_columns_and_filters(self, students, tmp_path):
+        """Test column selection and single- and multi-value filters"""
+        path = tmp_path / 'records.csv.gz'
+        stats = export_records(str(path), columns=('admin_no', 'name'), filter={'class_sec': ['9A', '9B']})
+        assert stats['rows'] == 2
+        assert read_gzip_csv(path) == [['AdminNo', 'StudentName'], ['101', 'Alice Johnson'], ['102', 'Bob Smith']]
+        export_records(str(path), columns=('admin_no', 'weight'), filter={'class_sec': '10A'})
+        assert read_gzip_csv(path) == [['AdminNo', 'Weight'], ['103', '50.0']]
+        with pytest.raises(ValueError):
+            export_records(str(path), columns=('admin_no', 'shoe_size'))
+    
+    def test_progress(self, students, tmp_path):
+        """Test progress is reported every `every` rows and at the end"""
+        reports = []
+        progress = Progress(every=2, report=lambda rows, seconds, rate: reports.append(rows))
+        stats = export_records(str(tmp_path / 'records.csv'), batch_size=1, progress=progress)
+        assert reports == [2, 3]
+        assert stats['rows'] == 3 and stats['rows_per_sec'] >= 0
+    
+    def test_report_and_command(self, students, tmp_path, monkeypatch, capsys):
+        """Test the compressed report file and the command-line export"""
+        monkeypatch.chdir(tmp_path)
+        filename = ReportsAnalytics.export_report_csv('health', compression='gzip')
+        assert filename.endswith('.csv.gz')
+        assert len(read_gzip_csv(filename)) == 4
+        assert ReportsAnalytics.export_report_csv('nonexistent') is None
+        
+        assert export.main(['--columns', 'admin_no', '--where', 'class_sec=10A']) == 0
+        assert capsys.readouterr().out.splitlines() == ['AdminNo', '103']
+        assert export.main(['--where', 'class_sec']) == 2
@@ -0,0 +1,736 @@
+"""
+Tests for models and reports against the embedded SQLite backend
+"""
+import csv
+import time
+from datetime import date, timedelta
+
+import pytest
+
+import audit
+import db
+import security
+import summary
+from models import StudentRecords, AdminAuth, MeasurementHistory, RecordCache, RECORD_CACHE, SESSIONS
+import reports
+from reports import HealthCube, ReportsAnalytics
+
+
+# AdminID of the admin the sqlite_db fixture (conftest.py) creates
+ADMIN_ID = 1
+
+# Birth date of a 14-year-old, relative to today so BMI-for-age groups stay put
+DOB = (date.today() - timedelta(days=14 * 365 + 100)).isoformat()
+
+
+def make_student(name='Alice Johnson', **overrides):
+    """Build a valid student_data dict"""
+    data = {
+        'name': name,
+        'sex': 'F',
+        'mother_name': 'Jane',
+        'father_name': 'Bob',
+        'age': 14,
+        'class_sec': '9A',
+        'dob': DOB,
+        'blood_group': 'O+',
+        'height': 165.0,
+        'weight': 55.0,
+        'allergies': 'Peanuts',
+        'tetanus': 'Y',
+        'tetanus_date': '2023-06-15',
+    }
+    data.update(overrides)
+    return data
+
+
+def add_student(admin_no, **overrides):
+    """Create a user and record in one step, as the fixture's admin"""
+    data = make_student(**overrides)
+    session = SESSIONS.issue(ADMIN_ID)
+    StudentRecords.create_user(admin_no, session, data['name'])
+    success, message = StudentRecords.create_record(admin_no, session, data)
+    assert success, message
+    return data
+
+
+class TestStudentRecords:
+    """Test student record CRUD"""
+    
+    def test_create_and_get_record(self, sqlite_db):
+        """Test a created record can be read back"""
+        add_student(101)
+        record = StudentRecords.get_record(101)
+        assert record.admin_no == 101
+        assert record.name == 'Alice Johnson'
+        assert str(record.dob) == DOB
+        assert record.vaccinations.missing() == ['cholera', 'typhoid', 'hep_a', 'hep_b', 'chicken_pox', 'measles', 'covid']
+    
+    def test_duplicate_user_rejected(self, sqlite_db):
+        """Test duplicate Admin No. is reported"""
+        add_student(101)
+        success, message = StudentRecords.create_user(101, sqlite_db, 'Someone Else')
+        assert not success
+        assert message == "Admin No. already exists"
+    
+    def test_search_records(self, sqlite_db):
+        """Test search by name and class"""
+        add_student(101)
+        add_student(102, name='Bob Smith', class_sec='10B')
+        assert [r.admin_no for r in StudentRecords.search_records("name", "bob")] == [102]
+        assert [r.admin_no for r in StudentRecords.search_records("class", "9A")] == [101]
+    
+    def test_get_all_records_sorted(self, sqlite_db):
+        """Test listings come back as StudentRecords in sort order"""
+        add_student(101, name='Zoe Park', age=15)
+        add_student(102, name='Bob Smith', age=12)
+        records = StudentRecords.get_all_records(sort_by='name')
+        assert [r.name for r in records] == ['Bob Smith', 'Zoe Park']
+        assert [r.admin_no for r in StudentRecords.get_all_records(sort_by='age')] == [102, 101]
+        assert list(records[0].vaccinations)[0] == ('Tetanus', 'Y', records[0].tetanus_date)
+    
+    def test_update_record_writes_audit(self, sqlite_db):
+        """Test update changes the row and logs an audit entry"""
+        add_student(101)
+        success, _ = StudentRecords.update_record(101, sqlite_db, height=170.0)
+        assert success
+        assert StudentRecords.get_record(101).height == 170.0
+        audit.flush()
+        logs = db.get_audit_logs()
+        assert logs[0][3] == 'UPDATE'
+    
+    def test_authenticate_student(self, sqlite_db):
+        """Test student login matches Admin No. and exact name"""
+        add_student(101)
+        assert StudentRecords.authenticate_student(101, 'Alice Johnson')[0] == 101
+        assert StudentRecords.authenticate_student(101, 'alice johnson')[0] is None
+        assert StudentRecords.authenticate_student(999, 'Alice Johnson')[0] is None
+        StudentRecords.get_record(101)
+        assert StudentRecords.authenticate_student(101, 'Alice Johnson')[0] == 101
+    
+    def test_delete_record(self, sqlite_db):
+        """Test delete removes the record"""
+        add_student(101)
+        success, _ = StudentRecords.delete_record(101, sqlite_db)
+        assert success
+        assert StudentRecords.get_record(101) is None
+    
+    def test_keyset_pages_cover_sort_order(self, sqlite_db):
+        """Test paging by (sort key, AdminNo) visits every row once, in order"""
+        for admin_no, age in [(105, 12), (101, 14), (104, 12), (102, 13), (103, 14)]:
+            add_student(admin_no, age=age)
+        seen = []
+        after = None
+        while True:
+            page = StudentRecords.get_all_records(sort_by='age', columns=('name',), after=after, limit=2)
+            seen.extend((r.age, r.admin_no) for r in page)
+            if len(page) < 2:
+                break
+            after = StudentRecords.page_cursor(page[-1], 'age')
+        assert seen == [(12, 104), (12, 105), (13, 102), (14, 101), (14, 103)]
+        
+        page = StudentRecords.search_records("class", "9A", columns=('name',), after=(102,), limit=2)
+        assert [r.admin_no for r in page] == [103, 104]
+    
+    def test_iter_records_projection_and_filter(self, sqlite_db):
+        """Test streamed records carry only the requested columns"""
+        for admin_no in range(101, 106):
+            add_student(admin_no, class_sec='9A' if admin_no % 2 else '9B')
+        records = list(StudentRecords.iter_records(
+            filter={'class_sec': '9A'}, columns=('admin_no', 'name'), batch_size=2
+        ))
+        assert sorted(r.admin_no for r in records) == [101, 103, 105]
+        with pytest.raises(AttributeError):
+            records[0].height
+        with pytest.raises(ValueError):
+            list(StudentRecords.iter_records(columns=('nope',)))
+
+
+class TestReports:
+    """Test report queries"""
+    
+    def test_distributions(self, sqlite_db):
+        """Test blood group, class and vaccination reports"""
+        add_student(101)
+        add_student(102, name='Bob Smith', class_sec='10B', blood_group='A+', tetanus='N')
+        assert dict(ReportsAnalytics.blood_group_distribution()) == {'O+': 1, 'A+': 1}
+        assert dict(ReportsAnalytics.class_distribution()) == {'10B': 1, '9A': 1}
+        assert ReportsAnalytics.vaccination_coverage()['Tetanus'] == 50.0
+        assert ReportsAnalytics.age_statistics()['total'] == 2
+    
+    def test_dashboard_matches_individual_reports(self, sqlite_db):
+        """Test the single-scan dashboard agrees with each report"""
+        add_student(101)
+        add_student(102, name='Bob Smith', class_sec='10B', blood_group='A+', tetanus='N', weight=80.0, age=16)
+        add_student(103, name='Cara Diaz', height=None, allergies='')
+        dashboard = ReportsAnalytics.dashboard()
+        assert dashboard['total'] == 3
+        assert dashboard['blood_groups'] == [('O+', 2), ('A+', 1)]
+        assert dashboard['classes'] == ReportsAnalytics.class_distribution()
+        assert dashboard['bmi'] == ReportsAnalytics.bmi_distribution() == {
+            'Underweight': 0, 'Normal': 1, 'Overweight': 1, 'Obese': 0
+        }
+        assert dashboard['vaccination_coverage'] == ReportsAnalytics.vaccination_coverage()
+        assert dashboard['age'] == ReportsAnalytics.age_statistics()
+        assert dashboard['missing'] == {'height': 1, 'weight': 0, 'allergies': 1, 'records': 1}
+    
+    def test_export_report_csv(self, sqlite_db, tmp_path, monkeypatch):
+        """Test the health export streams every record to the file"""
+        monkeypatch.chdir(tmp_path)
+        add_student(101)
+        add_student(102, name='Bob Smith', height=None)
+        filename = ReportsAnalytics.export_report_csv('health')
+        with open(filename, newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0][:2] == ['AdminNo', 'StudentName']
+        assert sorted(row[:2] for row in rows[1:]) == [['101', 'Alice Johnson'], ['102', 'Bob Smith']]
+
+
+class TestHealthCube:
+    """Test the precomputed cross-tab cube"""
+    
+    def add_students(self, session):
+        add_student(101, tetanus='N')
+        add_student(102, name='Bob Smith', sex='M', weight=80.0)
+        add_student(103, name='Cara Diaz', blood_group='O-', weight=70.0, age=16)
+        add_student(104, name='Dan Fox', class_sec='10B', height=None, age=9)
+        for admin_no in (102, 103):
+            for vaccine in ('hep_b', 'covid', 'measles'):
+                StudentRecords.add_vaccination(admin_no, session, vaccine)
+    
+    def test_slice_roll_up_and_drill_down(self, sqlite_db, growth_reference):
+        """Test slices and groupings agree with the students added"""
+        self.add_students(sqlite_db)
+        cube = HealthCube.build(batch_size=2)
+        assert cube.total()['students'] == 4
+        girls = cube.total(class_sec='9A', sex='F', blood_group='O-', bmi='Overweight')
+        assert (girls['students'], girls['mean_weight'], girls['mean_age']) == (1, 70.0, 16.0)
+        assert cube.query(('class_sec',)) == {
+            ('10B',): cube.total(class_sec='10B'), ('9A',): cube.total(class_sec='9A')
+        }
+        drilled = cube.query(('class_sec', 'bmi'), class_sec='9A')
+        assert {group: measures['students'] for group, measures in drilled.items()} == {
+            ('9A', 'Normal'): 1, ('9A', 'Overweight'): 1, ('9A', 'Obese'): 1
+        }
+        assert cube.total(bmi=['Normal', 'Unknown'])['students'] == 2
+        assert cube.total(class_sec='10B')['mean_height'] is None
+        assert {group: measures['students'] for group, measures in cube.query(('vaccine_status',)).items()} == {
+            ('critical_missing',): 2, ('partial',): 2
+        }
+        assert cube.values('age_band') == ['12-14', '15-17', '9-11']
+        with pytest.raises(ValueError):
+            cube.query(('grade',))
+    
+    def test_save_load_and_cache(self, sqlite_db, tmp_path, monkeypatch):
+        """Test the gzip file round-trips and get_cube() serves it while fresh"""
+        self.add_students(sqlite_db)
+        path = tmp_path / 'cube.json.gz'
+        assert reports.main(['build-cube', str(path)]) == 0
+        cube = HealthCube.build()
+        loaded = HealthCube.load(str(path))
+        assert loaded.query(('sex', 'bmi')) == cube.query(('sex', 'bmi'))
+        
+        monkeypatch.setenv('CUBE_PATH', str(path))
+        monkeypatch.setattr(reports, '_cube', None)
+        add_student(105, name='Eve Hart')
+        assert reports.get_cube().total()['students'] == 4
+        assert reports.get_cube(refresh=True).total()['students'] == 5
+        assert ReportsAnalytics.cross_tab(('sex',), class_sec='9A')[('F',)]['students'] == 3
+
+
+class TestSummaryCounts:
+    """Test incrementally maintained dashboard counts"""
+    
+    def test_writes_keep_counts_exact(self, sqlite_db, tmp_path):
+        """Test every write path leaves no drift against a full recount"""
+        add_student(101)
+        add_student(102, name='Bob Smith', class_sec='10B', height=None)
+        path = tmp_path / 'students.csv'
+        path.write_text(
+            "admin_no,name,sex,age,class_sec,dob,blood_group,height,weight,hep_b\n"
+            "201,Ann Lee,F,12,7A,2012-01-02,A+,150,40,Y\n"
+        )
+        assert StudentRecords.bulk_import(str(path), sqlite_db)[0]
+        StudentRecords.update_record(101, sqlite_db, class_sec='10B', tetanus='N')
+        StudentRecords.bulk_update_measurements([(102, 170, 90)], sqlite_db)
+        StudentRecords.add_vaccination(102, sqlite_db, 'HPV')
+        StudentRecords.delete_record(201, sqlite_db)
+        assert summary.drift() == {}
+        
+        dashboard = ReportsAnalytics.dashboard()
+        assert dashboard['total'] == 2
+        assert dashboard['classes'] == [('10B', 2)]
+        assert dashboard['bmi']['Obese'] == 1
+        assert dashboard['vaccination_coverage']['Tetanus'] == 50.0
+        assert dashboard['vaccination_coverage']['hpv'] == 50.0
+        assert dashboard['missing']['records'] == 0
+    
+    def test_check_and_rebuild(self, sqlite_db, capsys):
+        """Test drift is reported and repaired by the command"""
+        add_student(101)
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("UPDATE summary_counts SET Count = 5 WHERE Dimension = 'class' AND Value = '9A'")
+            cr.execute("UPDATE summary_counts SET Count = -1 WHERE Dimension = 'bmi' AND Value = 'Normal'")
+            conn.commit()
+            cr.close()
+        # Negative counts are shown, not filtered out
+        assert ReportsAnalytics.bmi_distribution()['Normal'] == -1
+        assert summary.drift() == {('bmi', 'Normal'): (-1, 1), ('class', '9A'): (5, 1)}
+        assert summary.main(['check']) == 1
+        assert summary.main(['rebuild']) == 0
+        assert summary.main(['check']) == 0
+        assert ReportsAnalytics.class_distribution() == [('9A', 1)]
+
+
+class TestAuditWriter:
+    """Test batched, spooled audit writing"""
+    
+    def test_batch_written_on_flush(self, sqlite_db, tmp_path):
+        """Test queued events reach audit_log in one flush"""
+        writer = audit.AuditWriter(str(tmp_path / 'spool.jsonl'), batch_size=1000, flush_interval=60).start()
+        writer.log_many([audit.make_event(ADMIN_ID, 'UPDATE', n, ['height']) for n in range(5)])
+        assert db.get_audit_logs() == []
+        assert writer.flush()
+        assert len(db.get_audit_logs()) == 5
+        writer.close()
+    
+    def test_spool_replayed_after_crash(self, sqlite_db, tmp_path):
+        """Test events spooled by a dead writer are written by the next one"""
+        spool = str(tmp_path / 'spool.jsonl')
+        crashed = audit.AuditWriter(spool, batch_size=1000, flush_interval=60).start()
+        crashed.log(audit.make_event(ADMIN_ID, 'DELETE', 101))
+        # The process dies, releasing its spool lock
+        crashed._lock.close()
+        
+        recovered = audit.AuditWriter(spool, batch_size=1000, flush_interval=60).start()
+        assert recovered.flush()
+        assert [log[3] for log in db.get_audit_logs()] == ['DELETE']
+        recovered.close()
+    
+    def test_concurrent_writers_use_separate_spools(self, sqlite_db, tmp_path):
+        """Test a second writer spools privately and a dead one's spool is recovered"""
+        spool_dir = tmp_path / 'audit'
+        spool = str(spool_dir / 'spool.jsonl')
+        first = audit.AuditWriter(spool, batch_size=1000, flush_interval=60).start()
+        second = audit.AuditWriter(spool, batch_size=1000, flush_interval=60).start()
+        assert first.spool_path == spool and second.spool_path != spool
+        first.log(audit.make_event(ADMIN_ID, 'UPDATE', 101))
+        second.log(audit.make_event(ADMIN_ID, 'UPDATE', 102))
+        
+        # A writer starting meanwhile leaves the live writers' spools alone
+        third = audit.AuditWriter(spool, batch_size=1000, flush_interval=60).start()
+        assert third._retry == []
+        third.close()
+        
+        second._lock.close()  # the second process dies before flushing
+        fourth = audit.AuditWriter(spool, batch_size=1000, flush_interval=60).start()
+        assert [event[1] for event in fourth._retry] == [102]
+        assert fourth.flush()
+        fourth.close()
+        first.close()
+        assert sorted(log[2] for log in db.get_audit_logs()) == [101, 102]
+        assert sorted(path.name for path in spool_dir.iterdir()) == ['spool.jsonl', 'spool.jsonl.lock']
+    
+    def test_invalid_event_dropped(self, sqlite_db, tmp_path):
+        """Test a row with an unknown AdminID does not block the batch"""
+        writer = audit.AuditWriter(str(tmp_path / 'spool.jsonl'), batch_size=1000, flush_interval=60).start()
+        writer.log(audit.make_event(999, 'UPDATE', 101))
+        writer.log(audit.make_event(ADMIN_ID, 'UPDATE', 102))
+        assert writer.flush()
+        assert [log[2] for log in db.get_audit_logs()] == [102]
+        writer.close()
+    
+    def test_non_database_error_keeps_batch(self, sqlite_db, tmp_path, monkeypatch):
+        """Test a pool timeout keeps the batch for retry and the flusher alive"""
+        writer = audit.AuditWriter(str(tmp_path / 'spool.jsonl'), batch_size=1000, flush_interval=0.01).start()
+        writer.log(audit.make_event(ADMIN_ID, 'UPDATE', 101))
+        write_batch = writer._write_batch
+        
+        def unavailable(batch):
+            raise TimeoutError("no pooled connection available")
+        monkeypatch.setattr(writer, '_write_batch', unavailable)
+        assert not writer.flush()
+        time.sleep(0.05)
+        assert writer._thread.is_alive()
+        
+        monkeypatch.setattr(writer, '_write_batch', write_batch)
+        writer.log(audit.make_event(ADMIN_ID, 'UPDATE', 102))
+        writer.close()
+        assert sorted(log[2] for log in db.get_audit_logs()) == [101, 102]
+
+
+class TestBulkImport:
+    """Test chunked CSV/NDJSON import"""
+    
+    def test_csv_import_with_errors(self, sqlite_db, tmp_path):
+        """Test valid rows import and bad rows are reported per line"""
+        add_student(101)
+        path = tmp_path / 'students.csv'
+        path.write_text(
+            "admin_no,name,sex,age,class_sec,dob,blood_group,height,weight,tetanus\n"
+            "201,Ann Lee,F,12,7A,2012-01-02,A+,150,40,Y\n"
+            "202,Raj Rao,M,13,7B,2011-03-04,B+,,,N\n"
+            "203,Bad Age,M,40,7B,2011-03-04,B+,,,N\n"
+            "101,Already There,M,13,7B,2011-03-04,B+,,,N\n"
+            "201,Dup In File,F,12,7A,2012-01-02,A+,,,N\n"
+        )
+        success, report = StudentRecords.bulk_import(str(path), sqlite_db, chunk_size=2)
+        assert success
+        assert report['imported'] == 2
+        assert [(line, admin_no) for line, admin_no, _ in report['errors']] == [(4, 203), (5, 101), (6, 201)]
+        assert StudentRecords.get_record(202).name == 'Raj Rao'
+    
+    def test_ndjson_import(self, sqlite_db, tmp_path):
+        """Test NDJSON rows and invalid JSON lines"""
+        path = tmp_path / 'students.ndjson'
+        path.write_text(
+            '{"admin_no": 301, "name": "Mia", "sex": "f", "age": 9, "class_sec": "4A", '
+            '"dob": "2016-02-02", "blood_group": "o-"}\n'
+            'not json\n'
+        )
+        success, report = StudentRecords.bulk_import(str(path), sqlite_db)
+        assert success
+        assert report['imported'] == 1
+        assert report['errors'] == [(2, None, "Invalid JSON")]
+        assert StudentRecords.get_record(301).blood_group == 'O-'
+
+
+class TestBulkMeasurements:
+    """Test set-based measurement-day updates"""
+    
+    def test_updates_applied_and_audited(self, sqlite_db):
+        """Test heights/weights change, unknown students are reported"""
+        add_student(101)
+        add_student(102, name='Bob Smith')
+        success, report = StudentRecords.bulk_update_measurements(
+            [(101, 170, 60), (102, None, 48.5), (999, 150, 40), (101, -1, 50)],
+            sqlite_db, chunk_size=1
+        )
+        assert success
+        assert report['updated'] == 2
+        assert [(pos, admin_no) for pos, admin_no, _ in report['errors']] == [(3, 999), (4, 101)]
+        record = StudentRecords.get_record(101)
+        assert (record.height, record.weight) == (170.0, 60.0)
+        record = StudentRecords.get_record(102)
+        assert (record.height, record.weight) == (165.0, 48.5)
+        audit.flush()
+        assert len(db.get_audit_logs()) == 2
+    
+    def test_malformed_items_reported(self, sqlite_db):
+        """Test items that are not (admin_no, height, weight) fail without stopping the run"""
+        add_student(101)
+        success, report = StudentRecords.bulk_update_measurements(
+            [(101, 170), None, (101, 170, 60, 1), (101, 171, 61)], sqlite_db
+        )
+        assert success
+        assert report['updated'] == 1 and report['failed'] == 3
+        assert [(pos, admin_no) for pos, admin_no, _ in report['errors']] == [(1, None), (2, None), (3, None)]
+        assert StudentRecords.get_record(101).height == 171.0
+
+
+class TestMeasurementHistory:
+    """Test the measurements history and its time-series queries"""
+    
+    def record_day(self, admin_id, day, *measurements):
+        success, report = StudentRecords.bulk_update_measurements(
+            measurements, admin_id, measured_at=f"{day} 09:00:00"
+        )
+        assert success and report['updated'] == len(measurements)
+    
+    def test_every_change_is_recorded(self, sqlite_db):
+        """Test create, update and bulk updates each append a measurement"""
+        add_student(101)
+        add_student(102, name='Bob Smith', height=None, weight=None)
+        StudentRecords.update_record(101, sqlite_db, weight=57.0)
+        StudentRecords.update_record(101, sqlite_db, allergies='None')
+        self.record_day(sqlite_db, '2030-01-10', (101, 168, None))
+        series = MeasurementHistory.student(101)
+        assert [(height, weight) for _, height, weight in series] == [(165.0, 55.0), (165.0, 57.0), (168.0, 57.0)]
+        assert MeasurementHistory.student(102) == []
+        assert len(MeasurementHistory.student(101, start='2030-01-01')) == 1
+        assert len(MeasurementHistory.student(101, end=date(2030, 1, 10))) == 2
+    
+    def test_velocity_and_rolling(self, sqlite_db):
+        """Test growth per year and trailing statistics"""
+        add_student(101)
+        self.record_day(sqlite_db, '2030-01-01', (101, 150, 40))
+        self.record_day(sqlite_db, '2030-07-02', (101, 153, 42))
+        self.record_day(sqlite_db, '2031-01-01', (101, 156, 46))
+        start = '2030-01-01'
+        steps = MeasurementHistory.velocity(101, 'height', start=start)
+        assert [(change, rate) for _, _, change, rate in steps] == [(3.0, 6.02), (3.0, 5.99)]
+        rolling = MeasurementHistory.rolling(101, 'weight', window_days=200)
+        assert [(value, mean, low, high, count) for _, value, mean, low, high, count in rolling][-3:] == [
+            (40.0, 40.0, 40.0, 40.0, 1), (42.0, 41.0, 40.0, 42.0, 2), (46.0, 44.0, 42.0, 46.0, 2)
+        ]
+        with pytest.raises(ValueError):
+            MeasurementHistory.velocity(101, 'bmi')
+    
+    def test_cohort_queries_and_trend(self, sqlite_db):
+        """Test per-class velocity and the monthly downsampled series"""
+        add_student(101)
+        add_student(102, name='Bob Smith')
+        add_student(103, name='Carol White', class_sec='10B')
+        self.record_day(sqlite_db, '2030-01-15', (101, 150, 40), (102, 160, 50), (103, 170, 60))
+        self.record_day(sqlite_db, '2030-01-20', (101, 151, 41))
+        self.record_day(sqlite_db, '2031-01-15', (101, 155, 44), (102, 162, 52))
+        start, end = '2030-01-01', '2032-01-01'
+        assert {row[0] for row in MeasurementHistory.cohort('9A', start, end)} == {101, 102}
+        assert MeasurementHistory.cohort_velocity('9A', start, end) == {101: 5.0, 102: 2.0}
+        assert MeasurementHistory.trend('9A', 'month', start, end) == [
+            ('2030-01', 153.67, 43.67, 3), ('2031-01', 158.5, 48.0, 2)
+        ]
+        assert [row[0] for row in MeasurementHistory.trend(bucket='year', start=start)] == ['2030', '2031']
+        with pytest.raises(ValueError):
+            MeasurementHistory.trend(bucket='week')
+
+class TestRecordCache:
+    """Test the read-through record cache"""
+    
+    def test_repeat_reads_hit_cache(self, sqlite_db):
+        """Test a second get_record is served from the cache"""
+        add_student(101)
+        hits = RECORD_CACHE.hits
+        first = StudentRecords.get_record(101)
+        assert StudentRecords.get_record(101) == first
+        assert RECORD_CACHE.hits == hits + 1
+    
+    def test_writes_invalidate(self, sqlite_db):
+        """Test updates and deletes are visible on the next read"""
+        add_student(101)
+        StudentRecords.get_record(101)
+        StudentRecords.update_record(101, sqlite_db, height=180.0)
+        assert StudentRecords.get_record(101).height == 180.0
+        StudentRecords.bulk_update_measurements([(101, 181.0, None)], sqlite_db)
+        assert StudentRecords.get_record(101).height == 181.0
+        StudentRecords.delete_record(101, sqlite_db)
+        assert StudentRecords.get_record(101) is None
+    
+    def test_lru_eviction_and_ttl(self, monkeypatch):
+        """Test least-recently-used eviction and expiry"""
+        cache = RecordCache(max_size=2, ttl=60)
+        for admin_no in (1, 2):
+            cache.put(admin_no, (admin_no,), cache.get(admin_no)[1])
+        cache.get(1)
+        cache.put(3, (3,), cache.get(3)[1])
+        assert cache.get(2)[0] is None
+        assert cache.get(1)[0] == (1,)
+        
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 120)
+        assert cache.get(1)[0] is None
+    
+    def test_stale_read_not_cached(self):
+        """Test a read that raced an invalidation is not stored"""
+        cache = RecordCache()
+        _, token = cache.get(1)
+        cache.invalidate(1)
+        cache.put(1, ('old',), token)
+        assert cache.get(1)[0] is None
+
+
+class TestVaccinations:
+    """Test the normalized student_vaccinations table"""
+    
+    def test_doses_written_and_mirrored(self, sqlite_db):
+        """Test create/add/update keep the table and legacy columns in step"""
+        add_student(101)
+        assert StudentRecords.get_vaccinations(101) == [('tetanus', 1, date(2023, 6, 15))]
+        
+        success, _ = StudentRecords.add_vaccination(101, sqlite_db, 'Tetanus', '2024-01-10')
+        assert success
+        assert StudentRecords.get_record(101).tetanus_date == date(2024, 1, 10)
+        assert StudentRecords.add_vaccination(101, sqlite_db, 'HPV', '2024-02-01')[0]
+        assert StudentRecords.add_vaccination(999, sqlite_db, 'HPV')[1] == "Student not found"
+        assert [v[:2] for v in StudentRecords.get_vaccinations(101)] == [('hpv', 1), ('tetanus', 1), ('tetanus', 2)]
+        
+        StudentRecords.update_record(101, sqlite_db, tetanus='N')
+        assert [v[0] for v in StudentRecords.get_vaccinations(101)] == ['hpv']
+        StudentRecords.update_record(101, sqlite_db, hep_b='Y', hep_b_date='2022-03-03')
+        assert ('hep_b', 1, date(2022, 3, 3)) in StudentRecords.get_vaccinations(101)
+    
+    def test_missing_due_and_coverage(self, sqlite_db):
+        """Test missing-vaccine, booster and coverage queries"""
+        add_student(101, tetanus_date='2010-01-01')
+        add_student(102, name='Bob Smith', tetanus='N', tetanus_date=None)
+        assert [r.admin_no for r in StudentRecords.students_missing_vaccine('tetanus')] == [102]
+        assert [row[0] for row in StudentRecords.students_due_for_booster('tetanus')] == [101]
+        StudentRecords.add_vaccination(102, sqlite_db, 'hep b')
+        coverage = ReportsAnalytics.vaccination_coverage()
+        assert coverage['Tetanus'] == 50.0
+        assert coverage['HepB'] == 50.0
+        assert coverage['Measles'] == 0.0
+
+
+class TestAllergySearch:
+    """Test the student_allergies inverted index"""
+    
+    def test_term_prefix_and_boolean_queries(self, sqlite_db):
+        """Test whole-term, prefix, AND and OR matching"""
+        add_student(101, allergies='Peanuts, dust mites')
+        add_student(102, name='Bob Smith', allergies='Nut allergy; penicillin')
+        add_student(103, name='Cara Diaz', allergies='Peanut and penicillin')
+        
+        def found(query, match='any'):
+            return [r.admin_no for r in StudentRecords.search_allergies(query, match)]
+        
+        assert found('peanut') == [101, 103]
+        assert found('nut') == [102]
+        assert found('pea*') == [101, 103]
+        assert found('peanut penicillin', 'all') == [103]
+        assert found('nut mite') == [101, 102]
+        assert found('allergy') == []
+    
+    def test_index_follows_updates(self, sqlite_db):
+        """Test update_record re-indexes the allergy note"""
+        add_student(101)
+        StudentRecords.update_record(101, sqlite_db, allergies='Latex')
+        assert StudentRecords.search_allergies('peanut') == []
+        assert [r.allergies for r in StudentRecords.search_allergies('latex')] == ['Latex']
+
+
+class TestFuzzySearch:
+    """Test the trigram name index"""
+    
+    def test_misspelt_names_ranked(self, sqlite_db):
+        """Test typos still find the student, best match first"""
+        add_student(101, name='Alice Johnson')
+        add_student(102, name='Alicia Jones')
+        add_student(103, name='Bob Smith')
+        results = StudentRecords.fuzzy_search('Alise Jonson')
+        assert [record.admin_no for record, _ in results][:2] == [101, 102]
+        assert results[0][1] > results[1][1]
+        assert StudentRecords.fuzzy_search('smiht')[0][0].name == 'Bob Smith'
+    
+    def test_index_follows_writes(self, sqlite_db):
+        """Test creates and deletes after the index is loaded are reflected"""
+        add_student(101, name='Alice Johnson')
+        StudentRecords.fuzzy_search('alice')
+        add_student(102, name='Priya Raman')
+        assert StudentRecords.fuzzy_search('priya ramen')[0][0].admin_no == 102
+        StudentRecords.delete_record(101, sqlite_db)
+        assert StudentRecords.fuzzy_search('alice johnson') == []
+
+
+class TestAdminLogin:
+    """Test lockout and rate limiting in AdminAuth.authenticate"""
+    
+    @pytest.fixture
+    def admin(self, sqlite_db, monkeypatch):
+        monkeypatch.setattr(security.get_password_hasher(), 'rounds', 4)
+        security.USER_LOGIN_LIMITER.reset()
+        security.IP_LOGIN_LIMITER.reset()
+        success, _ = AdminAuth.create_admin('head', 'right-pass', 'Head Nurse', 'h@example.com')
+        assert success
+        yield 'head'
+        security.USER_LOGIN_LIMITER.reset()
+        security.IP_LOGIN_LIMITER.reset()
+    
+    def test_lockout_after_failed_attempts(self, admin):
+        """Test the fifth failure locks the account, even for the right password"""
+        messages = [AdminAuth.authenticate(admin, 'wrong')[1] for _ in range(5)]
+        assert messages[0] == "Invalid credentials (4 attempts remaining)"
+        assert messages[-1] == "Account is locked. Try again later."
+        assert AdminAuth.authenticate(admin, 'right-pass') == (None, "Account is locked. Try again later.")
+    
+    def test_success_resets_counter(self, admin):
+        """Test a good login clears earlier failures"""
+        AdminAuth.authenticate(admin, 'wrong')
+        assert AdminAuth.authenticate(admin, 'right-pass')[0] is not None
+        assert AdminAuth.authenticate(admin, 'wrong')[1] == "Invalid credentials (4 attempts remaining)"
+    
+    def test_flood_rejected_before_database(self, admin, monkeypatch):
+        """Test the per-address bucket stops a burst"""
+        monkeypatch.setattr(security.IP_LOGIN_LIMITER, 'capacity', 3)
+        results = [AdminAuth.authenticate(f'user{i}', 'x', ip_address='10.0.0.9')[1] for i in range(5)]
+        assert results[:3] == ["Invalid credentials"] * 3
+        assert results[3:] == ["Too many login attempts. Try again later."] * 2
+    
+    def test_outdated_cost_rehashed_on_login(self, admin, monkeypatch):
+        """Test a successful login upgrades a hash made with a lower cost"""
+        monkeypatch.setattr(security.get_password_hasher(), 'rounds', 5)
+        assert AdminAuth.authenticate(admin, 'right-pass')[0] is not None
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute("SELECT PasswordHash FROM admins WHERE Username = %s", (admin,))
+            assert cr.fetchone()[0].startswith('$2b$05$')
+            cr.close()
+    
+    def test_password_change_revokes_sessions(self, admin):
+        """Test tokens issued before a password change stop working"""
+        token, _ = AdminAuth.login(admin, 'right-pass')
+        admin_id = SESSIONS.validate(token)
+        assert AdminAuth.change_password(admin_id, 'right-pass', 'new-pass')[0]
+        assert SESSIONS.validate(token) is None
+        assert SESSIONS.validate(AdminAuth.login(admin, 'new-pass')[0]) == admin_id
+    
+    def test_lockout_blocks_open_sessions(self, admin):
+        """Test a lockout denies a logged-in admin at once, not after the cache expires"""
+        token, _ = AdminAuth.login(admin, 'right-pass')
+        admin_id = SESSIONS.validate(token)
+        assert SESSIONS.authorize(admin_id, 'write')
+        for _ in range(5):
+            AdminAuth.authenticate(admin, 'wrong')
+        assert not SESSIONS.authorize(admin_id, 'write')
+
+
+class TestSessions:
+    """Test session tokens and role checks on mutations"""
+    
+    def add_admin(self, username, role):
+        with db.get_connection() as conn:
+            cr = conn.cursor()
+            cr.execute(
+                "INSERT INTO admins (Username, PasswordHash, Role) VALUES (%s, %s, %s)",
+                (username, 'not-a-hash', role)
+            )
+            conn.commit()
+            admin_id = cr.lastrowid
+            cr.close()
+        return admin_id
+    
+    def test_viewer_cannot_mutate(self, sqlite_db):
+        """Test roles gate updates and deletes"""
+        add_student(101)
+        viewer = SESSIONS.issue(self.add_admin('viewer', 'Viewer'))
+        assert StudentRecords.update_record(101, viewer, height=150.0) == (False, "Permission denied")
+        assert StudentRecords.delete_record(101, viewer) == (False, "Permission denied")
+        assert StudentRecords.create_user(102, viewer, 'Bob Smith') == (False, "Permission denied")
+        assert StudentRecords.create_record(101, viewer, make_student()) == (False, "Permission denied")
+        assert StudentRecords.update_record(101, None, height=150.0) == (False, "Permission denied")
+        assert StudentRecords.update_record(101, sqlite_db, height=150.0)[0]
+    
+    def test_bare_admin_id_rejected(self, sqlite_db):
+        """Test mutations need the signed token, not just an admin id"""
+        add_student(101)
+        assert StudentRecords.update_record(101, ADMIN_ID, height=150.0) == (False, "Permission denied")
+        forged = sqlite_db.split('.')
+        forged[-1] = '0' * len(forged[-1])
+        assert StudentRecords.delete_record(101, '.'.join(forged)) == (False, "Permission denied")
+        assert StudentRecords.get_record(101) is not None
+    
+    def test_state_cached_and_pushed(self, sqlite_db, monkeypatch):
+        """Test role lookups hit the cache until invalidated by deactivation"""
+        add_student(101)
+        boss = self.add_admin('boss', 'SuperAdmin')
+        SESSIONS.invalidate()
+        loads = []
+        original = SESSIONS.loader
+        monkeypatch.setattr(SESSIONS, 'loader', lambda admin_id: loads.append(admin_id) or original(admin_id))
+        for height in (150.0, 151.0, 152.0):
+            StudentRecords.update_record(101, sqlite_db, height=height)
+        assert loads == [ADMIN_ID]
+        
+        token = SESSIONS.issue(ADMIN_ID)
+        assert SESSIONS.validate(token) == ADMIN_ID
+        assert AdminAuth.set_active(ADMIN_ID, False, sqlite_db) == (False, "Permission denied")
+        assert AdminAuth.set_active(ADMIN_ID, False, SESSIONS.issue(boss))[0]
+        assert SESSIONS.validate(token) is None
+        assert StudentRecords.update_record(101, sqlite_db, height=153.0) == (False, "Permission denied")
+    
+    def test_tampered_token_rejected(self, sqlite_db):
+        """Test the signature covers the admin id"""
+        admin_id, issued, nonce, signature = SESSIONS.issue(ADMIN_ID).split('.')
+        assert SESSIONS.validate(f"2.{issued}.{nonce}.{signature}") is None
+        assert SESSIONS.validate('garbage') is None
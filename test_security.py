@@ -0,0 +1,128 @@
+"""
+Unit tests for login protection
+"""
+import os
+import subprocess
+import sys
+import time
+
+from security import TokenBucketLimiter, PasswordHasher, SessionManager
+
+
+class TestTokenBucketLimiter:
+    """Test per-key token buckets"""
+    
+    def test_burst_then_refill(self, monkeypatch):
+        """Test a key gets `capacity` attempts, then one per refill interval"""
+        now = [1000.0]
+        monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+        limiter = TokenBucketLimiter(capacity=3, rate=0.5)
+        assert [limiter.allow('nurse') for _ in range(4)] == [True, True, True, False]
+        assert limiter.allow('other')
+        now[0] += 2
+        assert limiter.allow('nurse')
+        assert not limiter.allow('nurse')
+    
+    def test_idle_buckets_pruned(self, monkeypatch):
+        """Test tracked keys stay bounded"""
+        now = [0.0]
+        monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+        limiter = TokenBucketLimiter(capacity=1, rate=1, max_keys=10)
+        for i in range(50):
+            now[0] += 1
+            limiter.allow(f'key{i}')
+        assert len(limiter._buckets) <= 11
+
+
+class TestPasswordHasher:
+    """Test pooled bcrypt hashing"""
+    
+    def test_hash_verify_and_rehash(self):
+        """Test round trip and cost comparison"""
+        hasher = PasswordHasher(workers=2, rounds=4)
+        hashed = hasher.hash('s3cret')
+        assert hasher.verify('s3cret', hashed)
+        assert not hasher.verify('wrong', hashed)
+        assert not hasher.verify('s3cret', 'not-a-hash')
+        assert not hasher.needs_rehash(hashed)
+        hasher.rounds = 5
+        assert hasher.needs_rehash(hashed)
+        hasher.shutdown()
+    
+    def test_calibration_within_bounds(self):
+        """Test the calibrated cost respects the configured floor and ceiling"""
+        hasher = PasswordHasher(target_ms=1)
+        assert hasher.rounds == PasswordHasher.MIN_ROUNDS
+        hasher.shutdown()
+    
+    def test_warm_up_calibrates_in_background(self):
+        """Test warm_up() picks the cost on another thread"""
+        hasher = PasswordHasher(target_ms=1)
+        hasher.warm_up().join()
+        assert hasher._rounds == PasswordHasher.MIN_ROUNDS
+        hasher.shutdown()
+    
+    def test_startup_imports_skip_bcrypt(self):
+        """Test importing main and utils loads neither bcrypt nor the hasher"""
+        code = "import sys, main, utils; print('bcrypt' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        assert result.stdout.strip() == 'False'
+
+
+class TestSessionManager:
+    """Test session tokens and cached permission checks"""
+    
+    def test_token_expiry_and_revocation(self, monkeypatch):
+        """Test tokens stop validating after the TTL or a revoke"""
+        now = [1000.0]
+        monkeypatch.setattr(time, 'time', lambda: now[0])
+        sessions = SessionManager(lambda admin_id: None, secret='k', ttl=60)
+        token = sessions.issue(1)
+        assert sessions.validate(token) == 1
+        assert SessionManager(lambda admin_id: None, secret='other').validate(token) is None
+        now[0] += 61
+        assert sessions.validate(token) is None
+        token = sessions.issue(1)
+        now[0] += 1
+        sessions.revoke(1)
+        assert sessions.validate(token) is None
+        now[0] += 1
+        assert sessions.validate(sessions.issue(1)) == 1
+    
+    def test_permissions_use_cached_state(self, monkeypatch):
+        """Test the loader runs once per cache_ttl and roles map to permissions"""
+        now = [1000.0]
+        monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+        loads = []
+        states = {1: ('Viewer', True, None), 2: ('Admin', False, None)}
+        sessions = SessionManager(lambda admin_id: loads.append(admin_id) or states.get(admin_id), cache_ttl=30)
+        assert sessions.authorize(1, 'read')
+        assert not sessions.authorize(1, 'write')
+        assert not sessions.authorize(2, 'read')
+        assert not sessions.authorize(3, 'read')
+        assert loads == [1, 2, 3]
+        states[1] = ('Admin', True, None)
+        assert not sessions.authorize(1, 'write')
+        now[0] += 31
+        assert sessions.authorize(1, 'write')
+        assert loads == [1, 2, 3, 1]
+    
+    def test_requires_resolves_admin_from_token(self):
+        """Test decorated calls need a valid token and see its admin_id"""
+        sessions = SessionManager(lambda admin_id: {1: ('Admin', True, None), 2: ('Viewer', True, None)}.get(admin_id))
+        
+        @sessions.requires('write')
+        def update(admin_no, admin_id, **changes):
+            return True, (admin_no, admin_id, changes)
+        
+        token = sessions.issue(1)
+        assert update(101, token, height=150) == (True, (101, 1, {'height': 150}))
+        assert update(101, session=token) == (True, (101, 1, {}))
+        assert update(101, 1) == (False, "Permission denied")
+        assert update(101, sessions.issue(2)) == (False, "Permission denied")
+        sessions.revoke(1)
+        assert update(101, token) == (False, "Permission denied")
+        assert update(101, sessions.issue(1))[0]
@@ -1,25 +1,36 @@
 """
 UI/CLI handling for the application
 """
+import csv
 import os
 import sys
 import logging
 from datetime import datetime
-from models import StudentRecords, AdminAuth
-from reports import ReportsAnalytics
+from models import (
+    StudentRecords, AdminAuth, SESSIONS, VACCINATION_FIELDS, VACCINE_LABELS, CRITICAL_VACCINES
+)
+from csvsink import Progress
+from growth import assess
 from utils import (
     validate_date, validate_blood_group, validate_sex, validate_age,
-    calculate_bmi, sanitize_string
+    sanitize_string
 )
 
 logger = logging.getLogger(__name__)
 
+# StudentRecord attributes shown by display_records_table
+TABLE_FIELDS = ('admin_no', 'name', 'sex', 'age', 'class_sec', 'blood_group')
+
+# Rows per page for sorted and searched listings
+PAGE_SIZE = 20
+
 class CLI:
     """Command-line interface"""
     
     def __init__(self):
         self.current_admin_id = None
         self.current_username = None
+        self.session_token = None
     
     def user_input(self, prompt, data_type=str, allow_empty=False):
         """Get user input with type checking"""
@@ -46,7 +57,7 @@ class CLI:
         print("="*60)
     
     def sign_up(self):
-        """Student signup"""
+        """Register a student (admin dashboard; needs the "write" permission)"""
         self.display_header("Student Registration")
         
         print('\n--- Personal Details ---\n')
@@ -54,7 +65,7 @@ class CLI:
         student_name = self.user_input("Enter Student Name: ")
         
         # Create user first
-        success, message = StudentRecords.create_user(admin_no, student_name)
+        success, message = StudentRecords.create_user(admin_no, self.session_token, student_name)
         if not success:
             print(f"Error: {message}")
             return
@@ -124,7 +135,7 @@ class CLI:
             **vaccinations
         }
         
-        success, message = StudentRecords.create_record(admin_no, student_data)
+        success, message = StudentRecords.create_record(admin_no, self.session_token, student_data)
         print(f"\n{message}")
         if success:
             logger.info(f"Student registered: AdminNo {admin_no}, Name {student_name}")
@@ -136,9 +147,10 @@ class CLI:
         username = self.user_input("Username: ")
         password = self.user_input("Password: ")
         
-        admin_id, message = AdminAuth.authenticate(username, password)
-        if admin_id:
-            self.current_admin_id = admin_id
+        token, message = AdminAuth.login(username, password)
+        if token:
+            self.session_token = token
+            self.current_admin_id = SESSIONS.validate(token)
             self.current_username = username
             print(f"\n✓ {message}")
             logger.info(f"Admin logged in: {username}")
@@ -153,23 +165,14 @@ class CLI:
         admin_no = self.user_input("Enter Admin No.: ", int)
         student_name = self.user_input("Enter Student Name: ")
         
-        record = StudentRecords.search_records("admin_no", admin_no)
-        if record and len(record) > 0:
-            found = False
-            for r in record:
-                if r[1] == student_name:  # r[1] is Sname
-                    found = True
-                    break
-            
-            if found:
-                print("✓ Login successful.\n")
-                self.student_menu(admin_no, student_name, r)
-            else:
-                print("✗ Invalid credentials.")
+        student_id, message = StudentRecords.authenticate_student(admin_no, student_name)
+        if student_id is not None:
+            print(f"✓ {message}.\n")
+            self.student_menu(admin_no, student_name)
         else:
-            print("✗ Invalid credentials.")
+            print(f"✗ {message}.")
     
-    def student_menu(self, admin_no, student_name, record):
+    def student_menu(self, admin_no, student_name):
         """Student menu"""
         while True:
             print("\n--- Student Menu ---")
@@ -180,7 +183,12 @@ class CLI:
             choice = self.user_input("Enter choice: ", int)
             
             if choice == 1:
-                self.display_full_record(record)
+                # Loaded on demand so the view reflects the latest data
+                record = StudentRecords.get_record(admin_no)
+                if record:
+                    self.display_full_record(record)
+                else:
+                    print("Record not found.")
             elif choice == 2:
                 print("Note: Contact administrator to change password.")
             elif choice == 3:
@@ -192,37 +200,43 @@ class CLI:
     def display_full_record(self, record):
         """Display complete student record"""
         print("\n--- Student Medical Record ---")
-        print(f"Admin No.: {record[0]}")
-        print(f"Name: {record[1]}")
-        print(f"Sex: {record[2]}")
-        print(f"Mother: {record[3]}")
-        print(f"Father: {record[4]}")
-        print(f"Age: {record[5]}")
-        print(f"Class/Section: {record[6]}")
-        print(f"DOB: {record[7]}")
-        print(f"Blood Group: {record[8]}")
-        print(f"Height (cm): {record[9]}")
-        print(f"Weight (kg): {record[10]}")
-        
-        if record[9] and record[10]:
-            bmi, status = calculate_bmi(record[9], record[10])
-            print(f"BMI: {bmi} ({status})")
-        
-        print(f"Allergies: {record[11]}")
+        print(f"Admin No.: {record.admin_no}")
+        print(f"Name: {record.name}")
+        print(f"Sex: {record.sex}")
+        print(f"Mother: {record.mother_name}")
+        print(f"Father: {record.father_name}")
+        print(f"Age: {record.age}")
+        print(f"Class/Section: {record.class_sec}")
+        print(f"DOB: {record.dob}")
+        print(f"Blood Group: {record.blood_group}")
+        print(f"Height (cm): {record.height}")
+        print(f"Weight (kg): {record.weight}")
+        
+        bmi = assess(record.height, record.weight, record.sex, record.dob)
+        if bmi and bmi['reference'] == 'age':
+            print(f"BMI: {bmi['bmi']} ({bmi['category']}, BMI-for-age z {bmi['z']:+.2f}, P{bmi['percentile']})")
+        elif bmi and bmi['reference'] is None:
+            print(f"BMI: {bmi['bmi']} (no BMI-for-age reference configured)")
+        elif bmi:
+            print(f"BMI: {bmi['bmi']} ({bmi['category']})")
+        
+        print(f"Allergies: {record.allergies}")
         print(f"\n--- Vaccinations ---")
-        print(f"Tetanus: {record[12]} ({record[13]})")
-        print(f"Cholera: {record[14]} ({record[15]})")
-        print(f"Typhoid: {record[16]} ({record[17]})")
-        print(f"Hep A: {record[18]} ({record[19]})")
-        print(f"Hep B: {record[20]} ({record[21]})")
-        print(f"Chickenpox: {record[22]} ({record[23]})")
-        print(f"Measles: {record[24]} ({record[25]})")
-        print(f"COVID: {record[26]} ({record[27]})")
-        print(f"Other: {record[28]}")
+        for label, status, date in record.vaccinations:
+            print(f"{label}: {status} ({date})")
+        for vaccine, dose, date in StudentRecords.get_vaccinations(record.admin_no):
+            if vaccine not in VACCINATION_FIELDS:
+                print(f"{vaccine} (dose {dose}): {date}")
+        print(f"Other: {record.other_info}")
     
     def admin_dashboard(self):
         """Admin dashboard"""
-        while True:
+        while self.session_token is not None:
+            if SESSIONS.validate(self.session_token) is None:
+                print("\nSession expired. Please log in again.")
+                self.logout()
+                break
+            
             self.display_header(f"Admin Dashboard - {self.current_username}")
             print("1. View Student Records")
             print("2. Sort Student Records")
@@ -233,7 +247,9 @@ class CLI:
             print("7. Reports & Analytics")
             print("8. View Audit Logs")
             print("9. Change Password")
-            print("10. Logout")
+            print("10. Bulk Operations")
+            print("11. Register Student")
+            print("12. Logout")
             
             choice = self.user_input("Enter choice: ", int)
             
@@ -256,13 +272,22 @@ class CLI:
             elif choice == 9:
                 self.change_password()
             elif choice == 10:
+                self.bulk_menu()
+            elif choice == 11:
+                self.sign_up()
+            elif choice == 12:
                 print("Logging out...")
-                self.current_admin_id = None
-                self.current_username = None
+                self.logout()
                 break
             else:
                 print("Invalid choice.")
     
+    def logout(self):
+        """End the admin session"""
+        self.current_admin_id = None
+        self.current_username = None
+        self.session_token = None
+    
     def view_records(self):
         """View student records"""
         print("\n--- View Student Records ---")
@@ -270,12 +295,15 @@ class CLI:
         print("2. Search by Admin No.")
         print("3. Search by name")
         print("4. Search by class")
+        print("5. Find by approximate name")
         
         choice = self.user_input("Enter choice: ", int)
         
         if choice == 1:
-            records = StudentRecords.get_all_records()
-            self.display_records_table(records)
+            try:
+                self.display_records_table(StudentRecords.iter_records(columns=TABLE_FIELDS))
+            except Exception as e:
+                print(f"Error: {e}")
         elif choice == 2:
             admin_no = self.user_input("Admin No.: ", int)
             record = StudentRecords.get_record(admin_no)
@@ -285,23 +313,51 @@ class CLI:
                 print("Record not found.")
         elif choice == 3:
             name = self.user_input("Student name: ")
-            records = StudentRecords.search_records("name", name)
-            self.display_records_table(records)
+            self.page_records(lambda after: StudentRecords.search_records(
+                "name", name, columns=TABLE_FIELDS, sort_by='name', after=after, limit=PAGE_SIZE
+            ), 'name')
         elif choice == 4:
             class_sec = self.user_input("Class/Section: ")
-            records = StudentRecords.search_records("class", class_sec)
-            self.display_records_table(records)
+            self.page_records(lambda after: StudentRecords.search_records(
+                "class", class_sec, columns=TABLE_FIELDS, sort_by='name', after=after, limit=PAGE_SIZE
+            ), 'name')
+        elif choice == 5:
+            name = self.user_input("Student name (spelling may be approximate): ")
+            matches = StudentRecords.fuzzy_search(name)
+            if not matches:
+                print("No similar names found.")
+            for record, score in matches:
+                print(f"{record.admin_no:<10} {record.name:<25} Age {record.age:<4} Class {record.class_sec:<8} ({score:.0%} match)")
     
     def display_records_table(self, records):
-        """Display records in table format"""
-        if not records:
+        """Display records (any iterable, printed as it is consumed) in table format"""
+        shown = 0
+        for r in records:
+            if shown == 0:
+                print(f"\n{'AdminNo':<10} {'Name':<25} {'Sex':<8} {'Age':<5} {'Class':<10} {'Blood':<7}")
+                print("-" * 70)
+            print(f"{r.admin_no:<10} {r.name:<25} {r.sex:<8} {r.age:<5} {r.class_sec:<10} {r.blood_group:<7}")
+            shown += 1
+        
+        if shown == 0:
             print("No records found.")
-            return
+    
+    def page_records(self, fetch_page, sort_by=None):
+        """Display a listing PAGE_SIZE rows at a time
         
-        print(f"\n{'AdminNo':<10} {'Name':<25} {'Sex':<8} {'Age':<5} {'Class':<10} {'Blood':<7}")
-        print("-" * 70)
-        for r in records:
-            print(f"{r[0]:<10} {r[1]:<25} {r[2]:<8} {r[5]:<5} {r[6]:<10} {r[8]:<7}")
+        `fetch_page(after)` returns the page following the keyset cursor
+        `after` (None for the first page).
+        """
+        after = None
+        while True:
+            records = fetch_page(after)
+            if after is None or records:
+                self.display_records_table(records)
+            if len(records) < PAGE_SIZE:
+                break
+            if self.user_input("Show next page? (Y/N): ").upper() != 'Y':
+                break
+            after = StudentRecords.page_cursor(records[-1], sort_by)
     
     def sort_records(self):
         """Sort records"""
@@ -313,28 +369,14 @@ class CLI:
         
         choice = self.user_input("Enter choice: ", int)
         
-        try:
-            from db import create_connection
-            conn = create_connection()
-            cr = conn.cursor()
-            
-            if choice == 1:
-                cr.execute("SELECT * FROM records ORDER BY Sname ASC")
-            elif choice == 2:
-                cr.execute("SELECT * FROM records ORDER BY Age ASC")
-            elif choice == 3:
-                cr.execute("SELECT * FROM records ORDER BY ClassSec ASC")
-            elif choice == 4:
-                cr.execute("SELECT * FROM records ORDER BY BloodGroup ASC")
-            else:
-                return
-            
-            records = cr.fetchall()
-            self.display_records_table(records)
-            cr.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error: {e}")
+        sort_keys = {1: 'name', 2: 'age', 3: 'class', 4: 'blood_group'}
+        if choice not in sort_keys:
+            return
+        
+        sort_by = sort_keys[choice]
+        self.page_records(lambda after: StudentRecords.get_all_records(
+            sort_by=sort_by, columns=TABLE_FIELDS, after=after, limit=PAGE_SIZE
+        ), sort_by)
     
     def update_record(self):
         """Update student record"""
@@ -354,39 +396,46 @@ class CLI:
         print("3. Class/Section")
         print("4. Allergies")
         print("5. Vaccination")
+        print("6. Record vaccine dose")
         
         choice = self.user_input("Enter choice: ", int)
         
         try:
             if choice == 1:
                 height = self.user_input("New height (cm): ", float)
-                StudentRecords.update_record(admin_no, self.current_admin_id, height=height)
-                print("✓ Updated.")
+                success, message = StudentRecords.update_record(admin_no, self.session_token, height=height)
+                print(f"{'✓' if success else '✗'} {message}")
             elif choice == 2:
                 weight = self.user_input("New weight (kg): ", float)
-                StudentRecords.update_record(admin_no, self.current_admin_id, weight=weight)
-                print("✓ Updated.")
+                success, message = StudentRecords.update_record(admin_no, self.session_token, weight=weight)
+                print(f"{'✓' if success else '✗'} {message}")
             elif choice == 3:
                 class_sec = self.user_input("New class/section: ")
-                StudentRecords.update_record(admin_no, self.current_admin_id, class_sec=class_sec)
-                print("✓ Updated.")
+                success, message = StudentRecords.update_record(admin_no, self.session_token, class_sec=class_sec)
+                print(f"{'✓' if success else '✗'} {message}")
             elif choice == 4:
                 allergies = self.user_input("New allergies: ")
-                StudentRecords.update_record(admin_no, self.current_admin_id, allergies=allergies)
-                print("✓ Updated.")
+                success, message = StudentRecords.update_record(admin_no, self.session_token, allergies=allergies)
+                print(f"{'✓' if success else '✗'} {message}")
             elif choice == 5:
                 print("Select vaccination:")
-                vaccines = ['Tetanus', 'Cholera', 'Typhoid', 'HepA', 'HepB', 'ChickenPox', 'Measles', 'COVID']
-                for i, v in enumerate(vaccines, 1):
-                    print(f"{i}. {v}")
+                for i, vaccine in enumerate(VACCINATION_FIELDS, 1):
+                    print(f"{i}. {VACCINE_LABELS[vaccine]}")
                 
                 vacc_choice = self.user_input("Enter choice: ", int)
-                if 1 <= vacc_choice <= len(vaccines):
-                    vacc = vaccines[vacc_choice - 1].lower()
+                if 1 <= vacc_choice <= len(VACCINATION_FIELDS):
+                    vacc = VACCINATION_FIELDS[vacc_choice - 1]
                     status = self.user_input("Status (Y/N): ").upper()
                     date = self.user_input("Date [YYYY-MM-DD] (or blank): ", allow_empty=True)
-                    StudentRecords.update_record(admin_no, self.current_admin_id, **{vacc: status, f"{vacc}_date": date})
-                    print("✓ Updated.")
+                    success, message = StudentRecords.update_record(admin_no, self.session_token, **{vacc: status, f"{vacc}_date": date or None})
+                    print(f"{'✓' if success else '✗'} {message}")
+            elif choice == 6:
+                vaccine = self.user_input("Vaccine name: ")
+                date = self.user_input("Date [YYYY-MM-DD] (or blank): ", allow_empty=True)
+                success, message = StudentRecords.add_vaccination(
+                    admin_no, self.session_token, vaccine, date or None
+                )
+                print(f"{'✓' if success else '✗'} {message}")
         except Exception as e:
             print(f"Error: {e}")
     
@@ -400,46 +449,137 @@ class CLI:
             print("Record not found.")
             return
         
-        print(f"About to delete: {record[1]}")
+        print(f"About to delete: {record.name}")
         confirm = self.user_input("Confirm? (Y/N): ").upper()
         
         if confirm == 'Y':
-            StudentRecords.delete_record(admin_no, self.current_admin_id)
-            print("✓ Deleted.")
+            success, message = StudentRecords.delete_record(admin_no, self.session_token)
+            print(f"{'✓' if success else '✗'} {message}")
+    
+    def bulk_menu(self):
+        """Bulk operations menu"""
+        print("\n--- Bulk Operations ---")
+        print("1. Import students (CSV/NDJSON)")
+        print("2. Measurement day update (CSV)")
+        
+        choice = self.user_input("Enter choice: ", int)
+        
+        if choice == 1:
+            self.bulk_import()
+        elif choice == 2:
+            self.bulk_measurements()
+    
+    def write_error_report(self, prefix, header, errors):
+        """Print the first errors and save all of them to a CSV file"""
+        filename = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(errors)
+        for position, admin_no, message in errors[:10]:
+            print(f"  {header[0]} {position} (AdminNo {admin_no}): {message}")
+        if len(errors) > 10:
+            print(f"  ... {len(errors) - 10} more")
+        print(f"Full error report: {filename}")
+    
+    def bulk_measurements(self):
+        """Apply a measurement-day CSV of admin_no, height, weight"""
+        print("\n--- Measurement Day Update ---")
+        print("Columns: admin_no, height, weight (leave a value blank to keep it)")
+        path = self.user_input("CSV file path: ")
+        
+        try:
+            with open(path, 'r', newline='') as f:
+                reader = csv.DictReader(f)
+                rows = [(row.get('admin_no'), row.get('height'), row.get('weight')) for row in reader]
+        except OSError as e:
+            print(f"✗ {e}")
+            return
+        
+        success, result = StudentRecords.bulk_update_measurements(rows, self.session_token)
+        if not success:
+            print(f"✗ {result}")
+            return
+        
+        print(f"\n✓ Updated: {result['updated']}  Failed: {result['failed']}")
+        if result['errors']:
+            # Row positions are 1-based data rows; the header is line 1
+            errors = [(position + 1, admin_no, message) for position, admin_no, message in result['errors']]
+            self.write_error_report("measurement_errors", ['Line', 'AdminNo', 'Error'], errors)
+    
+    def bulk_import(self):
+        """Import students from a CSV or NDJSON file"""
+        print("\n--- Bulk Import Students ---")
+        print("Columns: admin_no, name, sex, age, class_sec, dob, blood_group, and optionally")
+        print("mother_name, father_name, height, weight, allergies, other_info,")
+        print("<vaccine> and <vaccine>_date for tetanus, cholera, typhoid, hep_a, hep_b,")
+        print("chicken_pox, measles, covid")
+        path = self.user_input("File path (.csv or .ndjson): ")
+        
+        success, result = StudentRecords.bulk_import(path, self.session_token)
+        if not success:
+            print(f"✗ {result}")
+            return
+        
+        print(f"\n✓ Imported: {result['imported']}  Failed: {result['failed']}")
+        if result['errors']:
+            self.write_error_report("import_errors", ['Line', 'AdminNo', 'Error'], result['errors'])
     
     def vaccination_alerts(self):
         """Show vaccination alerts"""
         print("\n--- Vaccination Alerts ---")
         print("1. Due for booster")
         print("2. Missing critical vaccinations")
+        print("3. Missing a specific vaccine")
         
         choice = self.user_input("Enter choice: ", int)
+        
+        if choice == 1:
+            vaccine = self.user_input("Vaccine [tetanus]: ", allow_empty=True) or 'tetanus'
+            due = StudentRecords.students_due_for_booster(vaccine)
+            if not due:
+                print("No students are currently due for a booster.")
+            for admin_no, name, class_sec, last_date in due:
+                print(f"AdminNo: {admin_no}, Name: {name}, Class: {class_sec}, Last Dose: {last_date}")
+        elif choice == 2:
+            missing = {}
+            for vaccine in CRITICAL_VACCINES:
+                for record in StudentRecords.students_missing_vaccine(vaccine):
+                    missing.setdefault((record.admin_no, record.name), []).append(VACCINE_LABELS[vaccine])
+            if not missing:
+                print("All students have the critical vaccinations on record.")
+            for (admin_no, name), vaccines in sorted(missing.items()):
+                print(f"AdminNo: {admin_no}, Name: {name}, Missing: {', '.join(vaccines)}")
+        elif choice == 3:
+            vaccine = self.user_input("Vaccine name: ")
+            records = StudentRecords.students_missing_vaccine(vaccine)
+            if not records:
+                print("No students are missing this vaccine.")
+            for record in records:
+                print(f"AdminNo: {record.admin_no}, Name: {record.name}, Class: {record.class_sec}")
     
     def search_allergy(self):
         """Search by allergy"""
         print("\n--- Search by Allergy ---")
+        print("Enter one or more allergens; end a word with * to match a prefix.")
         allergy = self.user_input("Allergy to search: ")
-        
-        try:
-            from db import create_connection
-            conn = create_connection()
-            cr = conn.cursor()
-            cr.execute("SELECT AdminNo, Sname, Age, ClassSec, Allergies FROM records WHERE Allergies LIKE %s", (f"%{allergy}%",))
-            records = cr.fetchall()
-            cr.close()
-            conn.close()
-            
-            if records:
-                print(f"\n--- Students with {allergy} ---")
-                for r in records:
-                    print(f"AdminNo: {r[0]}, Name: {r[1]}, Age: {r[2]}, Class: {r[3]}, Allergies: {r[4]}")
-            else:
-                print("No students found.")
-        except Exception as e:
-            print(f"Error: {e}")
+        match = 'any'
+        if len(allergy.split()) > 1:
+            both = self.user_input("Students with (1) any or (2) all of these? ", int)
+            match = 'all' if both == 2 else 'any'
+        
+        records = StudentRecords.search_allergies(allergy, match=match)
+        if records:
+            print(f"\n--- Students with {allergy} ---")
+            for r in records:
+                print(f"AdminNo: {r.admin_no}, Name: {r.name}, Age: {r.age}, Class: {r.class_sec}, Allergies: {r.allergies}")
+        else:
+            print("No students found.")
     
     def reports_menu(self):
         """Reports menu"""
+        from reports import ReportsAnalytics
+        
         print("\n--- Reports & Analytics ---")
         print("1. Blood group distribution")
         print("2. BMI distribution")
@@ -448,6 +588,10 @@ class CLI:
         print("5. Age statistics")
         print("6. Missing records")
         print("7. Export report")
+        print("8. Full dashboard")
+        print("9. BMI analytics")
+        print("10. BMI-for-age screening")
+        print("11. Cross-tab (slice and drill down)")
         
         choice = self.user_input("Enter choice: ", int)
         
@@ -498,9 +642,82 @@ class CLI:
         
         elif choice == 7:
             report_type = input("Report type (comprehensive/health): ")
-            filename = ReportsAnalytics.export_report_csv(report_type)
+            compression = input("Compression (gzip/zstd/none) [gzip]: ").strip().lower() or 'gzip'
+            progress = Progress(report=lambda rows, seconds, rate: print(f"  {rows} rows ({rate:.0f} rows/s)"))
+            filename = ReportsAnalytics.export_report_csv(report_type, compression=compression, progress=progress)
             if filename:
                 print(f"✓ Exported: {filename}")
+            else:
+                print("Export failed.")
+        
+        elif choice == 8:
+            data = ReportsAnalytics.dashboard()
+            if not data:
+                print("Dashboard unavailable.")
+                return
+            age = data['age']
+            print("\n--- Dashboard ---")
+            print(f"Students: {data['total']}  Age: {age['min']}-{age['max']} (avg {age['avg']})")
+            print("Blood groups: " + ', '.join(f"{group} {count}" for group, count in data['blood_groups']))
+            print("Classes: " + ', '.join(f"{class_sec} {count}" for class_sec, count in data['classes']))
+            print("BMI (adult cut-offs): " + ', '.join(f"{status} {count}" for status, count in data['bmi'].items()))
+            print("Vaccination: " + ', '.join(f"{vacc} {coverage}%" for vacc, coverage in data['vaccination_coverage'].items()))
+            missing = data['missing']
+            print(f"Incomplete records: {missing['records']} (height {missing['height']}, "
+                  f"weight {missing['weight']}, allergies {missing['allergies']})")
+        
+        elif choice == 9:
+            data = ReportsAnalytics.bmi_analytics()
+            if not data:
+                print("BMI analytics unavailable.")
+                return
+            print("\n--- BMI Analytics ---")
+            print(f"Measured: {data['measured']} of {data['students']} students")
+            print("Adult cut-offs: " + ', '.join(f"{status} {count}" for status, count in data['adult_bmi'].items()))
+            print("Percentiles: " + ', '.join(f"P{q} {value}" for q, value in data['bmi_percentiles'].items()))
+            print(f"{'Class':<10} {'BMI':<8} {'Height':<8} {'Weight':<8}")
+            print("-" * 34)
+            for class_sec, means in data['class_means'].items():
+                print(f"{class_sec:<10} {means.get('bmi', '-'):<8} {means.get('height', '-'):<8} {means.get('weight', '-'):<8}")
+        
+        elif choice == 10:
+            data = ReportsAnalytics.growth_screening()
+            if not data:
+                print("Screening unavailable (is GROWTH_REFERENCE_PATH set to an LMS table?).")
+                return
+            print("\n--- BMI-for-age Screening ---")
+            print(f"Assessed: {data['assessed']} students")
+            print(', '.join(f"{category}: {count}" for category, count in data['categories'].items()))
+            print(f"\nAt risk (|z| >= 2): {len(data['at_risk'])}")
+            print(f"{'Admin No':<10} {'Class':<8} {'z':<8} {'Percentile':<10}")
+            print("-" * 36)
+            for admin_no, class_sec, z, pct in data['at_risk'][:PAGE_SIZE]:
+                print(f"{admin_no:<10} {class_sec:<8} {z:<+8.2f} {pct:<10}")
+        
+        elif choice == 11:
+            from reports import HealthCube
+            print(f"Dimensions: {', '.join(HealthCube.DIMENSIONS)}")
+            by = [name.strip() for name in input("Group by (comma-separated, blank for total): ").split(',') if name.strip()]
+            filters = {}
+            for condition in input("Filters, e.g. class_sec=9A, sex=F, bmi=Overweight: ").split(','):
+                if '=' in condition:
+                    name, value = (part.strip() for part in condition.split('=', 1))
+                    filters.setdefault(name, []).append(value)
+            unknown = [name for name in by + list(filters) if name not in HealthCube.DIMENSIONS]
+            if unknown:
+                print(f"Unknown dimension: {', '.join(unknown)}")
+                return
+            data = ReportsAnalytics.cross_tab(by, **filters)
+            if not data:
+                print("No students match.")
+                return
+            print("\n--- Cross-tab ---")
+            label = ' / '.join(by) or 'All'
+            print(f"{label:<30} {'Students':<10} {'Age':<8} {'Height':<8} {'Weight':<8}")
+            print("-" * 66)
+            for group, measures in data.items():
+                print(f"{' / '.join(group) or 'All':<30} {measures['students']:<10} {measures['mean_age'] or '-':<8} "
+                      f"{measures['mean_height'] or '-':<8} {measures['mean_weight'] or '-':<8}")
     
     def view_audit_logs(self):
         """View audit logs"""
@@ -529,25 +746,26 @@ class CLI:
         
         success, message = AdminAuth.change_password(self.current_admin_id, old_pass, new_pass)
         print(message)
+        if success:
+            # Changing the password revokes every session, this one included
+            print("Please log in again with your new password.")
+            self.logout()
     
     def main_menu(self):
         """Main menu"""
         while True:
             self.display_header("Medical Record Management System")
-            print("1. Student Registration")
-            print("2. Student Login")
-            print("3. Admin Login")
-            print("4. Exit")
+            print("1. Student Login")
+            print("2. Admin Login")
+            print("3. Exit")
             
             choice = self.user_input("Enter choice: ", int)
             
             if choice == 1:
-                self.sign_up()
-            elif choice == 2:
                 self.student_login()
-            elif choice == 3:
+            elif choice == 2:
                 self.admin_login()
-            elif choice == 4:
+            elif choice == 3:
                 print("Goodbye!")
                 sys.exit(0)
             else:
@@ -7,6 +7,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# BMI categories in order, shared by the adult and the BMI-for-age cut-offs
+BMI_CATEGORIES = ('Underweight', 'Normal', 'Overweight', 'Obese')
+
 def calculate_bmi(height_cm, weight_kg):
     """Calculate BMI and return status"""
     if not height_cm or not weight_kg or height_cm <= 0 or weight_kg <= 0:
@@ -45,10 +48,54 @@ def validate_sex(sex):
     """Validate sex field"""
     return sex.upper() in ['M', 'F', 'OTHER']
 
+def normalize_sex(sex):
+    """Return the canonical stored form of a valid sex value (M/F/Other)"""
+    return {'M': 'M', 'F': 'F', 'OTHER': 'Other'}[sex.upper()]
+
+def normalize_vaccine(name):
+    """Return a vaccine name as a lowercase key ('Hep B' -> 'hep_b'), or None if invalid"""
+    key = re.sub(r'[\s\-]+', '_', (name or '').strip().lower())
+    if re.fullmatch(r'[a-z][a-z0-9_]{0,19}', key):
+        return key
+    return None
+
+# Words in free-text allergy notes that are not allergens
+ALLERGY_STOPWORDS = {
+    'and', 'or', 'to', 'of', 'the', 'with', 'no', 'none', 'nil', 'na', 'known',
+    'allergy', 'allergies', 'allergic', 'mild', 'severe'
+}
+
+def normalize_allergy_term(word):
+    """Lowercase and singularize one allergy word ('Peanuts' -> 'peanut')"""
+    word = word.lower()
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('es') and word[:-2].endswith(('s', 'x', 'ch', 'sh')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def tokenize_allergies(text):
+    """Split a free-text allergy note into sorted, normalized search terms"""
+    terms = set()
+    for word in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        term = normalize_allergy_term(word)
+        if len(term) > 1 and term not in ALLERGY_STOPWORDS:
+            terms.add(term[:40])
+    return sorted(terms)
+
 def validate_age(age):
     """Validate age is reasonable"""
     return 5 <= age <= 25
 
+def age_in_months(dob, on=None):
+    """Completed months of age on `on` (default today); dob is a date or 'YYYY-MM-DD'"""
+    if isinstance(dob, str):
+        dob = datetime.strptime(dob, '%Y-%m-%d').date()
+    on = on or datetime.now().date()
+    return (on.year - dob.year) * 12 + on.month - dob.month - (on.day < dob.day)
+
 def validate_vaccination_status(status):
     """Validate vaccination status"""
     return status.upper() in ['Y', 'N']
@@ -85,19 +132,11 @@ def is_due_for_booster(last_date_string, years_between=5):
         return False
 
 def hash_password(password):
-    """Hash password using bcrypt (requires bcrypt package)"""
-    try:
-        import bcrypt
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
-    except ImportError:
-        logger.warning("bcrypt not installed, using plain password (NOT SECURE)")
-        return password
+    """Hash password with bcrypt on the shared worker pool (see security.PasswordHasher)"""
+    from security import get_password_hasher
+    return get_password_hasher().hash(password)
 
 def verify_password(password, hashed):
     """Verify password against hash"""
-    try:
-        import bcrypt
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-    except ImportError:
-        return password == hashed
+    from security import get_password_hasher
+    return get_password_hasher().verify(password, hashed)